@@ -78,11 +78,11 @@ def get_current_collection_value(collection_id):
         conn2 = pg_pool.getconn()
         cur2 = conn2.cursor()
         cur2.execute("""
-            SELECT SUM(COALESCE((cp.prices->>'usd')::numeric, 0)) AS total_value
+            SELECT SUM(COALESCE(cp.price_usd, 0)) AS total_value
             FROM collection_cards cc
             JOIN (
                 SELECT DISTINCT ON (collection_card_id)
-                       collection_card_id, prices
+                       collection_card_id, price_usd
                 FROM collection_price_snapshots
                 ORDER BY collection_card_id, snapshot_date DESC
             ) cp ON cp.collection_card_id = cc.id
@@ -223,7 +223,7 @@ def get_collection_value_history(collection_id):
         if cutoff:
             cur2.execute("""
                 SELECT snapshot_date,
-                       SUM(COALESCE((prices->>'usd')::numeric,0)) AS total_value
+                       SUM(COALESCE(price_usd, 0)) AS total_value
                 FROM collection_price_snapshots cps
                 JOIN collection_cards cc ON cps.collection_card_id = cc.id
                 WHERE cc.collection_id = %s
@@ -234,7 +234,7 @@ def get_collection_value_history(collection_id):
         else:
             cur2.execute("""
                 SELECT snapshot_date,
-                       SUM(COALESCE((prices->>'usd')::numeric,0)) AS total_value
+                       SUM(COALESCE(price_usd, 0)) AS total_value
                 FROM collection_price_snapshots cps
                 JOIN collection_cards cc ON cps.collection_card_id = cc.id
                 WHERE cc.collection_id = %s
@@ -1,23 +1,26 @@
 from flask import Flask, jsonify
 from flask_cors import CORS
+from flask_jwt_extended import JWTManager
 from flasgger import Swagger
 from dotenv import load_dotenv
-from logging.handlers import TimedRotatingFileHandler
-from apscheduler.schedulers.background import BackgroundScheduler
 import logging
-import os
-import sys
-import redis
+from utils.logging_setup import configure_logging
 from utils.resource_manager import load_resources
+from utils.shadow_eval import load_shadow_bundle
 from utils.scryfall_bootstrap import ensure_scryfall_json_present
-from config import LOG_FILE_PATH, LOG_LEVEL
+from utils.warmup import run_warmup, readiness_report
+from config import (
+    LOG_FILE_PATH, LOG_LEVEL, JWT_SECRET_KEY, JWT_TOKEN_LOCATION, JWT_IDENTITY_CLAIM,
+    JWT_ACCESS_COOKIE_NAME, JWT_COOKIE_CSRF_PROTECT,
+)
 from routes.infer_routes import infer_bp
-from scryfall_update.update import main as scryfall_update_main
-from descriptor_update.descriptor_update import run_descriptor_update_pipeline
+from routes.metrics_routes import metrics_bp
+from routes.mobile_infer_routes import mobile_infer_bp
 from db.init_tables import (
     init_auth_tables,
     init_security_tables,
     init_collection_tables,
+    init_card_columns,
     init_mobile_scan_tables,
     init_landing_cards_table,
     build_tag_cache,
@@ -27,41 +30,36 @@ from db.init_tables import (
 load_dotenv()
 
 # ─── Logging setup ─────────────────────────────────────────────────────
-handlers = []
-
-if LOG_FILE_PATH:
-    os.makedirs(os.path.dirname(LOG_FILE_PATH), exist_ok=True)
-    file_handler = TimedRotatingFileHandler(
-        LOG_FILE_PATH, when="midnight", interval=1, backupCount=0, utc=True
-    )
-    file_handler.suffix = "%Y-%m-%d"
-    file_handler.setFormatter(logging.Formatter(
-        "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
-    ))
-    handlers.append(file_handler)
-
-stream_handler = logging.StreamHandler(sys.stdout)
-stream_handler.setFormatter(logging.Formatter(
-    "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
-))
-handlers.append(stream_handler)
-
-logging.basicConfig(
-    level=LOG_LEVEL,
-    handlers=handlers,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    force=True
-)
+configure_logging(LOG_FILE_PATH, LOG_LEVEL)
 
 logger = logging.getLogger(__name__)
 logger.info("inference-service logging initialized.")
 
+# ─── Model Resources ───────────────────────────────────────────────────
+# Loaded once per process at import. Under gunicorn (see gunicorn.conf.py) this
+# runs in the master before workers are forked, so they share the loaded model.
+load_resources()
+load_shadow_bundle()
+
 # ─── Flask App Setup ────────────────────────────────────────────────────
 app = Flask(__name__)
 CORS(app, supports_credentials=True)
 
+# ─── JWT (mobile scan sessions) ────────────────────────────────────────
+# Verifies the access tokens issued by the core backend.
+app.config.update(
+    JWT_SECRET_KEY=JWT_SECRET_KEY,
+    JWT_TOKEN_LOCATION=JWT_TOKEN_LOCATION,
+    JWT_IDENTITY_CLAIM=JWT_IDENTITY_CLAIM,
+    JWT_ACCESS_COOKIE_NAME=JWT_ACCESS_COOKIE_NAME,
+    JWT_COOKIE_CSRF_PROTECT=JWT_COOKIE_CSRF_PROTECT,
+)
+JWTManager(app)
+
 # ─── Blueprint Registration ────────────────────────────────────────────
 app.register_blueprint(infer_bp)
+app.register_blueprint(metrics_bp)
+app.register_blueprint(mobile_infer_bp)
 
 # ─── Swagger Documentation ─────────────────────────────────────────────
 swagger = Swagger(app, template={
@@ -82,25 +80,6 @@ swagger = Swagger(app, template={
     }
 })
 
-# ─── Safe Scheduled Model Update ───────────────────────────────────────
-def safe_model_update():
-    r = redis.Redis(host=os.getenv("REDIS_HOST", "mtg-redis"), port=6379)
-    lock = r.lock("model_update_lock", timeout=1800)
-    if lock.acquire(blocking=False):
-        try:
-            logger.info("[scheduler] Acquired lock — running Scryfall + descriptor update.")
-            scryfall_update_main()
-            run_descriptor_update_pipeline()
-            logger.info("[scheduler] Update complete.")
-        finally:
-            lock.release()
-    else:
-        logger.info("[scheduler] Skipping update — another worker is running.")
-
-scheduler = BackgroundScheduler()
-scheduler.add_job(safe_model_update, trigger="cron", hour=2)
-scheduler.start()
-
 # ─── Health Check ──────────────────────────────────────────────────────
 @app.route("/", methods=["GET"])
 def root_health_check():
@@ -110,17 +89,26 @@ def root_health_check():
         "docs_url": "/apidocs"
     }), 200
 
+# ─── Readiness Check ───────────────────────────────────────────────────
+# Distinct from "/": only 200 once this process has loaded the model and
+# finished warmup, so the load balancer routes to warm workers only.
+@app.route("/ready", methods=["GET"])
+def readiness_check():
+    report = readiness_report()
+    return jsonify(report), 200 if report["ready"] else 503
+
 # ─── Main Entrypoint ───────────────────────────────────────────────────
 if __name__ == "__main__":
     logger.info("inference-service starting...")
     
     ensure_scryfall_json_present()
-    load_resources()
     init_auth_tables()
     init_security_tables()
     init_collection_tables()
+    init_card_columns()
     init_mobile_scan_tables()
     init_landing_cards_table()
     build_tag_cache()
+    run_warmup()
 
     app.run(debug=True, threaded=True, host="0.0.0.0", port=5001)
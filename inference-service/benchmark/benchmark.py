@@ -0,0 +1,293 @@
+# benchmark/benchmark.py
+# Offline accuracy / latency benchmark for the scan pipeline.
+#
+# Replays a labelled corpus of ROI images (plus synthetic perturbations) through
+# find_closest_card_ransac against a chosen bundle and writes a JSON report that
+# can be diffed between builds:
+#
+#   python -m benchmark.benchmark --bundle resources/run --corpus resources/benchmark \
+#       --threads 1,2,4 --out benchmark_report.json
+#
+# Corpus layout: either <corpus>/<card_id>/<any>.jpg, or flat files named
+# <card_id>.jpg / <card_id>__<suffix>.jpg. A further directory level,
+# <corpus>/<group>/<card_id>/<any>.jpg (e.g. one group per set), adds per-group
+# accuracy to the report.
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import resource
+import concurrent.futures
+from datetime import datetime, timezone
+
+import cv2
+import faiss
+import numpy as np
+
+from utils.bundle_manifest import read_manifest
+from utils.image_decode import decode_roi_image
+from utils.sift_features import find_closest_card_ransac, load_faiss_index_for_testing
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+PERTURBATIONS = ("none", "blur", "rotation", "glare", "perspective")
+LATENCY_STAGES = ("decode", "sift", "faiss_search", "candidate_load", "knn_match", "ransac", "match", "total")
+
+# ─── Corpus ────────────────────────────────────────────────────────────
+
+def load_corpus(corpus_dir):
+    """Returns [(relative_path, card_id, group, raw_bytes)] in a stable order."""
+    samples = []
+    for root, _, files in os.walk(corpus_dir):
+        parts = [p for p in os.path.relpath(root, corpus_dir).split(os.sep) if p != "."]
+        for fname in sorted(files):
+            if not fname.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.join(root, fname)
+            if parts:
+                card_id = parts[-1]
+            else:
+                card_id = os.path.splitext(fname)[0].split("__")[0]
+            group = parts[0] if len(parts) >= 2 else None
+            with open(path, 'rb') as f:
+                samples.append((os.path.relpath(path, corpus_dir), card_id, group, f.read()))
+    samples.sort(key=lambda s: s[0])
+    return samples
+
+# ─── Perturbations ─────────────────────────────────────────────────────
+
+def perturb(image, kind, rng):
+    h, w = image.shape[:2]
+    if kind == "none":
+        return image
+    if kind == "blur":
+        return cv2.GaussianBlur(image, (7, 7), 0)
+    if kind == "rotation":
+        angle = float(rng.uniform(-12, 12))
+        M = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 0.92)
+        return cv2.warpAffine(image, M, (w, h), borderMode=cv2.BORDER_REPLICATE)
+    if kind == "glare":
+        cx, cy = int(rng.uniform(0.2, 0.8) * w), int(rng.uniform(0.2, 0.8) * h)
+        yy, xx = np.mgrid[0:h, 0:w]
+        radius = 0.3 * min(h, w)
+        glare = np.exp(-((xx - cx) ** 2 + (yy - cy) ** 2) / (2 * radius ** 2)) * 160
+        return np.clip(image.astype(np.float32) + glare[..., None], 0, 255).astype(np.uint8)
+    if kind == "perspective":
+        jitter = 0.08 * min(h, w)
+        src = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+        dst = src + rng.uniform(-jitter, jitter, src.shape).astype(np.float32)
+        M = cv2.getPerspectiveTransform(src, dst)
+        return cv2.warpPerspective(image, M, (w, h), borderMode=cv2.BORDER_REPLICATE)
+    raise ValueError(f"Unknown perturbation: {kind}")
+
+def build_cases(samples, perturbations, seed=0):
+    """Expands the corpus into JPEG-encoded cases, one per (sample, perturbation)."""
+    cases = []
+    for i, (rel_path, card_id, group, raw) in enumerate(samples):
+        image = cv2.imdecode(np.frombuffer(raw, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            logger.warning(f"⚠️ Skipping undecodable corpus image {rel_path}")
+            continue
+        for kind in perturbations:
+            if kind == "none":
+                payload = raw
+            else:
+                rng = np.random.default_rng(seed + i)
+                ok, buf = cv2.imencode(".jpg", perturb(image, kind, rng), [cv2.IMWRITE_JPEG_QUALITY, 90])
+                if not ok:
+                    continue
+                payload = buf.tobytes()
+            cases.append({"file": rel_path, "card_id": card_id, "group": group,
+                          "perturbation": kind, "payload": payload})
+    return cases
+
+# ─── Evaluation ────────────────────────────────────────────────────────
+
+def run_case(case):
+    start = time.perf_counter()
+    image, decode_info = decode_roi_image(case["payload"])
+    if image is None:
+        return {"file": case["file"], "group": case["group"], "perturbation": case["perturbation"],
+                "expected": case["card_id"], "predicted": None, "top3": [],
+                "timings": {"decode": decode_info["decode_time"]}}
+
+    match_start = time.perf_counter()
+    best_candidate, _, _, _, debug_info = find_closest_card_ransac(image, k=3)
+    match_time = time.perf_counter() - match_start
+
+    candidate_debug = debug_info.get("candidate_debug", {})
+    ranked = sorted(candidate_debug.items(), key=lambda x: -x[1]["total_inliers"])
+    timings = {
+        "decode": decode_info["decode_time"],
+        "sift": debug_info.get("sift_time", 0.0),
+        "faiss_search": debug_info.get("faiss_search_time", 0.0),
+        "candidate_load": sum(d.get("load_time", 0.0) for d in candidate_debug.values()),
+        "knn_match": sum(d.get("bf_time_total", 0.0) for d in candidate_debug.values()),
+        "ransac": sum(d.get("ransac_time_total", 0.0) for d in candidate_debug.values()),
+        "match": match_time,
+        "total": time.perf_counter() - start,
+    }
+    return {
+        "file": case["file"],
+        "group": case["group"],
+        "perturbation": case["perturbation"],
+        "expected": case["card_id"],
+        "predicted": best_candidate,
+        "top3": [cand for cand, _ in ranked[:3]],
+        "best_inliers": debug_info.get("best_inliers", 0),
+        "cascade_tier": debug_info.get("cascade_tier"),
+        "timings": timings,
+    }
+
+def summarize_accuracy(results):
+    def score(rows):
+        n = len(rows)
+        top1 = sum(r["predicted"] == r["expected"] for r in rows)
+        top3 = sum(r["expected"] in r["top3"] for r in rows)
+        return {"n": n, "top1": round(top1 / n, 4) if n else None, "top3": round(top3 / n, 4) if n else None}
+
+    by_perturbation = {}
+    by_group = {}
+    for r in results:
+        by_perturbation.setdefault(r["perturbation"], []).append(r)
+        if r.get("group"):
+            by_group.setdefault(r["group"], []).append(r)
+    return {
+        "overall": score(results),
+        "by_perturbation": {kind: score(rows) for kind, rows in sorted(by_perturbation.items())},
+        "by_group": {group: score(rows) for group, rows in sorted(by_group.items())},
+    }
+
+def summarize_latency(results):
+    summary = {}
+    for stage in LATENCY_STAGES:
+        values = np.array([r["timings"][stage] for r in results if stage in r["timings"]], dtype=np.float64)
+        if not len(values):
+            continue
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        summary[stage] = {
+            "mean_ms": round(float(values.mean()) * 1000, 3),
+            "p50_ms": round(float(p50) * 1000, 3),
+            "p95_ms": round(float(p95) * 1000, 3),
+            "p99_ms": round(float(p99) * 1000, 3),
+        }
+    return summary
+
+def measure_throughput(cases, thread_counts):
+    throughput = []
+    for threads in thread_counts:
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(run_case, cases))
+        elapsed = time.perf_counter() - start
+        throughput.append({
+            "threads": threads,
+            "rois": len(cases),
+            "seconds": round(elapsed, 3),
+            "rois_per_second": round(len(cases) / elapsed, 2) if elapsed else None,
+        })
+        logger.info(f"⏱️ {threads} thread(s): {len(cases)} ROIs in {elapsed:.2f}s")
+    return throughput
+
+def peak_rss_bytes():
+    # ru_maxrss is KiB on Linux, bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def load_bundle(bundle_dir):
+    load_faiss_index_for_testing(
+        os.path.join(bundle_dir, "faiss_ivf.index"),
+        os.path.join(bundle_dir, "candidate_features.h5"),
+        os.path.join(bundle_dir, "id_map.json"),
+    )
+
+def run_benchmark(bundle_dir, corpus_dir, perturbations=PERTURBATIONS, thread_counts=(1,), seed=0):
+    """
+    Loads ``bundle_dir`` as the active model and benchmarks it on ``corpus_dir``.
+    Returns the report dict; ``write_report`` serialises it.
+    """
+    samples = load_corpus(corpus_dir)
+    if not samples:
+        raise ValueError(f"No corpus images found in {corpus_dir}")
+    cases = build_cases(samples, perturbations, seed=seed)
+
+    load_start = time.perf_counter()
+    load_bundle(bundle_dir)
+    load_time = time.perf_counter() - load_start
+
+    # Warm the index and caches so the first cases don't skew the percentiles.
+    run_case(cases[0])
+
+    results = [run_case(case) for case in cases]
+    misses = [
+        {k: r.get(k) for k in ("file", "group", "perturbation", "expected", "predicted", "best_inliers")}
+        for r in results if r["predicted"] != r["expected"]
+    ]
+
+    report = {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "bundle": {
+            "path": os.path.abspath(bundle_dir),
+            "bundle_id": (read_manifest(bundle_dir) or {}).get("bundle_id"),
+            "load_seconds": round(load_time, 3),
+        },
+        "corpus": {
+            "path": os.path.abspath(corpus_dir),
+            "images": len(samples),
+            "cases": len(cases),
+            "perturbations": list(perturbations),
+            "seed": seed,
+        },
+        "accuracy": summarize_accuracy(results),
+        "latency": summarize_latency(results),
+        "throughput": measure_throughput(cases, thread_counts),
+        "peak_rss_bytes": peak_rss_bytes(),
+        "misses": misses,
+        "environment": {
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "faiss": getattr(faiss, "__version__", None),
+            "cpu_count": os.cpu_count(),
+            "platform": platform.platform(),
+        },
+    }
+    return report
+
+def write_report(report, out_path):
+    with open(out_path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    logger.info(f"📝 Benchmark report written to {out_path}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scan pipeline accuracy / latency benchmark")
+    parser.add_argument("--bundle", default="resources/run", help="Directory with faiss_ivf.index, candidate_features.h5, id_map.json")
+    parser.add_argument("--corpus", default="resources/benchmark", help="Labelled ROI corpus directory")
+    parser.add_argument("--perturbations", default=",".join(PERTURBATIONS),
+                        help=f"Comma-separated subset of: {', '.join(PERTURBATIONS)}")
+    parser.add_argument("--threads", default="1", help="Comma-separated thread counts for the throughput runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmark_report.json")
+    args = parser.parse_args(argv)
+
+    perturbations = tuple(p.strip() for p in args.perturbations.split(",") if p.strip())
+    unknown = set(perturbations) - set(PERTURBATIONS)
+    if unknown:
+        parser.error(f"Unknown perturbations: {', '.join(sorted(unknown))}")
+    thread_counts = tuple(int(t) for t in args.threads.split(",") if t.strip())
+
+    report = run_benchmark(args.bundle, args.corpus, perturbations, thread_counts, seed=args.seed)
+    write_report(report, args.out)
+    overall = report["accuracy"]["overall"]
+    total = report["latency"]["total"]
+    logger.info(f"✅ top-1={overall['top1']} top-3={overall['top3']} over {overall['n']} cases | "
+                f"total p50={total['p50_ms']}ms p95={total['p95_ms']}ms p99={total['p99_ms']}ms")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    logging.getLogger("utils.sift_features").setLevel(logging.WARNING)
+    main()
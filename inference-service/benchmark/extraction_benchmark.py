@@ -0,0 +1,103 @@
+# benchmark/extraction_benchmark.py
+# Measures descriptor-build extraction throughput (cards/sec) against a local
+# HTTP stand-in for the Scryfall image CDN, comparing the pipelined
+# download/extract path with one-record-at-a-time workers.
+#
+#   python -m benchmark.extraction_benchmark --cards 200 --latency-ms 40 --workers 4
+
+import os
+import time
+import json
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import cv2
+import requests
+
+from utils.warmup import synthetic_roi
+from descriptor_update.workers.feature_worker import extract_features_from_bytes
+from descriptor_update.workers.extraction_pipeline import extract_features_pipelined, available_cpus
+
+logger = logging.getLogger(__name__)
+
+class _SlowHandler(SimpleHTTPRequestHandler):
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stand_in(image_dir, latency):
+    handler = type("StandInHandler", (_SlowHandler,), {"latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(handler, directory=image_dir))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def write_synthetic_cards(image_dir, count):
+    for i in range(count):
+        card = cv2.resize(synthetic_roi(i, size=256), (488, 680))
+        cv2.imwrite(os.path.join(image_dir, f"{i:05d}.jpg"), card)
+
+def _unpooled_record(row):
+    # One blocking download per record with a fresh connection, then extraction.
+    response = requests.get(row['image_url'], timeout=10)
+    if response.status_code != 200:
+        return None
+    _, descriptors = extract_features_from_bytes(response.content, row['image_url'])
+    return descriptors is not None
+
+def run_unpooled(records, workers):
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        done = sum(1 for ok in executor.map(_unpooled_record, records) if ok)
+    return done, time.perf_counter() - start
+
+def run_pipelined(records, workers, download_concurrency):
+    start = time.perf_counter()
+    done = sum(1 for _ in extract_features_pipelined(records, download_concurrency=download_concurrency,
+                                                     cpu_workers=workers))
+    return done, time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Descriptor extraction throughput benchmark")
+    parser.add_argument("--cards", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=40.0, help="Per-request latency of the stand-in server")
+    parser.add_argument("--workers", type=int, default=available_cpus(), help="CPU extraction processes")
+    parser.add_argument("--download-concurrency", type=int, default=16)
+    args = parser.parse_args(argv)
+
+    image_dir = tempfile.mkdtemp(prefix="extraction-bench-")
+    try:
+        write_synthetic_cards(image_dir, args.cards)
+        server = start_stand_in(image_dir, args.latency_ms / 1000)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        records = [
+            {"scryfall_id": f"card-{i}", "image_url": f"{base_url}/{i:05d}.jpg", "face_index": 0}
+            for i in range(args.cards)
+        ]
+
+        report = {"cards": args.cards, "latency_ms": args.latency_ms, "workers": args.workers,
+                  "download_concurrency": args.download_concurrency}
+        for name, runner in (("unpooled", lambda: run_unpooled(records, args.workers)),
+                             ("pipelined", lambda: run_pipelined(records, args.workers, args.download_concurrency))):
+            done, elapsed = runner()
+            report[name] = {"extracted": done, "seconds": round(elapsed, 3),
+                            "cards_per_second": round(done / elapsed, 2) if elapsed else None}
+            logger.info(f"⏱️ {name}: {done} cards in {elapsed:.2f}s ({report[name]['cards_per_second']} cards/s)")
+        server.shutdown()
+        print(json.dumps(report, indent=2))
+    finally:
+        shutil.rmtree(image_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    main()
@@ -0,0 +1,99 @@
+# benchmark/import_benchmark.py
+# Measures Scryfall import throughput (rows/sec) from the bulk file to COPY
+# text, without a database: the pure-Python ijson backend transforming in this
+# process, the C backend transforming in this process, and the C backend
+# feeding the import process pool. All three must produce identical COPY bytes.
+#
+#   python -m benchmark.import_benchmark --sample data/scryfall-all_prints.json --cards 20000 --workers 4
+
+import os
+import time
+import json
+import shutil
+import logging
+import argparse
+import tempfile
+import hashlib
+
+import ijson
+
+from scryfall_update.card_rows import CopyRowStream, IMPORT_CHUNK_CARDS, iter_card_copy_blocks
+
+logger = logging.getLogger(__name__)
+
+READ_BYTES = 1024 * 1024
+
+def synthetic_card(i):
+    return {
+        "object": "card", "id": f"00000000-0000-4000-8000-{i:012d}", "oracle_id": f"10000000-0000-4000-8000-{i:012d}",
+        "multiverse_ids": [i], "name": f"Bench Card {i}", "lang": "en", "released_at": "2024-02-09",
+        "uri": f"https://api.scryfall.com/cards/{i}", "scryfall_uri": f"https://scryfall.com/card/bch/{i}",
+        "layout": "normal", "highres_image": True, "image_status": "highres_scan",
+        "image_uris": {size: f"https://cards.scryfall.io/{size}/front/{i}.jpg" for size in ("small", "normal", "large")},
+        "mana_cost": "{2}{U}", "cmc": 3.0, "type_line": "Creature — Wizard",
+        "oracle_text": "Flying\nWhen this creature enters, draw a card.\tThen discard a card.",
+        "power": "2", "toughness": "3", "colors": ["U"], "color_identity": ["U"], "keywords": ["Flying"],
+        "legalities": {fmt: "legal" for fmt in ("standard", "pioneer", "modern", "legacy", "vintage", "commander")},
+        "games": ["paper", "mtgo"], "reserved": False, "foil": True, "nonfoil": True, "finishes": ["nonfoil", "foil"],
+        "set": "bch", "set_name": "Benchmark", "collector_number": str(i), "rarity": "common",
+        "artist": "Test Artist", "edhrec_rank": i, "flavor_text": "“Quoted\\flavor.”",
+        "prices": {"usd": f"{i % 100}.{i % 97:02d}", "usd_foil": None, "eur": "0.10", "tix": "0.02"},
+        "purchase_uris": {"tcgplayer": f"https://tcgplayer.com/{i}"},
+    }
+
+def write_sample(path, sample, cards):
+    """First ``cards`` cards of ``sample`` (or synthetic ones) as a bulk-file-shaped JSON array."""
+    if sample:
+        with open(sample, 'rb') as f:
+            source = ijson.items(f, 'item', use_float=True)
+            selected = [card for _, card in zip(range(cards), source)]
+    else:
+        selected = [synthetic_card(i) for i in range(cards)]
+    with open(path, 'w') as f:
+        json.dump(selected, f)
+    return len(selected)
+
+def run(json_file, workers, chunk_cards, parser):
+    stream = CopyRowStream(iter_card_copy_blocks(json_file, workers=workers, chunk_cards=chunk_cards, parser=parser))
+    digest = hashlib.blake2b(digest_size=16)
+    start = time.perf_counter()
+    for data in iter(lambda: stream.read(READ_BYTES), b""):
+        digest.update(data)
+    return stream.rows, time.perf_counter() - start, digest.hexdigest()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scryfall card import throughput benchmark")
+    parser.add_argument("--sample", help="Local Scryfall bulk file to sample (synthetic cards if omitted)")
+    parser.add_argument("--cards", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=len(os.sched_getaffinity(0)),
+                        help="Import transform processes for the pooled run")
+    parser.add_argument("--chunk-cards", type=int, default=IMPORT_CHUNK_CARDS)
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="import-bench-")
+    try:
+        json_file = os.path.join(work_dir, "cards.json")
+        cards = write_sample(json_file, args.sample, args.cards)
+
+        report = {"cards": cards, "sample": args.sample or "synthetic", "workers": args.workers,
+                  "chunk_cards": args.chunk_cards, "ijson_backend": ijson.backend}
+        runs = [("python_serial", 1, ijson.get_backend("python")),
+                (f"{ijson.backend}_serial", 1, ijson),
+                (f"{ijson.backend}_pipelined", args.workers, ijson)]
+        digests = set()
+        for name, workers, backend in runs:
+            rows, elapsed, digest = run(json_file, workers, args.chunk_cards, backend)
+            digests.add(digest)
+            report[name] = {"rows": rows, "seconds": round(elapsed, 3),
+                            "rows_per_second": round(rows / elapsed) if elapsed else None}
+            logger.info(f"⏱️ {name}: {rows} rows in {elapsed:.2f}s ({report[name]['rows_per_second']} rows/s)")
+        report["identical_output"] = len(digests) == 1
+        if not report["identical_output"]:
+            logger.error("❌ COPY output differs between runs.")
+        print(json.dumps(report, indent=2))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    main()
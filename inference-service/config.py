@@ -14,3 +14,78 @@ POSTGRES_CONFIG = {
 LOG_FILE_PATH = os.getenv("LOG_FILE_PATH", "/app/logs/inference-service.log")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
+
+# Mobile scan sessions are created with the access token the core backend
+# issues, so JWT_SECRET must be the core backend's value.
+JWT_SECRET_KEY = os.getenv("JWT_SECRET", "your-very-secure-secret")
+JWT_TOKEN_LOCATION = ["headers", "cookies"]
+JWT_IDENTITY_CLAIM = "user_id"
+JWT_ACCESS_COOKIE_NAME = "access_token"
+JWT_COOKIE_CSRF_PROTECT = False
+
+# Keypoint budget cascade: query with the smallest budget first and only
+# escalate to the next tier when the answer is ambiguous.
+SIFT_BUDGET_TIERS = tuple(int(t) for t in os.getenv("SIFT_BUDGET_TIERS", "80,250").split(","))
+SIFT_CASCADE_MIN_INLIERS = int(os.getenv("SIFT_CASCADE_MIN_INLIERS", 20))
+SIFT_CASCADE_MIN_VOTE_MARGIN = float(os.getenv("SIFT_CASCADE_MIN_VOTE_MARGIN", 0.05))
+
+# Image-quality gate applied to uploaded ROIs before feature extraction.
+QUALITY_GATE_ENABLED = os.getenv("QUALITY_GATE_ENABLED", "true").lower() == "true"
+QUALITY_MIN_LAPLACIAN_VAR = float(os.getenv("QUALITY_MIN_LAPLACIAN_VAR", 20.0))
+QUALITY_MIN_LUMINANCE = float(os.getenv("QUALITY_MIN_LUMINANCE", 25.0))
+QUALITY_MAX_LUMINANCE = float(os.getenv("QUALITY_MAX_LUMINANCE", 235.0))
+QUALITY_MIN_KEYPOINTS = int(os.getenv("QUALITY_MIN_KEYPOINTS", 15))
+
+# Mobile burst scanning: frames submitted to the same session pool their
+# FAISS votes and RANSAC inliers until the combined evidence is conclusive.
+BURST_MODE_ENABLED = os.getenv("BURST_MODE_ENABLED", "true").lower() == "true"
+BURST_STATE_TTL_SECONDS = int(os.getenv("BURST_STATE_TTL_SECONDS", 20))
+# Must outlast the 3s cooldown MobileScanPage enforces between submits, or the
+# next frame of a decided burst opens a new one and stores the card again.
+BURST_DECIDED_HOLD_SECONDS = int(os.getenv("BURST_DECIDED_HOLD_SECONDS", 5))
+BURST_MIN_FRAMES = int(os.getenv("BURST_MIN_FRAMES", 2))
+BURST_MIN_INLIERS = int(os.getenv("BURST_MIN_INLIERS", 14))
+BURST_MIN_INLIER_MARGIN = int(os.getenv("BURST_MIN_INLIER_MARGIN", 6))
+
+# Binder-page endpoint (/infer/page): pages are decoded with their short side
+# kept at or above PAGE_DECODE_TARGET so each card still rectifies cleanly.
+PAGE_DECODE_TARGET = int(os.getenv("PAGE_DECODE_TARGET", 1024))
+PAGE_MAX_CARDS = int(os.getenv("PAGE_MAX_CARDS", 12))
+
+# Standalone update worker (update_worker.py). Niceness and an optional CPU
+# list keep the nightly rebuild from competing with the serving workers.
+UPDATE_WORKER_CRON_HOUR = int(os.getenv("UPDATE_WORKER_CRON_HOUR", 2))
+UPDATE_WORKER_NICE = int(os.getenv("UPDATE_WORKER_NICE", 10))
+UPDATE_WORKER_CPUS = os.getenv("UPDATE_WORKER_CPUS", "")
+UPDATE_LOCK_TIMEOUT_SECONDS = int(os.getenv("UPDATE_LOCK_TIMEOUT_SECONDS", 1800))
+UPDATE_WORKER_LOG_FILE_PATH = os.getenv("UPDATE_WORKER_LOG_FILE_PATH", "/app/logs/update-worker.log")
+# "build" runs the nightly rebuild; "sync" only follows the published bundle
+# (delta chain or full download), for replicas that don't build their own.
+UPDATE_WORKER_MODE = os.getenv("UPDATE_WORKER_MODE", "build")
+BUNDLE_SYNC_INTERVAL_MINUTES = int(os.getenv("BUNDLE_SYNC_INTERVAL_MINUTES", 60))
+# Price-only refresh of cards.prices in build mode; runs before the core
+# backend's 01:00 collection price snapshot. Negative disables it.
+PRICE_REFRESH_CRON_HOUR = int(os.getenv("PRICE_REFRESH_CRON_HOUR", 0))
+
+# Warmup before a process reports ready on /ready: synthetic ROIs plus any
+# images found in WARMUP_FIXTURE_DIR are run through the full match pipeline.
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_SYNTHETIC_ROIS = int(os.getenv("WARMUP_SYNTHETIC_ROIS", 4))
+WARMUP_FIXTURE_DIR = os.getenv("WARMUP_FIXTURE_DIR", "resources/warmup")
+
+# Shadow evaluation: a sampled fraction of /infer requests is re-run, off the
+# response path, against a candidate bundle loaded side by side from SHADOW_BUNDLE_DIR.
+SHADOW_ENABLED = os.getenv("SHADOW_ENABLED", "false").lower() == "true"
+SHADOW_BUNDLE_DIR = os.getenv("SHADOW_BUNDLE_DIR", "resources/shadow")
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", 0.05))
+SHADOW_QUEUE_SIZE = int(os.getenv("SHADOW_QUEUE_SIZE", 16))
+SHADOW_NICE = int(os.getenv("SHADOW_NICE", 19))
+SHADOW_STORE_PATH = os.getenv("SHADOW_STORE_PATH", "/app/logs/shadow_eval.sqlite3")
+
+# Fallback bundle download (utils/bundle_download.py) when resources/run is empty:
+# parallel range requests against BUNDLE_BASE_URL, resumable and checksum-verified.
+BUNDLE_BASE_URL = os.getenv("BUNDLE_BASE_URL", "https://huggingface.co/datasets/JakeTurner616/mtg-cards-SIFT-Features/resolve/main")
+BUNDLE_ARCHIVE = os.getenv("BUNDLE_ARCHIVE", "resources-nightly.tar.zst")
+BUNDLE_DOWNLOAD_CONNECTIONS = int(os.getenv("BUNDLE_DOWNLOAD_CONNECTIONS", 4))
+BUNDLE_DOWNLOAD_SEGMENT_MB = int(os.getenv("BUNDLE_DOWNLOAD_SEGMENT_MB", 8))
+BUNDLE_DOWNLOAD_RETRIES = int(os.getenv("BUNDLE_DOWNLOAD_RETRIES", 5))
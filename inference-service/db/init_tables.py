@@ -120,6 +120,7 @@ def init_collection_tables():
                 collection_card_id  INTEGER NOT NULL REFERENCES collection_cards(id) ON DELETE CASCADE,
                 snapshot_date       DATE    NOT NULL,
                 prices              JSONB,
+                price_usd           NUMERIC GENERATED ALWAYS AS ((prices->>'usd')::numeric) STORED,
                 created_at          TIMESTAMPTZ DEFAULT NOW(),
                 CONSTRAINT unique_snapshot
                   UNIQUE (collection_card_id, snapshot_date)
@@ -133,6 +134,47 @@ def init_collection_tables():
     finally:
         pg_pool.putconn(conn)
 
+# Typed copies of cards.prices, generated by Postgres so every writer keeps them in sync.
+PRICE_COLUMNS = {
+    "price_usd": "usd", "price_usd_foil": "usd_foil", "price_usd_etched": "usd_etched",
+    "price_eur": "eur", "price_tix": "tix",
+}
+
+def init_card_columns():
+    """
+    Adds content_hash and the generated price columns to cards tables created
+    before them (init.sql has them for new databases), and price_usd to
+    collection_price_snapshots, which the core backend's value queries read.
+    This is the migration the update worker runs at startup; app.py's table
+    initialisers only run under the dev server.
+    Runs on its own and commits at once: ALTER TABLE holds an ACCESS EXCLUSIVE
+    lock until commit, so it must not share a transaction with the card
+    import's COPY. Every stored generated column rewrites the table, so all of
+    them are added in one statement, which rewrites it once.
+    """
+    clauses = ["ADD COLUMN IF NOT EXISTS content_hash TEXT"] + [
+        f"ADD COLUMN IF NOT EXISTS {column} NUMERIC GENERATED ALWAYS AS ((prices->>'{key}')::numeric) STORED"
+        for column, key in PRICE_COLUMNS.items()
+    ]
+    conn = pg_pool.getconn()
+    try:
+        cur = conn.cursor()
+        cur.execute("ALTER TABLE cards\n    " + ",\n    ".join(clauses) + ";")
+        cur.execute("SELECT to_regclass('public.collection_price_snapshots');")
+        if cur.fetchone()[0] is not None:
+            # Typed copy of prices->>'usd' for the collection value aggregates.
+            cur.execute("""
+            ALTER TABLE collection_price_snapshots ADD COLUMN IF NOT EXISTS
+                price_usd NUMERIC GENERATED ALWAYS AS ((prices->>'usd')::numeric) STORED;
+            """)
+        conn.commit()
+        logger.info("✅ cards and collection_price_snapshots price columns ensured.")
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"❌ Error ensuring cards columns: {e}")
+    finally:
+        pg_pool.putconn(conn)
+
 def init_mobile_scan_tables():
     conn = pg_pool.getconn()
     try:
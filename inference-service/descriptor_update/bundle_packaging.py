@@ -0,0 +1,134 @@
+# descriptor_update/bundle_packaging.py
+# Packs a descriptor bundle into a single streamed tarball for distribution.
+#
+# Files are read once, hashed and written straight into a tar stream, which is
+# compressed with multi-threaded zstd (or left uncompressed). Nothing is staged
+# on disk besides the archive itself. The archive ends with a manifest.json
+# carrying each file's size and sha256; the same manifest plus the archive's own
+# checksum is written next to it as <archive>.manifest.json.
+
+import os
+import io
+import json
+import time
+import hashlib
+import logging
+import tarfile
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_FILES = ["candidate_features.h5", "faiss_ivf.index", "id_map.json"]
+ARCHIVE_BASENAME = "resources-nightly"
+
+def archive_name(compression, basename=ARCHIVE_BASENAME):
+    return f"{basename}.tar.zst" if compression == "zstd" else f"{basename}.tar"
+
+def delta_basename(base_bundle_id, bundle_id):
+    return f"resources-delta-{base_bundle_id}-{bundle_id}"
+
+def manifest_name(archive):
+    return f"{archive}.manifest.json"
+
+class _HashingReader:
+    """File wrapper that hashes whatever tarfile reads through it."""
+
+    def __init__(self, f):
+        self._f = f
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        self.sha256.update(data)
+        return data
+
+class _HashingWriter:
+    """Counts and hashes the archive bytes on their way to disk."""
+
+    def __init__(self, f):
+        self._f = f
+        self.sha256 = hashlib.sha256()
+        self.bytes = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.bytes += len(data)
+        return self._f.write(data)
+
+    def flush(self):
+        self._f.flush()
+
+def _open_compressed(raw, compression, level, threads):
+    if compression == "zstd":
+        import zstandard
+        cctx = zstandard.ZstdCompressor(level=level, threads=threads)
+        return cctx.stream_writer(raw, closefd=False)
+    if compression == "none":
+        return None
+    raise ValueError(f"Unknown bundle compression: {compression}")
+
+def package_bundle(bundle_dir, out_dir, bundle_id=None, compression="zstd", level=3, threads=-1,
+                   files=BUNDLE_FILES, basename=ARCHIVE_BASENAME):
+    """
+    Writes ``archive_name(compression, basename)`` with ``files`` from
+    ``bundle_dir`` and its manifest into ``out_dir``.
+    ``threads=-1`` lets zstd use every core. Returns a summary with the archive
+    path, manifest path, pack time and input/output bytes.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    archive = archive_name(compression, basename)
+    archive_path = os.path.join(out_dir, archive)
+    tmp_path = archive_path + ".tmp"
+
+    start = time.perf_counter()
+    packed = {}
+    with open(tmp_path, 'wb') as f:
+        sink = _HashingWriter(f)
+        compressor = _open_compressed(sink, compression, level, threads)
+        stream = compressor if compressor is not None else sink
+        with tarfile.open(fileobj=stream, mode='w|') as tar:
+            for fname in files:
+                path = os.path.join(bundle_dir, fname)
+                if not os.path.exists(path):
+                    logger.warning(f"⚠️ Skipped {path} (file not found)")
+                    continue
+                info = tar.gettarinfo(path, arcname=fname)
+                with open(path, 'rb') as src:
+                    reader = _HashingReader(src)
+                    tar.addfile(info, reader)
+                packed[fname] = {"size": info.size, "sha256": reader.sha256.hexdigest()}
+
+            manifest = {"bundle_id": bundle_id, "files": packed}
+            payload = json.dumps(manifest, indent=2).encode("utf-8")
+            info = tarfile.TarInfo("manifest.json")
+            info.size = len(payload)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(payload))
+        if compressor is not None:
+            compressor.close()
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, archive_path)
+    pack_seconds = time.perf_counter() - start
+
+    input_bytes = sum(entry["size"] for entry in packed.values())
+    manifest.update({
+        "archive": archive,
+        "compression": compression,
+        "archive_bytes": sink.bytes,
+        "archive_sha256": sink.sha256.hexdigest(),
+    })
+    manifest_path = os.path.join(out_dir, manifest_name(archive))
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    logger.info(f"📦 Packed {len(packed)} files ({input_bytes / 1e6:.1f} MB) into {archive} "
+                f"({sink.bytes / 1e6:.1f} MB, {compression}) in {pack_seconds:.2f}s")
+    return {
+        "archive_path": archive_path,
+        "manifest_path": manifest_path,
+        "compression": compression,
+        "pack_seconds": round(pack_seconds, 2),
+        "input_bytes": input_bytes,
+        "archive_bytes": sink.bytes,
+        "files": packed,
+    }
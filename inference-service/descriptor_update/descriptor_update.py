@@ -4,20 +4,24 @@ import gc
 import numpy as np
 import psycopg2
 import psycopg2.extras
-import h5py
 import faiss
 import tempfile
 import requests
 import cv2
 from dotenv import load_dotenv
 from tqdm import tqdm
-from concurrent.futures import ProcessPoolExecutor
 import shutil
 import logging
-import threading
+import time
 from datetime import datetime, timezone
 
-from .workers.feature_worker import process_record
+from .workers.extraction_pipeline import extract_features_pipelined, available_cpus
+from .workers.image_cache import ImageCache
+from .upload_to_hf import enqueue_bundle_upload
+from .promotion_gate import PROMOTION_CORPUS_DIR, corpus_available, evaluate_staging_bundle
+from utils.bundle_manifest import new_bundle_id, read_manifest, write_manifest
+from utils.bundle_delta import apply_faiss_delta, assign_faiss_ids, faiss_ids_for_cards, id_map_holes, write_delta
+from utils.feature_store import FeatureStore, is_current_layout, repack
 
 logger = logging.getLogger(__name__)
 load_dotenv('.env')
@@ -36,6 +40,27 @@ H5_FEATURES_FILE = os.path.join(STAGING_DIR, 'candidate_features.h5')
 FAISS_INDEX_FILE = os.path.join(STAGING_DIR, 'faiss_ivf.index')
 ID_MAP_FILE = os.path.join(STAGING_DIR, 'id_map.json')
 METADATA_FILE = os.path.join(STAGING_DIR, 'descriptor_update_metadata.json')
+# Delta bundles of promoted incremental builds wait here until they are uploaded.
+DELTA_DIR = "resources/deltas"
+BUNDLE_FILES = ["candidate_features.h5", "faiss_ivf.index", "id_map.json"]
+# CPU extraction processes (default: one per core) and concurrent image downloads.
+MAX_WORKERS = int(os.getenv("DESCRIPTOR_MAX_WORKERS", 0)) or available_cpus()
+DOWNLOAD_CONCURRENCY = int(os.getenv("DESCRIPTOR_DOWNLOAD_CONCURRENCY", 16))
+# Source images are cached here so re-extraction doesn't re-download; empty disables it.
+IMAGE_CACHE_DIR = os.getenv("DESCRIPTOR_IMAGE_CACHE_DIR", "resources/image_cache")
+IMAGE_CACHE_MAX_BYTES = int(float(os.getenv("DESCRIPTOR_IMAGE_CACHE_MAX_GB", 20)) * 1024 ** 3)
+# Build only from cached images (disconnected machines, reproducible rebuilds).
+OFFLINE_BUILD = os.getenv("DESCRIPTOR_OFFLINE", "false").lower() == "true"
+# Refuse to remove more than this fraction of stored cards in one run (guards against a bad DB read).
+MAX_REMOVAL_FRACTION = float(os.getenv("DESCRIPTOR_MAX_REMOVAL_FRACTION", 0.1))
+# Repack the feature store once replaced/removed cards leave this fraction of its rows orphaned.
+REPACK_GARBAGE_FRACTION = float(os.getenv("DESCRIPTOR_REPACK_GARBAGE_FRACTION", 0.25))
+# Incremental builds keep the trained FAISS index and publish a delta bundle. The
+# index is retrained (full bundle, delta chain restarts) after this many deltas,
+# once removed ids leave this fraction of id_map empty, or when forced.
+MAX_DELTA_CHAIN = int(os.getenv("DESCRIPTOR_MAX_DELTA_CHAIN", 14))
+MAX_ID_MAP_HOLES = float(os.getenv("DESCRIPTOR_MAX_ID_MAP_HOLES", 0.2))
+FORCE_FULL_REBUILD = os.getenv("DESCRIPTOR_FORCE_FULL_REBUILD", "false").lower() == "true"
 
 def write_metadata(metadata):
     try:
@@ -53,7 +78,9 @@ def load_card_records():
     query = '''
         SELECT id AS scryfall_id,
                COALESCE(image_uris->>'png', image_uris->>'large') AS image_url,
-               0 AS face_index
+               0 AS face_index,
+               image_status,
+               highres_image
         FROM cards
         WHERE layout::text NOT IN ('art_series', 'scheme', 'plane', 'phenomenon')
         AND games @> '["paper"]'
@@ -66,8 +93,28 @@ def load_card_records():
         cur.execute(query)
         return cur.fetchall()
 
+def diff_card_records(card_records, stored_sources):
+    """
+    Splits eligible records into (added, refreshed, removed_ids). A card is
+    refreshed when its image URL changed (Scryfall URLs carry a version query)
+    or its recorded image_status changed.
+    """
+    added, refreshed = [], []
+    eligible_ids = set()
+    for record in card_records:
+        card_id = record['scryfall_id']
+        eligible_ids.add(card_id)
+        if card_id not in stored_sources:
+            added.append(record)
+            continue
+        stored_url, stored_status = stored_sources[card_id]
+        if stored_url != record['image_url'] or (stored_status and stored_status != (record.get('image_status') or "")):
+            refreshed.append(record)
+    removed = sorted(set(stored_sources) - eligible_ids)
+    return added, refreshed, removed
+
 def ensure_staging_files_present():
-    for fname in ["candidate_features.h5", "faiss_ivf.index", "id_map.json"]:
+    for fname in BUNDLE_FILES:
         staging_file = os.path.join(STAGING_DIR, fname)
         run_file = os.path.join(RUN_DIR, fname)
         if not os.path.exists(staging_file):
@@ -77,9 +124,111 @@ def ensure_staging_files_present():
             else:
                 logger.warning(f"⚠️ {run_file} missing; staging file {staging_file} will be created from scratch if required")
 
+def reset_staging_to_run():
+    """
+    Incremental index updates and their deltas must start from the promoted
+    bundle that replicas have. A staging bundle that was never promoted (gate
+    refusal, crash) is therefore replaced by the run bundle.
+    """
+    run_manifest = read_manifest(RUN_DIR)
+    if not run_manifest:
+        return
+    staging_manifest = read_manifest(STAGING_DIR)
+    if staging_manifest and staging_manifest.get("bundle_id") == run_manifest.get("bundle_id"):
+        return
+    for fname in BUNDLE_FILES:
+        shutil.copy2(os.path.join(RUN_DIR, fname), os.path.join(STAGING_DIR, fname))
+    write_manifest(STAGING_DIR, run_manifest)
+    logger.info(f"♻️ Staging reset to promoted bundle {run_manifest.get('bundle_id')}")
+
+def plan_index_build(id_map):
+    """Returns (incremental, reason)."""
+    staging_manifest = read_manifest(STAGING_DIR) or {}
+    run_manifest = read_manifest(RUN_DIR) or {}
+    if FORCE_FULL_REBUILD:
+        return False, "DESCRIPTOR_FORCE_FULL_REBUILD"
+    if id_map is None or not os.path.exists(FAISS_INDEX_FILE):
+        return False, "no previous index"
+    if not run_manifest.get("bundle_id") or staging_manifest.get("bundle_id") != run_manifest.get("bundle_id"):
+        return False, "staging is not the promoted bundle"
+    if staging_manifest.get("delta_chain", 0) >= MAX_DELTA_CHAIN:
+        return False, f"delta chain reached {MAX_DELTA_CHAIN}"
+    if id_map and id_map_holes(id_map) / len(id_map) > MAX_ID_MAP_HOLES:
+        return False, f"over {MAX_ID_MAP_HOLES:.0%} of FAISS ids removed"
+    return True, None
+
+def build_full_index(metadata):
+    """Retrains IVF-PQ on the whole feature store. Returns (index, id_map) or (None, None)."""
+    all_descriptors = []
+    id_map = []
+    with FeatureStore(H5_FEATURES_FILE, 'r') as store:
+        for card_id, descriptors in store.iter_descriptors():
+            all_descriptors.append(descriptors)
+            id_map.extend([card_id] * descriptors.shape[0])
+
+    if not all_descriptors:
+        logger.error("❌ No descriptors found; skipping FAISS rebuild.")
+        metadata["error"] = "No descriptors found for FAISS rebuild."
+        return None, None
+
+    all_descriptors = np.vstack(all_descriptors)
+    dim = all_descriptors.shape[1]
+    quantizer = faiss.IndexFlatL2(dim)
+    index = faiss.IndexIVFPQ(quantizer, dim, 256, 8, 8)
+
+    if all_descriptors.shape[0] < 256:
+        logger.error(f"❌ Not enough descriptors ({all_descriptors.shape[0]}) to train with nlist=256. Skipping FAISS rebuild.")
+        metadata["error"] = "Not enough descriptors for FAISS rebuild."
+        return None, None
+
+    index.train(all_descriptors[:10000])
+    index.nprobe = 10
+    index.add(all_descriptors)
+    metadata["faiss_trained"] = True
+    return index, id_map
+
+def update_index_incrementally(id_map, removed_cards, added_card_ids):
+    """Applies the run's removals and additions to the existing index. Returns (index, id_map, delta)."""
+    index = faiss.read_index(FAISS_INDEX_FILE)
+    with FeatureStore(H5_FEATURES_FILE, 'r') as store:
+        removed_faiss_ids = faiss_ids_for_cards(id_map, removed_cards)
+        added_cards = assign_faiss_ids(id_map, added_card_ids, store)
+        apply_faiss_delta(index, id_map, removed_faiss_ids, added_cards, store)
+    delta = {
+        "base_bundle_id": (read_manifest(RUN_DIR) or {}).get("bundle_id"),
+        "removed_cards": sorted(removed_cards),
+        "removed_faiss_ids": removed_faiss_ids,
+        "added_cards": added_cards,
+    }
+    return index, id_map, delta
+
+def migrate_feature_store_if_needed(file_path):
+    """Rewrites a legacy (group-per-card) feature store in layout v2, in place."""
+    try:
+        if not os.path.exists(file_path) or is_current_layout(file_path):
+            return False
+    except OSError:
+        return False  # unreadable; open_h5_file_safely restores it from backup
+    tmp_path = file_path + ".migrate.tmp"
+    logger.info(f"📦 Migrating {file_path} to feature store layout v2...")
+    repack(file_path, tmp_path)
+    os.replace(tmp_path, file_path)
+    return True
+
+def repack_feature_store_if_needed(file_path, metadata):
+    with FeatureStore(file_path, 'r') as store:
+        stats = store.stats()
+    if stats["rows"] and stats["garbage_rows"] / stats["rows"] > REPACK_GARBAGE_FRACTION:
+        tmp_path = file_path + ".repack.tmp"
+        stats = repack(file_path, tmp_path)
+        os.replace(tmp_path, file_path)
+        metadata["feature_store_repacked"] = True
+    metadata["feature_store"] = stats
+
 def open_h5_file_safely(file_path, backup_path, mode='a'):
     try:
-        return h5py.File(file_path, mode)
+        migrate_feature_store_if_needed(file_path)
+        return FeatureStore(file_path, mode)
     except OSError as e:
         logger.warning(f"⚠️ HDF5 open failed with {e}. Restoring from backup.")
         if os.path.exists(file_path):
@@ -88,7 +237,8 @@ def open_h5_file_safely(file_path, backup_path, mode='a'):
         if os.path.exists(backup_path):
             shutil.copy2(backup_path, file_path)
             logger.info(f"Restored HDF5 from backup: {backup_path}")
-            return h5py.File(file_path, mode)
+            migrate_feature_store_if_needed(file_path)
+            return FeatureStore(file_path, mode)
         else:
             logger.error(f"❌ No backup available for HDF5: {file_path}")
             raise RuntimeError("HDF5 file unrecoverable.")
@@ -130,12 +280,65 @@ def run_inference_check():
         logger.error(f"❌ Inference sanity check FAILED: expected one of {expected_ids}, got {best_candidate}")
         return False
 
+def validate_staging_bundle(metadata):
+    """
+    Gates promotion on the fixture-corpus comparison against the running bundle.
+    Without a local corpus, falls back to the single-image network sanity check.
+    """
+    if corpus_available():
+        passed, comparison = evaluate_staging_bundle(STAGING_DIR, RUN_DIR)
+        metadata["promotion_gate"] = comparison
+        write_metadata(metadata)
+        return passed
+
+    logger.warning(f"⚠️ No benchmark corpus in {PROMOTION_CORPUS_DIR}; using the single-image sanity check.")
+    passed = run_inference_check()
+    metadata["promotion_gate"] = {"mode": "sanity_check", "passed": passed}
+    return passed
+
+def promote_staging_bundle(delta=None):
+    """
+    Copies each staged file next to its run counterpart and renames it into
+    place, so open handles in serving processes keep reading the old inode.
+    The manifest is written last; it is what tells serving processes to reload.
+    For incremental builds the delta bundle is written to DELTA_DIR first.
+    """
+    bundle_id = new_bundle_id()
+    previous = read_manifest(STAGING_DIR) or {}
+    if delta is not None:
+        delta["bundle_id"] = bundle_id
+        with FeatureStore(H5_FEATURES_FILE, 'r') as store:
+            write_delta(os.path.join(DELTA_DIR, bundle_id), delta, store, STAGING_DIR)
+    files = {}
+    for fname in BUNDLE_FILES:
+        src = os.path.join(STAGING_DIR, fname)
+        dst = os.path.join(RUN_DIR, fname)
+        tmp_dst = dst + ".promoting"
+        shutil.copy2(src, tmp_dst)
+        os.replace(tmp_dst, dst)
+        files[fname] = {"size": os.path.getsize(dst)}
+        logger.info(f"✅ Atomically promoted {src} → {dst}")
+
+    manifest = {
+        "bundle_id": bundle_id,
+        "promoted_at": datetime.now(timezone.utc).isoformat(),
+        "files": files,
+        "base_bundle_id": delta["base_bundle_id"] if delta else None,
+        "delta_chain": previous.get("delta_chain", 0) + 1 if delta else 0,
+    }
+    write_manifest(RUN_DIR, manifest)
+    write_manifest(STAGING_DIR, manifest)
+    return bundle_id
+
 def run_descriptor_update_pipeline():
     metadata = {
         "start_time": datetime.now(timezone.utc).isoformat(),
         "status": "in_progress",
         "num_cards_total": 0,
         "num_cards_new": 0,
+        "num_cards_added": 0,
+        "num_cards_refreshed": 0,
+        "num_cards_removed": 0,
         "faiss_descriptors_total": 0,
         "faiss_trained": False,
         "promotion_successful": False,
@@ -146,113 +349,114 @@ def run_descriptor_update_pipeline():
 
     try:
         ensure_staging_files_present()
+        reset_staging_to_run()
         card_records = load_card_records()
         metadata["num_cards_total"] = len(card_records)
         logger.info(f"🔄 Loaded {len(card_records)} card records for descriptor update.")
 
         hf_backup = os.path.join(RUN_DIR, 'candidate_features.h5')
-        with open_h5_file_safely(H5_FEATURES_FILE, hf_backup, mode='a') as hf:
-            processed_ids = set(hf.keys())
+        with open_h5_file_safely(H5_FEATURES_FILE, hf_backup, mode='a') as store:
+            stored_sources = store.sources()
+            added, refreshed, removed = diff_card_records(card_records, stored_sources)
+
+            if len(removed) > MAX_REMOVAL_FRACTION * max(len(stored_sources), 1):
+                logger.error(f"❌ {len(removed)} of {len(stored_sources)} stored cards are no longer eligible; "
+                             f"above DESCRIPTOR_MAX_REMOVAL_FRACTION={MAX_REMOVAL_FRACTION}, so nothing is removed.")
+                metadata["removal_skipped"] = True
+                removed = []
+            for card_id in removed:
+                store.remove(card_id)
 
-        new_records = [r for r in card_records if r['scryfall_id'] not in processed_ids]
+        new_records = added + refreshed
         metadata["num_cards_new"] = len(new_records)
-        logger.info(f"🆕 {len(new_records)} new records requiring descriptor extraction.")
-
-        MAX_WORKERS = 4
-        with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor, open_h5_file_safely(H5_FEATURES_FILE, hf_backup, mode='a') as hf:
-            for result in tqdm(executor.map(process_record, new_records), total=len(new_records)):
-                if not result:
-                    continue
-                scryfall_id = result["scryfall_id"]
-                image_url = result["image_url"]
-                keypoints = result["keypoints"]
-                descriptors = np.array(result["descriptors"], dtype=np.float16)
-                card_grp = hf.create_group(scryfall_id) if scryfall_id not in hf else hf[scryfall_id]
-                feat_grp = card_grp.create_group(f"feature_{len(card_grp)}")
-                feat_grp.create_dataset("descriptors", data=descriptors, compression="gzip")
-                feat_grp.create_dataset("keypoints", data=[json.dumps(keypoints)],
-                                        dtype=h5py.string_dtype(encoding="utf-8"),
-                                        compression="gzip")
-                feat_grp.attrs["image_url"] = image_url
-
-        all_descriptors = []
-        id_map = []
-        with h5py.File(H5_FEATURES_FILE, 'r') as hf:
-            for card_id in hf.keys():
-                card_grp = hf[card_id]
-                for feat_key in card_grp.keys():
-                    feat_grp = card_grp[feat_key]
-                    descriptors = feat_grp["descriptors"][:].astype(np.float32)
-                    all_descriptors.append(descriptors)
-                    id_map.extend([card_id] * descriptors.shape[0])
-
-        if not all_descriptors:
-            logger.error("❌ No descriptors found; skipping FAISS rebuild.")
-            metadata["status"] = "failed"
-            metadata["error"] = "No descriptors found for FAISS rebuild."
-            write_metadata(metadata)
-            return
+        metadata["num_cards_added"] = len(added)
+        metadata["num_cards_refreshed"] = len(refreshed)
+        metadata["num_cards_removed"] = len(removed)
+        logger.info(f"🆕 {len(added)} added, ♻️ {len(refreshed)} with changed images, "
+                    f"🗑️ {len(removed)} removed; {len(new_records)} records need descriptor extraction.")
 
-        all_descriptors = np.vstack(all_descriptors)
-        metadata["faiss_descriptors_total"] = all_descriptors.shape[0]
+        extract_start = time.perf_counter()
+        num_extracted = 0
+        extracted_ids = []
+        image_stats = {}
+        image_cache = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES) if IMAGE_CACHE_DIR else None
+        results = extract_features_pipelined(
+            new_records, download_concurrency=DOWNLOAD_CONCURRENCY, cpu_workers=MAX_WORKERS,
+            image_cache=image_cache, offline=OFFLINE_BUILD, stats=image_stats
+        )
+        with open_h5_file_safely(H5_FEATURES_FILE, hf_backup, mode='a') as store:
+            for result in tqdm(results, total=len(new_records)):
+                # A refreshed card's old rows stay indexed until this append replaces them.
+                store.append(result["scryfall_id"], result["keypoints"], result["descriptors"],
+                             image_url=result["image_url"], image_status=result["image_status"],
+                             highres_image=result["highres_image"])
+                extracted_ids.append(result["scryfall_id"])
+                num_extracted += 1
 
-        dim = all_descriptors.shape[1]
-        quantizer = faiss.IndexFlatL2(dim)
-        index = faiss.IndexIVFPQ(quantizer, dim, 256, 8, 8)
+        extract_time = time.perf_counter() - extract_start
+        metadata["num_cards_extracted"] = num_extracted
+        metadata["source_images"] = image_stats
+        metadata["extraction_cards_per_second"] = round(num_extracted / extract_time, 2) if extract_time else None
+        logger.info(f"✅ Extracted {num_extracted}/{len(new_records)} new cards in {extract_time:.1f}s "
+                    f"({metadata['extraction_cards_per_second']} cards/s)")
 
-        if all_descriptors.shape[0] < 256:
-            logger.error(f"❌ Not enough descriptors ({all_descriptors.shape[0]}) to train with nlist=256. Skipping FAISS rebuild.")
-            metadata["status"] = "failed"
-            metadata["error"] = "Not enough descriptors for FAISS rebuild."
-            write_metadata(metadata)
-            return
+        repack_feature_store_if_needed(H5_FEATURES_FILE, metadata)
+
+        id_map = None
+        if os.path.exists(ID_MAP_FILE):
+            with open(ID_MAP_FILE, 'r') as f:
+                id_map = json.load(f)
+        incremental, full_reason = plan_index_build(id_map)
+        delta = None
+        if incremental:
+            # Refreshed cards that failed to re-extract keep their old descriptors and FAISS ids.
+            refreshed_ids = {record['scryfall_id'] for record in refreshed}
+            removed_cards = list(removed) + [card_id for card_id in extracted_ids if card_id in refreshed_ids]
+            index, id_map, delta = update_index_incrementally(id_map, removed_cards, extracted_ids)
+            logger.info(f"✅ FAISS index updated in place: -{len(delta['removed_faiss_ids'])} "
+                        f"+{sum(count for _, _, count in delta['added_cards'])} vectors.")
+        else:
+            logger.info(f"🏗️ Retraining FAISS index ({full_reason}).")
+            index, id_map = build_full_index(metadata)
+            if index is None:
+                metadata["status"] = "failed"
+                write_metadata(metadata)
+                return
+        metadata["index_build"] = "incremental" if incremental else "full"
+        metadata["faiss_descriptors_total"] = index.ntotal
 
-        index.train(all_descriptors[:10000])
-        index.nprobe = 10
-        index.add(all_descriptors)
         faiss.write_index(index, FAISS_INDEX_FILE)
         with open(ID_MAP_FILE, 'w') as f:
             json.dump(id_map, f)
-        metadata["faiss_trained"] = True
-        logger.info(f"✅ FAISS index rebuilt with {index.ntotal} descriptors.")
+        logger.info(f"✅ FAISS index written with {index.ntotal} descriptors.")
 
-        if run_inference_check():
-            files_to_promote = ["candidate_features.h5", "faiss_ivf.index", "id_map.json"]
+        if validate_staging_bundle(metadata):
             try:
-                for fname in files_to_promote:
-                    src = os.path.join(STAGING_DIR, fname)
-                    dst = os.path.join(RUN_DIR, fname)
-                    shutil.copy2(src, dst)
-                    logger.info(f"✅ Atomically promoted {src} → {dst}")
-
+                metadata["bundle_id"] = promote_staging_bundle(delta)
                 metadata["promotion_successful"] = True
 
-                def upload_hf_background():
-                    try:
-                        from .upload_to_hf import upload_descriptor_bundle_to_hf
-                        upload_result = upload_descriptor_bundle_to_hf()
-                        metadata.update(upload_result)
-                    except Exception as e:
-                        logger.warning(f"⚠️ HF upload failed in background: {e}")
-                        metadata["hf_upload_successful"] = False
-                        metadata["error"] = str(e)
-                    finally:
-                        metadata["end_time"] = datetime.now(timezone.utc).isoformat()
-                        metadata["status"] = "success" if metadata.get("hf_upload_successful") else "partial_success"
-                        write_metadata(metadata)
-
-                upload_thread = threading.Thread(target=upload_hf_background)
-                upload_thread.start()
-                upload_thread.join()
+                def record_upload(upload_result):
+                    # Runs on the upload thread after this run has finished and written its metadata.
+                    metadata.update(upload_result)
+                    metadata["upload_finished_time"] = datetime.now(timezone.utc).isoformat()
+                    if not upload_result.get("hf_upload_successful"):
+                        metadata["status"] = "partial_success"
+                    write_metadata(metadata)
+
+                metadata["hf_upload_queued"] = True
+                delta_dir = os.path.join(DELTA_DIR, metadata["bundle_id"]) if delta else None
+                enqueue_bundle_upload(RUN_DIR, metadata["bundle_id"], on_done=record_upload, delta_dir=delta_dir)
 
             except Exception as e:
                 logger.error(f"❌ Atomic promotion failed: {e}")
                 metadata["status"] = "failed"
                 metadata["error"] = str(e)
         else:
-            logger.error("❌ Inference validation failed. Staging model discarded. Promotion and upload skipped.")
+            logger.error("❌ Staging bundle failed validation. Staging model discarded. Promotion and upload skipped.")
             metadata["status"] = "failed"
-            metadata["error"] = "Inference validation failed."
+            reasons = metadata.get("promotion_gate", {}).get("reasons")
+            metadata["error"] = "Promotion gate refused staging bundle: " + "; ".join(reasons) if reasons \
+                else "Inference validation failed."
 
     except Exception as e:
         logger.exception("❌ Descriptor update pipeline encountered an error.")
@@ -0,0 +1,42 @@
+# descriptor_update/feature_store_tool.py
+# Maintenance commands for candidate_features.h5.
+#
+#   python -m descriptor_update.feature_store_tool stats resources/run/candidate_features.h5
+#   python -m descriptor_update.feature_store_tool repack old.h5 new.h5   # compact, or migrate a legacy file
+
+import os
+import json
+import logging
+import argparse
+
+from utils.feature_store import FeatureStore, is_current_layout, repack
+
+logger = logging.getLogger(__name__)
+
+def file_stats(path):
+    if not is_current_layout(path):
+        return {"layout_version": 1, "file_bytes": os.path.getsize(path)}
+    with FeatureStore(path, 'r') as store:
+        return store.stats()
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect, compact or migrate a candidate feature store.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    stats_parser = sub.add_parser("stats", help="Print layout, card/row counts and file size")
+    stats_parser.add_argument("path")
+    repack_parser = sub.add_parser("repack", help="Write a compact layout-v2 copy (also migrates legacy files)")
+    repack_parser.add_argument("src")
+    repack_parser.add_argument("dst")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.command == "stats":
+        print(json.dumps(file_stats(args.path), indent=2))
+    else:
+        before = os.path.getsize(args.src)
+        stats = repack(args.src, args.dst)
+        stats["source_bytes"] = before
+        print(json.dumps(stats, indent=2))
+
+if __name__ == "__main__":
+    main()
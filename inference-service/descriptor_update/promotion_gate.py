@@ -0,0 +1,118 @@
+# descriptor_update/promotion_gate.py
+# Accuracy- and latency-gated promotion: the staging bundle is benchmarked on the
+# local fixture corpus next to the currently running bundle, and promotion is
+# refused if top-1 accuracy drops or p95 latency rises beyond the thresholds.
+
+import os
+import logging
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+load_dotenv('.env')
+
+PROMOTION_CORPUS_DIR = os.getenv("PROMOTION_CORPUS_DIR", "resources/benchmark")
+PROMOTION_PERTURBATIONS = tuple(
+    p.strip() for p in os.getenv("PROMOTION_PERTURBATIONS", "none,blur,rotation,glare,perspective").split(",")
+    if p.strip()
+)
+# Absolute drop in top-1 accuracy (0.01 = one percentage point), overall and per corpus group.
+PROMOTION_MAX_TOP1_DROP = float(os.getenv("PROMOTION_MAX_TOP1_DROP", 0.01))
+# Relative rise in end-to-end p95 latency (0.2 = 20% slower).
+PROMOTION_MAX_P95_INCREASE = float(os.getenv("PROMOTION_MAX_P95_INCREASE", 0.2))
+
+def _summary(report):
+    accuracy = report["accuracy"]
+    return {
+        "bundle_id": report["bundle"]["bundle_id"],
+        "top1": accuracy["overall"]["top1"],
+        "top3": accuracy["overall"]["top3"],
+        "by_perturbation": accuracy["by_perturbation"],
+        "by_group": accuracy["by_group"],
+        "p50_ms": report["latency"]["total"]["p50_ms"],
+        "p95_ms": report["latency"]["total"]["p95_ms"],
+        "p99_ms": report["latency"]["total"]["p99_ms"],
+        "misses": len(report["misses"]),
+    }
+
+def corpus_available():
+    if not os.path.isdir(PROMOTION_CORPUS_DIR):
+        return False
+    from benchmark.benchmark import load_corpus
+    return bool(load_corpus(PROMOTION_CORPUS_DIR))
+
+def compare_bundles(baseline, candidate):
+    """Returns (passed, reasons) for a candidate summary against the baseline summary."""
+    reasons = []
+    top1_drop = baseline["top1"] - candidate["top1"]
+    if top1_drop > PROMOTION_MAX_TOP1_DROP:
+        reasons.append(f"top-1 accuracy dropped {top1_drop:.4f} ({baseline['top1']} → {candidate['top1']})")
+
+    for group, base_score in baseline["by_group"].items():
+        cand_score = candidate["by_group"].get(group)
+        if cand_score is None:
+            continue
+        group_drop = base_score["top1"] - cand_score["top1"]
+        if group_drop > PROMOTION_MAX_TOP1_DROP:
+            reasons.append(f"top-1 accuracy for group '{group}' dropped {group_drop:.4f}")
+
+    if baseline["p95_ms"]:
+        p95_increase = (candidate["p95_ms"] - baseline["p95_ms"]) / baseline["p95_ms"]
+        if p95_increase > PROMOTION_MAX_P95_INCREASE:
+            reasons.append(f"p95 latency rose {p95_increase:.1%} ({baseline['p95_ms']}ms → {candidate['p95_ms']}ms)")
+    return not reasons, reasons
+
+def evaluate_staging_bundle(staging_dir, run_dir):
+    """
+    Benchmarks the running bundle (when one exists) and the staging bundle on the
+    fixture corpus. Returns (passed, comparison); ``comparison`` goes into
+    descriptor_update_metadata.json.
+    """
+    from benchmark.benchmark import run_benchmark
+
+    comparison = {
+        "mode": "corpus",
+        "corpus": os.path.abspath(PROMOTION_CORPUS_DIR),
+        "perturbations": list(PROMOTION_PERTURBATIONS),
+        "thresholds": {
+            "max_top1_drop": PROMOTION_MAX_TOP1_DROP,
+            "max_p95_increase": PROMOTION_MAX_P95_INCREASE,
+        },
+        "baseline": None,
+        "candidate": None,
+        "passed": False,
+        "reasons": [],
+    }
+
+    has_baseline = all(
+        os.path.exists(os.path.join(run_dir, f))
+        for f in ("faiss_ivf.index", "candidate_features.h5", "id_map.json")
+    )
+    if has_baseline:
+        logger.info(f"📏 Benchmarking running bundle in {run_dir}...")
+        comparison["baseline"] = _summary(
+            run_benchmark(run_dir, PROMOTION_CORPUS_DIR, PROMOTION_PERTURBATIONS, thread_counts=())
+        )
+
+    logger.info(f"📏 Benchmarking staging bundle in {staging_dir}...")
+    candidate_report = run_benchmark(staging_dir, PROMOTION_CORPUS_DIR, PROMOTION_PERTURBATIONS, thread_counts=())
+    comparison["candidate"] = _summary(candidate_report)
+    comparison["cases"] = candidate_report["corpus"]["cases"]
+
+    if comparison["baseline"] is None:
+        # First build: nothing to regress against.
+        comparison["passed"] = True
+        comparison["reasons"] = ["no running bundle to compare against"]
+    else:
+        comparison["passed"], comparison["reasons"] = compare_bundles(comparison["baseline"], comparison["candidate"])
+        comparison["top1_delta"] = round(comparison["candidate"]["top1"] - comparison["baseline"]["top1"], 4)
+        comparison["p95_change"] = (
+            round((comparison["candidate"]["p95_ms"] - comparison["baseline"]["p95_ms"]) / comparison["baseline"]["p95_ms"], 4)
+            if comparison["baseline"]["p95_ms"] else None
+        )
+
+    if comparison["passed"]:
+        logger.info(f"✅ Promotion gate passed: candidate top-1={comparison['candidate']['top1']}, "
+                    f"p95={comparison['candidate']['p95_ms']}ms")
+    else:
+        logger.error(f"❌ Promotion gate refused staging bundle: {'; '.join(comparison['reasons'])}")
+    return comparison["passed"], comparison
@@ -0,0 +1,345 @@
+# descriptor_update/sharded_build.py
+# Full descriptor rebuild split into independent shards (e.g. after an
+# extractor change). Cards are assigned to shards by a hash of their Scryfall
+# id, so the split does not depend on database order. Every step reads and
+# writes only files under the build directory, so shards can run as separate
+# processes or on separate hosts that share (or copy) that directory:
+#
+#   plan                 load eligible cards, write one record file per shard
+#   extract --shard i    features for shard i → shard-i/candidate_features.h5
+#   train                train IVF-PQ once on a sample from all shards → trained.index
+#   index --shard i      add shard i to a copy of trained.index (local FAISS ids)
+#   merge                merge_from every shard index into the final bundle in --out
+#   promote              gate and promote the merged staging bundle, upload it
+#   run-local            all of the above, shard steps as parallel subprocesses
+#
+# Each shard step is resumable: extraction skips cards already in the shard's
+# store, and finished steps are recorded in shard-i/status.json. merge and
+# promote write the staging/run bundles, so they hold the same Redis
+# model_update_lock as update_worker.
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import subprocess
+from contextlib import contextmanager
+
+import faiss
+import redis
+import numpy as np
+from datetime import datetime, timezone
+
+from .descriptor_update import (
+    DOWNLOAD_CONCURRENCY, IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES, OFFLINE_BUILD, RUN_DIR, STAGING_DIR,
+    load_card_records, promote_staging_bundle, validate_staging_bundle, write_metadata,
+)
+from .workers.extraction_pipeline import extract_features_pipelined, available_cpus
+from .workers.image_cache import ImageCache
+from .upload_to_hf import enqueue_bundle_upload, wait_for_uploads
+from utils.feature_store import FeatureStore, dequantize_descriptors
+from utils.bundle_manifest import new_bundle_id, read_manifest, write_manifest
+from config import UPDATE_LOCK_TIMEOUT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUILD_DIR = os.getenv("DESCRIPTOR_SHARD_BUILD_DIR", "resources/sharded_build")
+TRAIN_SAMPLE_SIZE = 10000
+NLIST, PQ_M, PQ_BITS, NPROBE = 256, 8, 8, 10
+# Shard stores are flushed this often so a killed extraction resumes close to where it stopped.
+FLUSH_EVERY_CARDS = 500
+
+@contextmanager
+def model_update_lock():
+    """The lock update_worker holds for the nightly update; refuses to wait for it."""
+    r = redis.Redis(host=os.getenv("REDIS_HOST", "mtg-redis"), port=6379)
+    lock = r.lock("model_update_lock", timeout=UPDATE_LOCK_TIMEOUT_SECONDS)
+    if not lock.acquire(blocking=False):
+        raise RuntimeError("Another model update holds model_update_lock; rerun once it has finished.")
+    try:
+        yield
+    finally:
+        lock.release()
+
+def shard_of(card_id, num_shards):
+    return int(hashlib.sha1(card_id.encode("utf-8")).hexdigest()[:8], 16) % num_shards
+
+def shard_dir(build_dir, shard):
+    return os.path.join(build_dir, f"shard-{shard:03d}")
+
+def read_plan(build_dir):
+    with open(os.path.join(build_dir, "plan.json"), 'r') as f:
+        return json.load(f)
+
+def read_status(build_dir, shard):
+    path = os.path.join(shard_dir(build_dir, shard), "status.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def write_status(build_dir, shard, **updates):
+    status = read_status(build_dir, shard)
+    status.update(updates)
+    path = os.path.join(shard_dir(build_dir, shard), "status.json")
+    with open(path + ".tmp", 'w') as f:
+        json.dump(status, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+# ─── Steps ─────────────────────────────────────────────────────────────
+
+def plan(build_dir, num_shards, card_records=None):
+    card_records = card_records if card_records is not None else load_card_records()
+    shards = [[] for _ in range(num_shards)]
+    for record in card_records:
+        shards[shard_of(record['scryfall_id'], num_shards)].append(dict(record))
+    for shard, records in enumerate(shards):
+        os.makedirs(shard_dir(build_dir, shard), exist_ok=True)
+        records.sort(key=lambda r: r['scryfall_id'])
+        with open(os.path.join(shard_dir(build_dir, shard), "records.json"), 'w') as f:
+            json.dump(records, f, default=str)
+    with open(os.path.join(build_dir, "plan.json"), 'w') as f:
+        json.dump({"num_shards": num_shards, "num_cards": len(card_records),
+                   "shard_sizes": [len(r) for r in shards]}, f, indent=2)
+    logger.info(f"🗺️ Planned {len(card_records)} cards into {num_shards} shards: {[len(r) for r in shards]}")
+
+def extract_shard(build_dir, shard, cpu_workers=None):
+    if read_status(build_dir, shard).get("extract") == "done":
+        logger.info(f"⏭️ Shard {shard}: extraction already done.")
+        return
+    sdir = shard_dir(build_dir, shard)
+    with open(os.path.join(sdir, "records.json"), 'r') as f:
+        records = json.load(f)
+
+    image_stats = {}
+    image_cache = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES) if IMAGE_CACHE_DIR else None
+    start = time.perf_counter()
+    with FeatureStore(os.path.join(sdir, "candidate_features.h5"), 'a') as store:
+        pending = [r for r in records if r['scryfall_id'] not in store]
+        logger.info(f"🔨 Shard {shard}: {len(records) - len(pending)} cards already extracted, {len(pending)} to go.")
+        results = extract_features_pipelined(
+            pending, download_concurrency=DOWNLOAD_CONCURRENCY, cpu_workers=cpu_workers,
+            image_cache=image_cache, offline=OFFLINE_BUILD, stats=image_stats
+        )
+        for n, result in enumerate(results, 1):
+            store.append(result["scryfall_id"], result["keypoints"], result["descriptors"],
+                         image_url=result["image_url"], image_status=result["image_status"],
+                         highres_image=result["highres_image"])
+            if n % FLUSH_EVERY_CARDS == 0:
+                store.flush()
+        num_cards = len(store)
+
+    elapsed = time.perf_counter() - start
+    write_status(build_dir, shard, extract="done", num_cards=num_cards, failed=image_stats.get("failed", 0),
+                 extract_seconds=round(elapsed, 1))
+    logger.info(f"✅ Shard {shard}: {num_cards} cards in store ({len(pending)} attempted in {elapsed:.1f}s).")
+
+def train(build_dir):
+    """Trains the shared IVF-PQ quantizer on a sample spread evenly over the shards."""
+    num_shards = read_plan(build_dir)["num_shards"]
+    stores = [FeatureStore(os.path.join(shard_dir(build_dir, s), "candidate_features.h5"), 'r')
+              for s in range(num_shards)]
+    try:
+        per_shard = -(-TRAIN_SAMPLE_SIZE // num_shards)
+        sample = []
+        for store in stores:
+            taken = 0
+            for card_id in sorted(store.card_ids()):
+                if taken >= per_shard:
+                    break
+                descriptors = dequantize_descriptors(store.get_raw(card_id)[1], store.scale)
+                sample.append(descriptors[:per_shard - taken])
+                taken += len(sample[-1])
+    finally:
+        for store in stores:
+            store.close()
+
+    sample = np.vstack(sample)
+    if sample.shape[0] < NLIST:
+        raise RuntimeError(f"Not enough descriptors ({sample.shape[0]}) to train with nlist={NLIST}.")
+    quantizer = faiss.IndexFlatL2(sample.shape[1])
+    index = faiss.IndexIVFPQ(quantizer, sample.shape[1], NLIST, PQ_M, PQ_BITS)
+    index.train(sample)
+    index.nprobe = NPROBE
+    faiss.write_index(index, os.path.join(build_dir, "trained.index"))
+    logger.info(f"✅ Trained shared IVF-PQ quantizer on {sample.shape[0]} descriptors.")
+
+def index_shard(build_dir, shard):
+    if read_status(build_dir, shard).get("index") == "done":
+        logger.info(f"⏭️ Shard {shard}: index already built.")
+        return
+    sdir = shard_dir(build_dir, shard)
+    index = faiss.read_index(os.path.join(build_dir, "trained.index"))
+    id_map = []
+    with FeatureStore(os.path.join(sdir, "candidate_features.h5"), 'r') as store:
+        for card_id, descriptors in store.iter_descriptors():
+            index.add_with_ids(descriptors, np.arange(len(id_map), len(id_map) + len(descriptors), dtype=np.int64))
+            id_map.extend([card_id] * len(descriptors))
+    faiss.write_index(index, os.path.join(sdir, "faiss_ivf.index"))
+    with open(os.path.join(sdir, "id_map.json"), 'w') as f:
+        json.dump(id_map, f)
+    write_status(build_dir, shard, index="done", num_descriptors=len(id_map))
+    logger.info(f"✅ Shard {shard}: indexed {len(id_map)} descriptors.")
+
+def merge(build_dir, out_dir):
+    """Combines the shard stores and indexes into a bundle in ``out_dir``; shard ids are offset into one id map."""
+    num_shards = read_plan(build_dir)["num_shards"]
+    for shard in range(num_shards):
+        status = read_status(build_dir, shard)
+        if status.get("extract") != "done" or status.get("index") != "done":
+            raise RuntimeError(f"Shard {shard} is not finished: {status}")
+
+    os.makedirs(out_dir, exist_ok=True)
+    # out_dir stops holding the promoted bundle as soon as its files change, so its
+    # manifest is replaced first: a nightly update then resets staging instead of
+    # building on the merged files, and promote can tell the merge is still there.
+    merge_id = new_bundle_id()
+    write_manifest(out_dir, {"bundle_id": None, "sharded_merge_id": merge_id})
+    index = faiss.read_index(os.path.join(build_dir, "trained.index"))
+    id_map = []
+    features_tmp = os.path.join(out_dir, "candidate_features.h5.merging")
+    if os.path.exists(features_tmp):
+        os.remove(features_tmp)
+    with FeatureStore(features_tmp, 'w') as merged_store:
+        for shard in range(num_shards):
+            sdir = shard_dir(build_dir, shard)
+            shard_index = faiss.read_index(os.path.join(sdir, "faiss_ivf.index"))
+            with open(os.path.join(sdir, "id_map.json"), 'r') as f:
+                shard_id_map = json.load(f)
+            index.merge_from(shard_index, len(id_map))
+            id_map.extend(shard_id_map)
+            with FeatureStore(os.path.join(sdir, "candidate_features.h5"), 'r') as store:
+                for card_id in sorted(store.card_ids()):
+                    keypoints, descriptors = store.get_raw(card_id)
+                    merged_store.append(card_id, keypoints, descriptors, **store.source(card_id))
+        num_cards = len(merged_store)
+
+    os.replace(features_tmp, os.path.join(out_dir, "candidate_features.h5"))
+    faiss.write_index(index, os.path.join(out_dir, "faiss_ivf.index"))
+    with open(os.path.join(out_dir, "id_map.json"), 'w') as f:
+        json.dump(id_map, f)
+    stats = {"out_dir": out_dir, "merge_id": merge_id, "num_shards": num_shards, "num_cards_total": num_cards,
+             "faiss_descriptors_total": index.ntotal}
+    with open(os.path.join(build_dir, "merge.json"), 'w') as f:
+        json.dump(stats, f, indent=2)
+    logger.info(f"✅ Merged {num_shards} shards into {out_dir}: {num_cards} cards, {index.ntotal} descriptors.")
+    return stats
+
+def promote(build_dir):
+    """
+    Gates and promotes the merged staging bundle as a full (non-delta) build,
+    then queues its upload. Callers wait for the upload (wait_for_uploads) after
+    releasing the update lock, as update_worker --once does.
+    """
+    with open(os.path.join(build_dir, "merge.json"), 'r') as f:
+        merge_stats = json.load(f)
+    if os.path.abspath(merge_stats["out_dir"]) != os.path.abspath(STAGING_DIR):
+        raise RuntimeError(f"Shards were merged into {merge_stats['out_dir']}, not {STAGING_DIR}; nothing to promote.")
+    if (read_manifest(STAGING_DIR) or {}).get("sharded_merge_id") != merge_stats.get("merge_id"):
+        raise RuntimeError(f"{STAGING_DIR} no longer holds merge {merge_stats.get('merge_id')}; rerun merge.")
+
+    metadata = {"start_time": datetime.now(timezone.utc).isoformat(), "status": "in_progress",
+                "index_build": "sharded", "faiss_trained": True, "promotion_successful": False, **merge_stats}
+    if not validate_staging_bundle(metadata):
+        logger.error("❌ Merged bundle failed validation. Promotion and upload skipped.")
+        metadata["status"] = "failed"
+        metadata["error"] = "Promotion gate refused merged bundle."
+        write_metadata(metadata)
+        return False
+
+    metadata["bundle_id"] = promote_staging_bundle()
+    metadata["promotion_successful"] = True
+    metadata["status"] = "success"
+    write_metadata(metadata)
+
+    def record_upload(upload_result):
+        metadata.update(upload_result)
+        if not upload_result.get("hf_upload_successful"):
+            metadata["status"] = "partial_success"
+        write_metadata(metadata)
+
+    enqueue_bundle_upload(RUN_DIR, metadata["bundle_id"], on_done=record_upload)
+    return True
+
+def run_local(build_dir, num_shards, out_dir, parallel, promote_bundle=False):
+    """
+    Runs every step on this machine; shard steps are separate processes,
+    ``parallel`` at a time. The update lock is held from merge through promote,
+    so a nightly update cannot run in between, but not while the promoted
+    bundle uploads: that can outlast the lock's timeout.
+    """
+    if not os.path.exists(os.path.join(build_dir, "plan.json")):
+        plan(build_dir, num_shards)
+    num_shards = read_plan(build_dir)["num_shards"]
+    cpu_workers = max(1, available_cpus() // parallel)
+
+    def run_shards(step, extra=()):
+        pending = list(range(num_shards))
+        running = []
+        while pending or running:
+            while pending and len(running) < parallel:
+                shard = pending.pop(0)
+                cmd = [sys.executable, "-m", "descriptor_update.sharded_build", "--build-dir", build_dir,
+                       step, "--shard", str(shard), *extra]
+                running.append((shard, subprocess.Popen(cmd)))
+            shard, proc = running.pop(0)
+            if proc.wait() != 0:
+                raise RuntimeError(f"{step} failed for shard {shard} (exit {proc.returncode}); rerun to resume.")
+
+    run_shards("extract", ("--cpu-workers", str(cpu_workers)))
+    train(build_dir)
+    run_shards("index")
+    with model_update_lock():
+        stats = merge(build_dir, out_dir)
+        if promote_bundle:
+            promote(build_dir)
+    wait_for_uploads()
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded full descriptor rebuild")
+    parser.add_argument("--build-dir", default=DEFAULT_BUILD_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("plan")
+    p.add_argument("--shards", type=int, required=True)
+    p = sub.add_parser("extract")
+    p.add_argument("--shard", type=int, required=True)
+    p.add_argument("--cpu-workers", type=int, default=None)
+    sub.add_parser("train")
+    p = sub.add_parser("index")
+    p.add_argument("--shard", type=int, required=True)
+    p = sub.add_parser("merge")
+    p.add_argument("--out", default=STAGING_DIR)
+    sub.add_parser("promote")
+    p = sub.add_parser("run-local")
+    p.add_argument("--shards", type=int, default=4)
+    p.add_argument("--parallel", type=int, default=2, help="Shard processes running at once")
+    p.add_argument("--out", default=STAGING_DIR)
+    p.add_argument("--promote", action="store_true", help="Gate and promote the merged bundle")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    os.makedirs(args.build_dir, exist_ok=True)
+    if args.command == "plan":
+        plan(args.build_dir, args.shards)
+    elif args.command == "extract":
+        extract_shard(args.build_dir, args.shard, args.cpu_workers)
+    elif args.command == "train":
+        train(args.build_dir)
+    elif args.command == "index":
+        index_shard(args.build_dir, args.shard)
+    elif args.command == "merge":
+        with model_update_lock():
+            merge(args.build_dir, args.out)
+    elif args.command == "promote":
+        with model_update_lock():
+            promote(args.build_dir)
+        wait_for_uploads()
+    else:
+        run_local(args.build_dir, args.shards, args.out, args.parallel, promote_bundle=args.promote)
+
+if __name__ == "__main__":
+    main()
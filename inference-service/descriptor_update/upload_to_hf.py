@@ -1,83 +1,255 @@
+# descriptor_update/upload_to_hf.py
+# Packages the promoted bundle and publishes it to an upload target.
+#
+# Uploads run on a single background thread fed by a queue, so the descriptor
+# pipeline finishes as soon as the bundle is promoted. The run directory is
+# snapshotted with hard links when the job is queued, so a later promotion
+# can't change the files a queued or running job packs.
+#
+# Incremental builds also publish a delta archive. bundle-index.json, uploaded
+# last, names the latest bundle and maps each base bundle id to the delta that
+# upgrades it, so replicas can walk the chain instead of downloading everything.
+
 import os
-import zipfile
-from datetime import datetime, timezone
-from huggingface_hub import HfApi
+import json
+import queue
+import shutil
 import logging
+import tempfile
+import threading
 import time
+from datetime import datetime, timezone
+
+from .bundle_packaging import BUNDLE_FILES, delta_basename, package_bundle
+from utils.bundle_delta import DELTA_FILES, DELTA_JSON
+from utils.bundle_manifest import BUNDLE_INDEX_NAME, read_manifest
 
 logger = logging.getLogger(__name__)
 
-def upload_descriptor_bundle_to_hf():
+HF_REPO_ID = os.getenv("HF_REPO_ID", "JakeTurner616/mtg-cards-SIFT-Features")
+# "zstd" (multi-threaded) or "none" for a plain tar.
+BUNDLE_COMPRESSION = os.getenv("BUNDLE_COMPRESSION", "zstd")
+BUNDLE_ZSTD_LEVEL = int(os.getenv("BUNDLE_ZSTD_LEVEL", 3))
+# When set, bundles are copied into this directory instead of uploaded to Hugging Face.
+BUNDLE_UPLOAD_DIR = os.getenv("BUNDLE_UPLOAD_DIR", "")
+PACKAGE_DIR = os.getenv("BUNDLE_PACKAGE_DIR", "resources/package")
+# Deltas listed in bundle-index.json; older delta archives are deleted from the target.
+BUNDLE_DELTA_KEEP = int(os.getenv("BUNDLE_DELTA_KEEP", 14))
+
+class HuggingFaceTarget:
+    name = "huggingface"
+
+    def __init__(self, token, repo_id=HF_REPO_ID):
+        from huggingface_hub import HfApi
+        self.api = HfApi(token=token)
+        self.repo_id = repo_id
+
+    def upload(self, local_path, path_in_repo):
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        self.api.upload_file(
+            path_or_fileobj=local_path,
+            path_in_repo=path_in_repo,
+            repo_id=self.repo_id,
+            repo_type="dataset",
+            commit_message=f"Overwrite {path_in_repo} ({today})",
+        )
+
+    def delete(self, path_in_repo):
+        self.api.delete_file(path_in_repo=path_in_repo, repo_id=self.repo_id, repo_type="dataset",
+                             commit_message=f"Remove {path_in_repo}")
+
+class LocalDirectoryTarget:
+    """Publishes into a directory; used for tests and air-gapped mirrors."""
+    name = "local"
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def upload(self, local_path, path_in_repo):
+        dst = os.path.join(self.directory, path_in_repo)
+        tmp_path = dst + ".tmp"
+        shutil.copyfile(local_path, tmp_path)
+        os.replace(tmp_path, dst)
+
+    def delete(self, path_in_repo):
+        path = os.path.join(self.directory, path_in_repo)
+        if os.path.exists(path):
+            os.remove(path)
+
+def upload_target_from_env():
+    """Returns the configured target, or None when there is nowhere to upload."""
+    if BUNDLE_UPLOAD_DIR:
+        return LocalDirectoryTarget(BUNDLE_UPLOAD_DIR)
     hf_token = os.getenv("HF_UPLOAD_TOKEN")
     if not hf_token:
+        return None
+    return HuggingFaceTarget(hf_token)
+
+def snapshot_bundle(run_dir):
+    """Hard-links the bundle files into a new directory next to ``run_dir`` and returns it."""
+    snapshot_dir = tempfile.mkdtemp(prefix="upload-", dir=os.path.dirname(os.path.abspath(run_dir)))
+    for fname in BUNDLE_FILES:
+        src = os.path.join(run_dir, fname)
+        if not os.path.exists(src):
+            continue
+        dst = os.path.join(snapshot_dir, fname)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+    return snapshot_dir
+
+def update_bundle_index(bundle_id, full_archive, delta_entry=None):
+    """
+    Records ``bundle_id`` as the latest bundle in the local copy of the index.
+    A full retrain (no delta) restarts the chain. Returns (index, archives
+    dropped from the chain).
+    """
+    path = os.path.join(PACKAGE_DIR, BUNDLE_INDEX_NAME)
+    index = {"deltas": {}}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            index = json.load(f)
+    dropped = []
+    if delta_entry is None:
+        dropped = [entry["archive"] for entry in index.get("deltas", {}).values()]
+        index["deltas"] = {}
+    else:
+        deltas = index.setdefault("deltas", {})
+        deltas[delta_entry["base_bundle_id"]] = {"to": bundle_id, "archive": delta_entry["archive"]}
+        while len(deltas) > BUNDLE_DELTA_KEEP:
+            oldest = next(iter(deltas))
+            dropped.append(deltas.pop(oldest)["archive"])
+    index["latest"] = bundle_id
+    index["full"] = full_archive
+    index["updated_at"] = datetime.now(timezone.utc).isoformat()
+    return index, dropped
+
+def upload_descriptor_bundle(bundle_dir, bundle_id=None, target=None, delta_dir=None):
+    """
+    Packs ``bundle_dir`` (a snapshot, see snapshot_bundle) and the delta in
+    ``delta_dir``, if any, uploads the archives and their manifests, then the
+    bundle index. Returns a result dict.
+    """
+    target = target or upload_target_from_env()
+    if target is None:
         logger.warning("HF_UPLOAD_TOKEN not set. Skipping Hugging Face upload.")
+        if delta_dir:
+            shutil.rmtree(delta_dir, ignore_errors=True)
         return {
             "hf_upload_attempted": False,
             "hf_upload_successful": False,
             "error": "HF_UPLOAD_TOKEN not set."
         }
 
-    api = HfApi(token=hf_token)
-    repo_id = "JakeTurner616/mtg-cards-SIFT-Features"
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    commit_message = f"Overwrite resources-nightly.zip ({today})"
-
-    files_to_zip = [
-        ("resources/run/candidate_features.h5", "candidate_features.h5"),
-        ("resources/run/faiss_ivf.index", "faiss_ivf.index"),
-        ("resources/run/id_map.json", "id_map.json"),
-    ]
-
-    zip_name = "resources-nightly.zip"
-    logger.info(f"📦 Starting to create {zip_name}. This may take a few minutes...")
-
+    packages = []
     try:
-        zip_start = time.time()
-        with zipfile.ZipFile(zip_name, 'w', compression=zipfile.ZIP_DEFLATED) as zipf:
-            for local_path, arcname in files_to_zip:
-                if os.path.exists(local_path):
-                    zipf.write(local_path, arcname)
-                    logger.info(f"✅ Added {arcname} to {zip_name}")
-                else:
-                    logger.warning(f"⚠️ Skipped {local_path} (file not found)")
-        zip_elapsed = time.time() - zip_start
-        zip_size_mb = os.path.getsize(zip_name) / (1024 * 1024)
-        logger.info(f"✅ Finished creating {zip_name} ({zip_size_mb:.2f} MB) in {zip_elapsed:.2f} seconds.")
-
-        logger.info("🚀 Starting upload to Hugging Face...")
-        upload_start = time.time()
-        api.upload_file(
-            path_or_fileobj=zip_name,
-            path_in_repo=zip_name,
-            repo_id=repo_id,
-            repo_type="dataset",
-            commit_message=commit_message,
-        )
-        upload_elapsed = time.time() - upload_start
-        logger.info(f"✅ Uploaded {zip_name} to Hugging Face in {upload_elapsed:.2f} seconds.")
-        logger.info(f"🎉 Upload complete. {zip_name} now overwrites the same path in {repo_id}.")
+        packed = package_bundle(bundle_dir, PACKAGE_DIR, bundle_id=bundle_id,
+                                compression=BUNDLE_COMPRESSION, level=BUNDLE_ZSTD_LEVEL)
+
+        packages.append(packed)
+        delta_entry = None
+        if delta_dir:
+            with open(os.path.join(delta_dir, DELTA_JSON), 'r') as f:
+                base_bundle_id = json.load(f)["base_bundle_id"]
+            packed_delta = package_bundle(delta_dir, PACKAGE_DIR, bundle_id=bundle_id,
+                                          compression=BUNDLE_COMPRESSION, level=BUNDLE_ZSTD_LEVEL,
+                                          files=DELTA_FILES, basename=delta_basename(base_bundle_id, bundle_id))
+            delta_entry = {"base_bundle_id": base_bundle_id, "archive": os.path.basename(packed_delta["archive_path"])}
+            packages.insert(0, packed_delta)
 
-        os.remove(zip_name)
-        logger.info("🧹 Cleaned up local zip file after upload.")
+        logger.info(f"🚀 Uploading {', '.join(os.path.basename(p['archive_path']) for p in packages)} to {target.name}...")
+        upload_start = time.perf_counter()
+        # Archives first, manifests next, index last: a reader that sees a new
+        # manifest or index entry can always fetch what it points to.
+        for package in packages:
+            target.upload(package["archive_path"], os.path.basename(package["archive_path"]))
+            target.upload(package["manifest_path"], os.path.basename(package["manifest_path"]))
+        bundle_index, dropped = update_bundle_index(bundle_id, os.path.basename(packed["archive_path"]), delta_entry)
+        index_path = os.path.join(PACKAGE_DIR, BUNDLE_INDEX_NAME)
+        with open(index_path + ".tmp", 'w') as f:
+            json.dump(bundle_index, f, indent=2)
+        os.replace(index_path + ".tmp", index_path)
+        target.upload(index_path, BUNDLE_INDEX_NAME)
+        for archive in dropped:
+            for name in (archive, f"{archive}.manifest.json"):
+                try:
+                    target.delete(name)
+                except Exception as e:
+                    logger.warning(f"⚠️ Could not delete old delta {name}: {e}")
+        upload_elapsed = time.perf_counter() - upload_start
+        logger.info(f"✅ Uploaded bundle {bundle_id} to {target.name} in {upload_elapsed:.2f} seconds.")
 
         return {
             "hf_upload_attempted": True,
             "hf_upload_successful": True,
-            "hf_repo_id": repo_id,
-            "hf_commit_message": commit_message,
-            "zip_size_mb": round(zip_size_mb, 2),
-            "zip_elapsed_sec": round(zip_elapsed, 2),
+            "upload_target": target.name,
+            "archive": os.path.basename(packed["archive_path"]),
+            "compression": packed["compression"],
+            "pack_seconds": packed["pack_seconds"],
+            "pack_input_bytes": packed["input_bytes"],
+            "pack_archive_bytes": packed["archive_bytes"],
+            "delta_archive_bytes": packages[0]["archive_bytes"] if delta_dir else None,
             "upload_elapsed_sec": round(upload_elapsed, 2)
         }
 
     except Exception as e:
-        logger.error(f"❌ HF upload failed: {e}")
+        logger.error(f"❌ Bundle upload failed: {e}")
         return {
             "hf_upload_attempted": True,
             "hf_upload_successful": False,
+            "upload_target": target.name,
             "error": str(e)
         }
 
+    finally:
+        # Uploads are not retried, so the archives and the delta are dropped
+        # whether or not this one succeeded.
+        for package in packages:
+            for path in (package["archive_path"], package["manifest_path"]):
+                if os.path.exists(path):
+                    os.remove(path)
+        if delta_dir:
+            shutil.rmtree(delta_dir, ignore_errors=True)
+
+# ─── Background queue ──────────────────────────────────────────────────
+
+_upload_queue = queue.Queue()
+_upload_thread = None
+_upload_thread_lock = threading.Lock()
+
+def _upload_loop():
+    while True:
+        snapshot_dir, bundle_id, on_done, delta_dir = _upload_queue.get()
+        try:
+            result = upload_descriptor_bundle(snapshot_dir, bundle_id, delta_dir=delta_dir)
+            if on_done:
+                on_done(result)
+        except Exception as e:
+            logger.exception(f"❌ Background upload of bundle {bundle_id} failed: {e}")
+        finally:
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+            _upload_queue.task_done()
+
+def enqueue_bundle_upload(run_dir, bundle_id, on_done=None, delta_dir=None):
+    """Queues a pack + upload of ``run_dir``; ``on_done(result)`` runs on the upload thread."""
+    global _upload_thread
+    with _upload_thread_lock:
+        if _upload_thread is None:
+            _upload_thread = threading.Thread(target=_upload_loop, name="bundle-upload", daemon=True)
+            _upload_thread.start()
+    _upload_queue.put((snapshot_bundle(run_dir), bundle_id, on_done, delta_dir))
+    logger.info(f"📤 Queued upload of bundle {bundle_id} ({_upload_queue.qsize()} pending).")
+
+def wait_for_uploads():
+    """Blocks until every queued upload has finished (e.g. before a one-shot process exits)."""
+    _upload_queue.join()
+
 if __name__ == "__main__":
-    result = upload_descriptor_bundle_to_hf()
+    snapshot_dir = snapshot_bundle("resources/run")
+    try:
+        result = upload_descriptor_bundle(snapshot_dir, (read_manifest("resources/run") or {}).get("bundle_id"))
+    finally:
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
     print(result)
@@ -0,0 +1,122 @@
+# descriptor_update/workers/extraction_pipeline.py
+# Two-stage descriptor extraction: a thread pool downloads card images over a
+# pooled keep-alive session and hands the raw bytes to a process pool that does
+# the CPU work. Downloads and extraction overlap, so neither stage idles on the other.
+
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .feature_worker import process_downloaded_record
+from .image_cache import cache_key
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_TIMEOUT = 10
+
+def available_cpus():
+    # Respects CPU pinning (e.g. UPDATE_WORKER_CPUS), unlike os.cpu_count().
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def build_session(pool_size):
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=("GET",))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def download_record(session, row, image_cache=None, offline=False):
+    """Returns (row, raw_bytes or None, source) where source is "cache", "network" or None."""
+    image_url = row['image_url']
+    if not image_url:
+        logger.warning(f"⚠️ No image URL for scryfall_id {row['scryfall_id']}")
+        return row, None, None
+
+    key = None
+    if image_cache is not None:
+        key = cache_key(image_url, row.get('image_status'), row.get('highres_image'))
+        cached = image_cache.get(key)
+        if cached is not None:
+            return row, cached, "cache"
+    if offline:
+        logger.warning(f"⚠️ Offline build: {image_url} not in image cache; skipping.")
+        return row, None, None
+
+    try:
+        response = session.get(image_url, timeout=DOWNLOAD_TIMEOUT)
+        if response.status_code != 200:
+            logger.warning(f"⚠️ Failed to fetch image from {image_url} (status code: {response.status_code})")
+            return row, None, None
+        if image_cache is not None:
+            try:
+                image_cache.put(key, response.content)
+            except OSError as e:
+                logger.warning(f"⚠️ Could not cache {image_url}: {e}")
+        return row, response.content, "network"
+    except requests.RequestException as e:
+        logger.warning(f"⚠️ Exception downloading {image_url}: {e}")
+        return row, None, None
+
+def extract_features_pipelined(records, download_concurrency=16, cpu_workers=None, max_in_flight=None,
+                               image_cache=None, offline=False, stats=None):
+    """
+    Yields one result dict (see ``process_downloaded_record``) per record that
+    downloaded and extracted successfully, in completion order.
+
+    ``max_in_flight`` bounds downloads plus pending extractions, so raw image
+    bytes never pile up faster than the CPU pool can consume them. With an
+    ``image_cache``, images are read from it first; ``offline`` never touches
+    the network. ``stats``, if given, is filled with cache/network/failed counts.
+    """
+    stats = stats if stats is not None else {}
+    for field in ("from_cache", "from_network", "failed"):
+        stats.setdefault(field, 0)
+    cpu_workers = cpu_workers or available_cpus()
+    max_in_flight = max_in_flight or download_concurrency + 2 * cpu_workers
+    records_iter = iter(records)
+
+    with build_session(download_concurrency) as session, \
+            ThreadPoolExecutor(max_workers=download_concurrency) as download_pool, \
+            ProcessPoolExecutor(max_workers=cpu_workers) as cpu_pool:
+        downloads = set()
+        extractions = set()
+
+        def refill():
+            while len(downloads) < download_concurrency and len(downloads) + len(extractions) < max_in_flight:
+                row = next(records_iter, None)
+                if row is None:
+                    return
+                downloads.add(download_pool.submit(download_record, session, row, image_cache, offline))
+
+        refill()
+        while downloads or extractions:
+            done, _ = wait(downloads | extractions, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in downloads:
+                    downloads.discard(future)
+                    row, raw_bytes, source = future.result()
+                    if raw_bytes is None:
+                        stats["failed"] += 1
+                        continue
+                    stats["from_cache" if source == "cache" else "from_network"] += 1
+                    extractions.add(cpu_pool.submit(process_downloaded_record, row, raw_bytes))
+                else:
+                    extractions.discard(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.warning(f"⚠️ Extraction worker failed: {e}")
+                        result = None
+                    if result:
+                        yield result
+                    else:
+                        stats["failed"] += 1
+            refill()
@@ -1,82 +1,80 @@
 import cv2
 import numpy as np
-import requests
 import logging
+from utils.feature_store import keypoints_to_array, quantize_descriptors
 
 logger = logging.getLogger(__name__)
 
-def serialize_keypoints(keypoints):
-    return [{
-        'pt': kp.pt,
-        'size': kp.size,
-        'angle': kp.angle,
-        'response': kp.response,
-        'octave': kp.octave,
-        'class_id': kp.class_id
-    } for kp in keypoints]
+MAX_FEATURES = 100
 
-def extract_features_from_url(image_url):
-    try:
-        response = requests.get(image_url, timeout=10)
-        if response.status_code != 200:
-            logger.warning(f"⚠️ Failed to fetch image from {image_url} (status code: {response.status_code})")
-            return None, None
+# Created once per worker process on first use and reused for every record.
+_extractors = {}
 
-        image_array = np.asarray(bytearray(response.content), dtype=np.uint8)
-        image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+def _get_extractors():
+    if not _extractors:
+        _extractors["sift"] = cv2.SIFT_create(nfeatures=MAX_FEATURES)
+        _extractors["clahe"] = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    return _extractors["sift"], _extractors["clahe"]
+
+def extract_features_from_bytes(raw_bytes, source=""):
+    """
+    Decodes an image and extracts up to MAX_FEATURES RootSIFT descriptors.
+    Returns (keypoints, descriptors) as a KEYPOINT_DTYPE array and uint8
+    quantized RootSIFT (the feature-store format), or (None, None).
+    """
+    try:
+        image = cv2.imdecode(np.frombuffer(raw_bytes, np.uint8), cv2.IMREAD_COLOR)
         if image is None:
-            logger.warning(f"⚠️ Failed to decode image from {image_url}")
+            logger.warning(f"⚠️ Failed to decode image from {source}")
             return None, None
 
+        sift, clahe = _get_extractors()
         resized = cv2.resize(image, (256, 256))
         lab = cv2.cvtColor(resized, cv2.COLOR_BGR2LAB)
         L, A, B = cv2.split(lab)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
         L_clahe = clahe.apply(L)
         lab_clahe = cv2.merge((L_clahe, A, B))
         gray = cv2.cvtColor(cv2.cvtColor(lab_clahe, cv2.COLOR_LAB2BGR), cv2.COLOR_BGR2GRAY)
 
-        sift = cv2.SIFT_create(nfeatures=100)
         keypoints, descriptors = sift.detectAndCompute(gray, None)
         if descriptors is None or len(keypoints) == 0:
-            logger.warning(f"⚠️ No descriptors found in {image_url}")
+            logger.warning(f"⚠️ No descriptors found in {source}")
             return None, None
 
-        if len(keypoints) > 100:
+        if len(keypoints) > MAX_FEATURES:
             sorted_kp_des = sorted(zip(keypoints, descriptors), key=lambda x: -x[0].response)
-            keypoints, descriptors = zip(*sorted_kp_des[:100])
+            keypoints, descriptors = zip(*sorted_kp_des[:MAX_FEATURES])
             descriptors = np.array(descriptors)
 
         eps = 1e-7
         descriptors = descriptors / (descriptors.sum(axis=1, keepdims=True) + eps)
-        descriptors = np.sqrt(descriptors).astype(np.float16)
+        descriptors = quantize_descriptors(np.sqrt(descriptors))
 
-        logger.info(f"✅ Extracted {len(keypoints)} keypoints from {image_url}")
-
-        return serialize_keypoints(keypoints), descriptors.tolist()
+        logger.debug(f"✅ Extracted {len(keypoints)} keypoints from {source}")
+        return keypoints_to_array(keypoints), descriptors
 
     except Exception as e:
-        logger.warning(f"⚠️ Exception during feature extraction from {image_url}: {e}")
+        logger.warning(f"⚠️ Exception during feature extraction from {source}: {e}")
         return None, None
 
-def process_record(row):
+def process_downloaded_record(row, raw_bytes):
+    """
+    CPU stage of the descriptor build: runs in a worker process on bytes the
+    download stage already fetched. Keypoints and descriptors come back as
+    numpy arrays (each pickled as one buffer) ready to append to the store.
+    """
     scryfall_id = row['scryfall_id']
-    image_url = row['image_url']
-    face_index = row['face_index']
-
-    if not image_url:
-        logger.warning(f"⚠️ No image URL for scryfall_id {scryfall_id}")
-        return None
-
-    keypoints, descriptors = extract_features_from_url(image_url)
+    keypoints, descriptors = extract_features_from_bytes(raw_bytes, row['image_url'])
     if descriptors is None:
         logger.warning(f"⚠️ Descriptor extraction failed for scryfall_id {scryfall_id}")
         return None
 
     return {
         "scryfall_id": scryfall_id,
-        "image_url": image_url,
-        "face_index": face_index,
+        "image_url": row['image_url'],
+        "face_index": row['face_index'],
+        "image_status": row.get('image_status'),
+        "highres_image": row.get('highres_image'),
         "keypoints": keypoints,
         "descriptors": descriptors
-    }
\ No newline at end of file
+    }
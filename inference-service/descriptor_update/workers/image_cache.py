@@ -0,0 +1,94 @@
+# descriptor_update/workers/image_cache.py
+# On-disk cache of source card images for descriptor builds.
+#
+# Entries are keyed by image URL plus Scryfall's image_status/highres_image, so
+# a rescan (e.g. lowres → highres_scan) is a different key and gets downloaded,
+# while re-extraction with new parameters reads everything from disk. Eviction
+# is least-recently-used by file mtime once the cache grows past max_bytes.
+
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Evict down to this fraction of max_bytes so every put near the limit doesn't rescan.
+EVICT_TARGET_RATIO = 0.9
+
+def cache_key(image_url, image_status=None, highres_image=None):
+    material = f"{image_url}|{image_status or ''}|{bool(highres_image)}"
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+class ImageCache:
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._entries())
+        logger.info(f"🗄️ Image cache at {root}: {self._total_bytes / 1e9:.2f} GB used of {max_bytes / 1e9:.2f} GB")
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _entries(self):
+        for shard in os.listdir(self.root):
+            shard_dir = os.path.join(self.root, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for fname in os.listdir(shard_dir):
+                if fname.endswith(".tmp"):
+                    continue
+                path = os.path.join(shard_dir, fname)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        existing = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._total_bytes += len(data) - existing
+            over_limit = self._total_bytes > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def evict(self):
+        with self._lock:
+            target = self.max_bytes * EVICT_TARGET_RATIO
+            if self._total_bytes <= target:
+                return
+            entries = sorted(self._entries(), key=lambda e: e[2])
+            removed = 0
+            for path, size, _ in entries:
+                if self._total_bytes <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                self._total_bytes -= size
+                removed += 1
+        logger.info(f"🧹 Evicted {removed} images from cache; {self._total_bytes / 1e9:.2f} GB remain")
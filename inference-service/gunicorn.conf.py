@@ -0,0 +1,58 @@
+# gunicorn.conf.py
+# Production serving mode for the inference service.
+#
+# preload_app loads the model once in the master; workers are forked afterwards
+# and share the FAISS index pages copy-on-write instead of each holding a copy.
+
+import multiprocessing
+import os
+import shutil
+
+# Workers share their metric values through this directory (prometheus_client
+# multiprocess mode) so /metrics reports the whole service, not just the worker
+# that happens to answer the scrape. Must be set before the app is imported.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/inference-metrics")
+
+# The directory must exist before preload_app imports the app, whose metrics
+# open their files at import time. It is cleared once per master so totals
+# start from zero; SIGHUP reloads re-read this file while the old workers'
+# files still count, so they only make sure it exists.
+_metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+if os.environ.get("INFERENCE_METRICS_MASTER_PID") != str(os.getpid()):
+    os.environ["INFERENCE_METRICS_MASTER_PID"] = str(os.getpid())
+    shutil.rmtree(_metrics_dir, ignore_errors=True)
+os.makedirs(_metrics_dir, exist_ok=True)
+
+bind = "0.0.0.0:5001"
+preload_app = True
+workers = int(os.getenv("INFERENCE_WORKERS", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.getenv("INFERENCE_WORKER_THREADS", 2))
+timeout = int(os.getenv("INFERENCE_WORKER_TIMEOUT", 120))
+graceful_timeout = 30
+
+accesslog = "-"
+errorlog = "-"
+capture_output = True
+
+
+def when_ready(server):
+    from utils.worker_runtime import mark_gunicorn_master
+    mark_gunicorn_master()
+
+
+def post_fork(server, worker):
+    from utils.worker_runtime import init_worker
+    init_worker(server.cfg.workers)
+
+
+def post_worker_init(worker):
+    # Warm up inside each worker, before it accepts connections; FAISS's OpenMP
+    # pool must not be started in the master ahead of the fork.
+    from utils.warmup import run_warmup
+    run_warmup()
+
+
+def child_exit(server, worker):
+    from utils.metrics import mark_worker_dead
+    mark_worker_dead(worker.pid)
@@ -1,18 +1,26 @@
 import logging
 from flask import Blueprint, request, jsonify
-import cv2
-import numpy as np
 import time
 from flasgger import swag_from
-from utils.sift_features import find_closest_card_ransac
-from utils.resource_manager import load_resources
+from utils.sift_features import find_closest_card_ransac, find_closest_cards_ransac_batch
+from utils.card_detection import detect_card_quads, rectify_card
+from utils.image_quality import quality_gate
+from utils.image_decode import decode_roi_image
 from db.postgres_pool import pg_pool
+from utils.inference_metrics import observe_stages, not_found
+from utils.shadow_eval import maybe_submit as maybe_submit_shadow
+from utils.model_state import model_resources
+from config import PAGE_DECODE_TARGET, PAGE_MAX_CARDS
 
 logger = logging.getLogger(__name__)
 infer_bp = Blueprint('infer_bp', __name__)
 
-# Load heavy resources once at startup
-faiss_index, hf, id_map = load_resources()
+def _record_stage_timings(outcome, timings, stage_prefix=""):
+    """Logs the per-stage timings and feeds them into the stage-latency histogram.
+    /infer/page uses ``stage_prefix="page_"`` so page totals stay out of the per-ROI series."""
+    logger.info("Inference %s: %s", outcome,
+                ", ".join(f"{stage}={t * 1000:.1f}ms" for stage, t in timings.items()))
+    observe_stages(timings, prefix=stage_prefix)
 
 @infer_bp.route('/infer', methods=['POST'])
 @swag_from({
@@ -52,6 +60,16 @@ faiss_index, hf, id_map = load_resources()
                 'application/json': {'error': 'No ROI image uploaded.'}
             }
         },
+        422: {
+            'description': 'ROI rejected by the image-quality gate; the client should reshoot',
+            'examples': {
+                'application/json': {
+                    'error': 'Image quality too low.',
+                    'reason': 'too_blurry',
+                    'metrics': {'laplacian_var': 4.2, 'mean_luminance': 131.0, 'keypoint_estimate': 3}
+                }
+            }
+        },
         404: {
             'description': 'No matching card found',
             'examples': {
@@ -69,24 +87,46 @@ faiss_index, hf, id_map = load_resources()
 })
 def infer():
     overall_start = time.perf_counter()
+    timings = {}
 
     if 'roi_image' not in request.files:
         return jsonify({'error': 'No ROI image uploaded.'}), 400
     file = request.files['roi_image']
-    file_bytes = np.frombuffer(file.read(), np.uint8)
+    raw_bytes = file.read()
 
-    roi_image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+    roi_image, decode_info = decode_roi_image(raw_bytes)
+    timings['decode'] = decode_info['decode_time']
     if roi_image is None:
         return jsonify({'error': 'Invalid image format.'}), 400
 
+    start = time.perf_counter()
+    reason, quality_metrics = quality_gate(roi_image)
+    timings['quality_gate'] = time.perf_counter() - start
+    if reason:
+        timings['total'] = time.perf_counter() - overall_start
+        _record_stage_timings(f"rejected ({reason})", timings)
+        return jsonify({
+            'error': 'Image quality too low.',
+            'reason': reason,
+            'metrics': quality_metrics
+        }), 422
+
+    start = time.perf_counter()
     best_candidate, _, keypoints, processed_img, debug_info = find_closest_card_ransac(
         roi_image, k=3
     )
+    timings['match'] = time.perf_counter() - start
+    maybe_submit_shadow(raw_bytes, roi_image, best_candidate, timings['match'],
+                        debug_info.get('best_inliers', 0), model_resources.get('bundle_id'))
 
     if not best_candidate:
         logger.debug("SIFT/RANSAC found no matching card in ROI")
+        timings['total'] = time.perf_counter() - overall_start
+        _record_stage_timings("no match", timings)
+        not_found.inc(endpoint="infer", reason="no_match")
         return jsonify({'error': 'No matching card found.'}), 404
 
+    db_start = time.perf_counter()
     conn = cur = None
     try:
         conn = pg_pool.getconn()
@@ -99,6 +139,7 @@ def infer():
         row = cur.fetchone()
 
         if not row:
+            not_found.inc(endpoint="infer", reason="not_in_db")
             return jsonify({'error': 'Card not found in database.'}), 404
 
         card_name, finishes, set_field, set_name, prices, image_uris, collector_number = row
@@ -113,6 +154,10 @@ def infer():
         if conn:
             pg_pool.putconn(conn)
 
+    timings['db_lookup'] = time.perf_counter() - db_start
+    timings['total'] = time.perf_counter() - overall_start
+    _record_stage_timings("matched", timings)
+
     result = {
         'predicted_card_id': best_candidate,
         'predicted_card_name': card_name,
@@ -124,3 +169,172 @@ def infer():
         'collector_number': collector_number
     }
     return jsonify(result), 200
+
+
+@infer_bp.route('/infer/page', methods=['POST'])
+@swag_from({
+    'summary': 'Predict every MTG card in a binder-page photo',
+    'description': (
+        'Detects card quadrilaterals in a photo of a whole binder page, rectifies each to the '
+        '256x256 ROI used by /infer, and matches them all in one batched SIFT + RANSAC pass. '
+        'Cards are returned in reading order.'
+    ),
+    'consumes': ['multipart/form-data'],
+    'parameters': [
+        {
+            'name': 'page_image',
+            'in': 'formData',
+            'type': 'file',
+            'required': True,
+            'description': 'Photo of a binder page or several cards laid out (JPEG/PNG)'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Cards detected; each entry is either a match or carries an error',
+            'examples': {
+                'application/json': {
+                    'detected': 2,
+                    'matched': 1,
+                    'cards': [
+                        {
+                            'index': 0,
+                            'quad': [[12.0, 8.0], [250.0, 10.0], [248.0, 340.0], [10.0, 338.0]],
+                            'predicted_card_id': 'e5a30b6a-dfd5-4b4b-b4ff-9de81d36e9fd',
+                            'predicted_card_name': 'Lightning Bolt',
+                            'finishes': ['nonfoil', 'foil'],
+                            'set': 'M11',
+                            'set_name': 'Magic 2011',
+                            'prices': {'usd': '3.50'},
+                            'image_uris': {
+                                'normal': 'https://cards.scryfall.io/normal/front/e/5/e5a30b6a-dfd5-4b4b-b4ff-9de81d36e9fd.jpg'
+                            },
+                            'collector_number': '150'
+                        },
+                        {
+                            'index': 1,
+                            'quad': [[270.0, 9.0], [508.0, 11.0], [506.0, 341.0], [268.0, 339.0]],
+                            'error': 'No matching card found.'
+                        }
+                    ]
+                }
+            }
+        },
+        400: {
+            'description': 'Missing or invalid image',
+            'examples': {
+                'application/json': {'error': 'No page image uploaded.'}
+            }
+        },
+        404: {
+            'description': 'No card outlines found in the photo',
+            'examples': {
+                'application/json': {'error': 'No cards detected in page image.'}
+            }
+        },
+        500: {
+            'description': 'Internal server error',
+            'examples': {
+                'application/json': {'error': 'Error fetching card details'}
+            }
+        }
+    },
+    'tags': ['Inference']
+})
+def infer_page():
+    overall_start = time.perf_counter()
+    timings = {}
+
+    if 'page_image' not in request.files:
+        return jsonify({'error': 'No page image uploaded.'}), 400
+    file = request.files['page_image']
+
+    page_image, decode_info = decode_roi_image(file.read(), target=PAGE_DECODE_TARGET)
+    timings['decode'] = decode_info['decode_time']
+    if page_image is None:
+        return jsonify({'error': 'Invalid image format.'}), 400
+    scale = decode_info['reduction']
+
+    start = time.perf_counter()
+    quads = detect_card_quads(page_image, max_cards=PAGE_MAX_CARDS)
+    timings['detect'] = time.perf_counter() - start
+    if not quads:
+        timings['total'] = time.perf_counter() - overall_start
+        _record_stage_timings("page without cards", timings, stage_prefix="page_")
+        not_found.inc(endpoint="infer_page", reason="no_cards_detected")
+        return jsonify({'error': 'No cards detected in page image.'}), 404
+
+    cards = []
+    rois = []
+    start = time.perf_counter()
+    for index, quad in enumerate(quads):
+        # Report quads in the coordinates of the uploaded image, not the reduced decode.
+        entry = {'index': index, 'quad': (quad.astype(float) * scale).round(1).tolist()}
+        roi = rectify_card(page_image, quad)
+        reason, _ = quality_gate(roi)
+        if reason:
+            entry['error'] = 'Image quality too low.'
+            entry['reason'] = reason
+        else:
+            rois.append((entry, roi))
+        cards.append(entry)
+    timings['rectify'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matches = find_closest_cards_ransac_batch([roi for _, roi in rois], k=3) if rois else []
+    timings['match'] = time.perf_counter() - start
+
+    matched_ids = []
+    for (entry, _), (best_candidate, *_rest) in zip(rois, matches):
+        if best_candidate:
+            entry['predicted_card_id'] = best_candidate
+            matched_ids.append(best_candidate)
+        else:
+            entry['error'] = 'No matching card found.'
+
+    db_start = time.perf_counter()
+    details = {}
+    if matched_ids:
+        conn = cur = None
+        try:
+            conn = pg_pool.getconn()
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT id::text, name, finishes, "set", set_name, prices, image_uris, collector_number
+                FROM cards
+                WHERE id = ANY(%s::uuid[])
+            """, (list(set(matched_ids)),))
+            for card_id, name, finishes, set_field, set_name, prices, image_uris, collector_number in cur.fetchall():
+                details[card_id] = {
+                    'predicted_card_name': name,
+                    'finishes': finishes,
+                    'set': set_field,
+                    'set_name': set_name,
+                    'prices': prices,
+                    'image_uris': image_uris,
+                    'collector_number': collector_number.lstrip('0') if collector_number is not None else None
+                }
+        except Exception as e:
+            return jsonify({'error': 'Error fetching card details', 'details': str(e)}), 500
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                pg_pool.putconn(conn)
+    timings['db_lookup'] = time.perf_counter() - db_start
+
+    matched = 0
+    for entry in cards:
+        card_id = entry.get('predicted_card_id')
+        if not card_id:
+            continue
+        if card_id in details:
+            entry.update(details[card_id])
+            matched += 1
+        else:
+            del entry['predicted_card_id']
+            entry['error'] = 'Card not found in database.'
+
+    timings['total'] = time.perf_counter() - overall_start
+    _record_stage_timings(f"page ({matched}/{len(cards)} matched)", timings, stage_prefix="page_")
+    return jsonify({'detected': len(cards), 'matched': matched, 'cards': cards}), 200
@@ -0,0 +1,19 @@
+from flask import Blueprint, Response
+from flasgger import swag_from
+from utils.metrics import render_metrics
+
+metrics_bp = Blueprint('metrics_bp', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+@swag_from({
+    'summary': 'Prometheus metrics',
+    'description': 'In-process inference-service metrics in the Prometheus text exposition format.',
+    'produces': ['text/plain'],
+    'responses': {
+        200: {'description': 'Metrics text'}
+    },
+    'tags': ['Monitoring']
+})
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
@@ -1,15 +1,17 @@
 from datetime import datetime, timedelta, timezone
 from flask import Blueprint, request, jsonify
-import cv2
 from flask_cors import cross_origin
-import numpy as np
 import json
 import uuid
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from flasgger import swag_from
 
 from utils.sift_features import find_closest_card_ransac
-from utils.resource_manager import load_resources
+from utils.image_decode import decode_roi_image
+from utils.burst_state import (get_decided_result, record_frame, pick_burst_winner, claim_decision,
+                               release_decision, mark_decided)
+from utils.inference_metrics import not_found
+from config import BURST_MODE_ENABLED
 from db.postgres_pool import pg_pool
 from utils.cors import get_cors_origin
 import logging
@@ -18,9 +20,6 @@ logger = logging.getLogger(__name__)
 
 mobile_infer_bp = Blueprint('mobile_infer_bp', __name__, url_prefix="/api/mobile-infer")
 
-# Load resources once
-faiss_index, hf, id_map = load_resources()
-
 @mobile_infer_bp.route("/create", methods=["POST"])
 @jwt_required()
 @cross_origin(**get_cors_origin())
@@ -87,6 +86,25 @@ def mobile_infer_create():
         if conn:
             pg_pool.putconn(conn)
 
+def _check_session(session_id):
+    """Returns an error response for an unknown or expired session, else None."""
+    conn = pg_pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT expires_at FROM mobile_scan_sessions WHERE id = %s", (session_id,))
+            session_row = cur.fetchone()
+    finally:
+        pg_pool.putconn(conn)
+
+    if not session_row:
+        logger.warning(f"[SUBMIT] Session not found: {session_id}")
+        return jsonify({'error': 'Session not found'}), 404
+
+    if session_row[0] < datetime.now(timezone.utc):
+        logger.info(f"[SUBMIT] Session expired: {session_id}")
+        return jsonify({'error': 'Session expired'}), 403
+    return None
+
 @mobile_infer_bp.route("/submit/<session_id>", methods=["POST"])
 @swag_from({
     'tags': ['Mobile Inference'],
@@ -110,7 +128,7 @@ def mobile_infer_create():
     ],
     'responses': {
         200: {
-            'description': 'Scan submitted and stored',
+            'description': 'Scan submitted and stored (status "success"), or the session was already decided by an earlier frame (status "already_decided")',
             'schema': {
                 'type': 'object',
                 'properties': {
@@ -118,6 +136,16 @@ def mobile_infer_create():
                 }
             }
         },
+        202: {
+            'description': 'Burst mode: frame recorded, evidence not yet conclusive; keep sending frames',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'status': {'type': 'string', 'example': 'accumulating'},
+                    'frames': {'type': 'integer'}
+                }
+            }
+        },
         400: {
             'description': 'Missing or invalid image',
             'schema': {
@@ -151,9 +179,27 @@ def mobile_infer_submit(session_id):
         logger.warning(f"[SUBMIT] No roi_image provided for session {session_id}")
         return jsonify({'error': 'Missing roi_image'}), 400
 
+    # Validate session before any burst state is written for it
+    try:
+        session_error = _check_session(session_id)
+    except Exception as e:
+        logger.exception(f"[SUBMIT] Failed to validate session {session_id}")
+        return jsonify({'error': str(e)}), 500
+    if session_error:
+        return session_error
+
+    if BURST_MODE_ENABLED:
+        try:
+            decided = get_decided_result(session_id)
+        except Exception:
+            logger.exception(f"[SUBMIT] Burst state unavailable for session {session_id}")
+            decided = None
+        if decided:
+            logger.info(f"[SUBMIT] Session {session_id} already decided; skipping frame")
+            return jsonify({"status": "already_decided", **decided}), 200
+
     file = request.files['roi_image']
-    file_bytes = np.frombuffer(file.read(), np.uint8)
-    roi_image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+    roi_image, _ = decode_roi_image(file.read())
 
     if roi_image is None:
         logger.warning(f"[SUBMIT] Invalid image format for session {session_id}")
@@ -168,28 +214,49 @@ def mobile_infer_submit(session_id):
         logger.exception("[SUBMIT] Error during RANSAC processing")
         return jsonify({'error': f'RANSAC processing failed: {str(e)}'}), 500
 
+    if BURST_MODE_ENABLED:
+        try:
+            burst_state = record_frame(
+                session_id,
+                debug_info.get('faiss_candidate_counts', {}),
+                debug_info.get('candidate_debug', {})
+            )
+        except Exception:
+            logger.exception(f"[SUBMIT] Failed to record burst frame for session {session_id}")
+            burst_state = None
+
+        if burst_state:
+            if not best_candidate:
+                best_candidate = pick_burst_winner(burst_state)
+            if not best_candidate:
+                logger.info(f"[SUBMIT] Accumulating evidence for session {session_id} "
+                            f"({burst_state['frames']} frames so far)")
+                return jsonify({'status': 'accumulating', 'frames': burst_state['frames']}), 202
+
     if not best_candidate:
         logger.info(f"[SUBMIT] No matching card found for session {session_id}")
+        not_found.inc(endpoint="mobile_submit", reason="no_match")
         return jsonify({'error': 'No matching card found'}), 404
 
+    # Only one frame of a burst may store its result; the rest report the winner.
+    claimed = False
+    if BURST_MODE_ENABLED:
+        try:
+            claimed = claim_decision(session_id, best_candidate)
+        except Exception:
+            logger.exception(f"[SUBMIT] Burst state unavailable for session {session_id}")
+        else:
+            if not claimed:
+                logger.info(f"[SUBMIT] Session {session_id} decided by another frame; skipping insert")
+                return jsonify({"status": "already_decided", **(get_decided_result(session_id) or {})}), 200
+
     conn = None
     cur = None
+    stored = False
     try:
         conn = pg_pool.getconn()
         cur = conn.cursor()
 
-        # Validate session
-        cur.execute("SELECT expires_at FROM mobile_scan_sessions WHERE id = %s", (session_id,))
-        session_row = cur.fetchone()
-
-        if not session_row:
-            logger.warning(f"[SUBMIT] Session not found: {session_id}")
-            return jsonify({'error': 'Session not found'}), 404
-
-        if session_row[0] < datetime.now(timezone.utc):
-            logger.info(f"[SUBMIT] Session expired: {session_id}")
-            return jsonify({'error': 'Session expired'}), 403
-
         # Fetch card metadata
         cur.execute("""
             SELECT name, finishes, "set", set_name, prices, image_uris, collector_number
@@ -228,6 +295,13 @@ def mobile_infer_submit(session_id):
         ))
 
         conn.commit()
+        stored = True
+
+        if claimed:
+            try:
+                mark_decided(session_id, scan_data)
+            except Exception:
+                logger.exception(f"[SUBMIT] Failed to mark session {session_id} as decided")
 
         logger.info(f"[SUBMIT] Successfully stored scan result for session {session_id}")
 
@@ -242,6 +316,11 @@ def mobile_infer_submit(session_id):
         return jsonify({'error': str(e)}), 500
 
     finally:
+        if claimed and not stored:
+            try:
+                release_decision(session_id)
+            except Exception:
+                logger.exception(f"[SUBMIT] Failed to release decision for session {session_id}")
         if cur:
             cur.close()
         if conn:
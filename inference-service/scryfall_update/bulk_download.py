@@ -0,0 +1,208 @@
+# scryfall_update/bulk_download.py
+# Streaming download of Scryfall bulk files (several GB for all_cards).
+#
+# The response body is written to <dest>.part in fixed-size chunks exactly as
+# it arrives on the wire (gzip-encoded when the server compresses it), so a
+# dropped connection resumes with a Range request from the last byte on disk.
+# If-Range pins the resume to the same ETag / Last-Modified; if the file changed
+# upstream the server sends it whole and the partial is discarded. A partial that
+# is already complete (run stopped before decoding) skips the request, or is
+# recognised from the server's 416, and goes straight to decoding. Once complete,
+# the body is decoded chunk by chunk into <dest>.tmp and renamed over <dest>.
+# Peak memory is a few chunks regardless of file size.
+#
+# <dest>.meta.json keeps the validators of the finished file, and the next
+# download sends them as If-None-Match / If-Modified-Since; a 304 leaves <dest>
+# untouched.
+
+import os
+import json
+import time
+import zlib
+import logging
+from email.utils import formatdate
+
+import requests
+import urllib3
+
+logger = logging.getLogger(__name__)
+
+CHUNK_BYTES = 1024 * 1024
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+RETRY_BACKOFF_SECONDS = 2.0
+# zlib wbits per Content-Encoding; gzip is what Scryfall serves.
+DECODERS = {"identity": None, "gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+class BulkDownloadError(RuntimeError):
+    pass
+
+def _read_json(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_json(path, data):
+    with open(path + ".tmp", 'w') as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+def _remove(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+def _validators(response):
+    return {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "content_encoding": response.headers.get("Content-Encoding", "identity").lower(),
+    }
+
+def _decode_to(part_path, tmp_path, content_encoding):
+    """Decodes the on-disk body into ``tmp_path``; returns the decoded size."""
+    if content_encoding not in DECODERS:
+        raise BulkDownloadError(f"Unsupported Content-Encoding: {content_encoding}")
+    wbits = DECODERS[content_encoding]
+    decoder = zlib.decompressobj(wbits) if wbits is not None else None
+    size = 0
+    with open(part_path, 'rb') as src, open(tmp_path, 'wb') as out:
+        for chunk in iter(lambda: src.read(CHUNK_BYTES), b""):
+            if decoder is None:
+                out.write(chunk)
+                size += len(chunk)
+                continue
+            # max_length keeps a highly compressible chunk from expanding in memory.
+            data = decoder.decompress(chunk, CHUNK_BYTES)
+            while data:
+                out.write(data)
+                size += len(data)
+                data = decoder.decompress(decoder.unconsumed_tail, CHUNK_BYTES)
+        if decoder is not None:
+            tail = decoder.flush()
+            out.write(tail)
+            size += len(tail)
+            if not decoder.eof:
+                raise BulkDownloadError(f"{part_path} ended before the end of the {content_encoding} stream")
+        out.flush()
+        os.fsync(out.fileno())
+    return size
+
+def _fetch_body(session, url, part_path, state_path, conditional_headers):
+    """
+    Streams the body into ``part_path``, resuming a partial download when the
+    validators match. Returns the response validators, or None on 304.
+    """
+    state = _read_json(state_path)
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Accept-Encoding": "gzip", **conditional_headers}
+    if offset and state.get("url") == url and (state.get("etag") or state.get("last_modified")):
+        saved = {k: state.get(k) for k in ("etag", "last_modified", "content_encoding")}
+        if state.get("length") == offset:
+            # Fully downloaded on an earlier run that stopped before decoding.
+            logger.info(f"⏭️ {part_path} is already complete; decoding it.")
+            return saved
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = state.get("etag") or state["last_modified"]
+    else:
+        offset = 0
+
+    with session.get(url, headers=headers, stream=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)) as response:
+        if response.status_code == 304:
+            return None
+        if response.status_code == 416 and offset:
+            # Range starts at or past the end: either the partial is complete, or it
+            # no longer fits the upstream file and is restarted from byte 0.
+            total = response.headers.get("Content-Range", "").rpartition("/")[2]
+            if total == str(offset):
+                logger.info(f"⏭️ {part_path} is already complete; decoding it.")
+                return saved
+            logger.info(f"🔁 {part_path} does not fit {url} (size {total or 'unknown'}); restarting from byte 0.")
+            _remove(part_path, state_path)
+            response.close()
+            return _fetch_body(session, url, part_path, state_path, conditional_headers)
+        if response.status_code == 206 and offset:
+            logger.info(f"⏯️ Resuming {url} from byte {offset}.")
+            validators = saved
+        elif response.status_code == 200:
+            if offset:
+                logger.info(f"🔁 {url} changed or ignores ranges; restarting from byte 0.")
+            offset = 0
+            validators = _validators(response)
+        else:
+            raise BulkDownloadError(f"HTTP {response.status_code} downloading {url}")
+
+        expected = response.headers.get("Content-Length")
+        expected = offset + int(expected) if expected is not None else None
+        if response.status_code == 200:
+            _write_json(state_path, {"url": url, **validators, "length": expected})
+        with open(part_path, 'r+b' if offset else 'wb') as f:
+            f.truncate(offset)
+            f.seek(offset)
+            # Raw wire bytes: range offsets refer to the encoded body.
+            for chunk in response.raw.stream(CHUNK_BYTES, decode_content=False):
+                f.write(chunk)
+            written = f.tell()
+        if expected is not None and written != expected:
+            raise BulkDownloadError(f"{url} ended after {written} of {expected} bytes")
+    return validators
+
+def download_bulk_file(url, dest, retries=5, session=None):
+    """
+    Downloads ``url`` to ``dest`` unless the server reports it unchanged.
+    Returns True if ``dest`` was replaced, False on 304 Not Modified.
+    """
+    part_path = dest + ".part"
+    state_path = part_path + ".json"
+    meta_path = dest + ".meta.json"
+
+    conditional_headers = {}
+    if os.path.exists(dest):
+        meta = _read_json(meta_path)
+        if meta.get("url") != url:
+            meta = {}
+        if meta.get("etag"):
+            conditional_headers["If-None-Match"] = meta["etag"]
+        conditional_headers["If-Modified-Since"] = meta.get("last_modified") or \
+            formatdate(os.path.getmtime(dest), usegmt=True)
+
+    own_session = session is None
+    session = session or requests.Session()
+    start = time.perf_counter()
+    try:
+        for attempt in range(retries + 1):
+            try:
+                validators = _fetch_body(session, url, part_path, state_path, conditional_headers)
+                break
+            except (requests.RequestException, urllib3.exceptions.HTTPError, BulkDownloadError) as e:
+                if attempt == retries:
+                    raise
+                logger.warning(f"⚠️ Download of {url} interrupted ({e}); retrying.")
+                time.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt)
+    finally:
+        if own_session:
+            session.close()
+
+    if validators is None:
+        _remove(part_path, state_path)
+        logger.info(f"✅ {url} not modified (304); keeping {dest}.")
+        return False
+
+    wire_bytes = os.path.getsize(part_path)
+    tmp_path = dest + ".tmp"
+    try:
+        size = _decode_to(part_path, tmp_path, validators["content_encoding"])
+    except (zlib.error, BulkDownloadError):
+        # A corrupt body can't be resumed; start over next time.
+        _remove(part_path, state_path, tmp_path)
+        raise
+    os.replace(tmp_path, dest)
+    _write_json(meta_path, {"url": url, "etag": validators["etag"], "last_modified": validators["last_modified"]})
+    _remove(part_path, state_path)
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"⬇️ Downloaded {dest}: {wire_bytes / 1e6:.1f} MB on the wire, {size / 1e6:.1f} MB decoded, "
+                f"in {elapsed:.1f}s.")
+    return True
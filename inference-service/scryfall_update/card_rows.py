@@ -0,0 +1,186 @@
+# scryfall_update/card_rows.py
+# Turns the Scryfall bulk file into COPY text for the cards table.
+#
+# Card objects are parsed with ijson (the C backend when it is installed) and
+# transformed into ready-to-COPY rows in chunks. By default that runs serially
+# in the importing process. SCRYFALL_IMPORT_WORKERS > 1 hands the chunks to a
+# process pool instead. The COPY stream pulls results in file order, which
+# bounds the work in flight. Kept free of database imports so worker processes
+# don't open a connection pool.
+
+import os
+import json
+import decimal
+import hashlib
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+
+import ijson
+
+logger = logging.getLogger(__name__)
+
+# Serial by default. Parsing (~25% of serial time) and pickling the chunks
+# stay on the parent, which caps the pool at ~3x on any core count. On one CPU
+# the pool is slower (benchmark.import_benchmark: 5.2k rows/s serial, 4.0k
+# pooled). Raise this only where that benchmark shows the pool ahead.
+IMPORT_WORKERS = int(os.getenv("SCRYFALL_IMPORT_WORKERS", 1))
+IMPORT_CHUNK_CARDS = int(os.getenv("SCRYFALL_IMPORT_CHUNK_CARDS", 500))
+
+ALLOWED_LAYOUTS = {
+    'normal', 'split', 'flip', 'transform', 'modal_dfc', 'meld', 'leveler',
+    'class', 'case', 'saga', 'adventure', 'mutate', 'prototype', 'battle',
+    'planar', 'scheme', 'vanguard', 'token', 'double_faced_token', 'emblem',
+    'augment', 'host', 'art_series', 'reversible_card'
+}
+
+columns = [
+    "oracle_id", "id", "object", "multiverse_ids", "mtgo_id", "tcgplayer_id", "cardmarket_id", "name",
+    "lang", "released_at", "uri", "scryfall_uri", "layout", "highres_image", "image_status", "image_uris",
+    "mana_cost", "cmc", "type_line", "oracle_text", "power", "toughness", "colors", "color_identity",
+    "keywords", "legalities", "games", "reserved", "game_changer", "foil", "nonfoil", "finishes", "oversized",
+    "promo", "reprint", "variation", "set_id", "set", "set_name", "set_type", "set_uri", "set_search_uri",
+    "scryfall_set_uri", "rulings_uri", "prints_search_uri", "collector_number", "digital", "rarity",
+    "watermark", "flavor_text", "card_back_id", "artist", "artist_ids", "illustration_id", "border_color",
+    "frame", "frame_effects", "security_stamp", "full_art", "textless", "booster", "story_spotlight",
+    "edhrec_rank", "preview", "prices", "related_uris", "purchase_uris", "card_faces"
+]
+
+# Columns that feed content_hash. Prices move daily and are refreshed separately.
+HASH_EXCLUDED_COLUMNS = {"prices"}
+hashed_columns = [col for col in columns if col not in HASH_EXCLUDED_COLUMNS]
+
+def parse_date(date_str):
+    if not date_str:
+        return None
+    try:
+        return datetime.fromisoformat(date_str).date()
+    except ValueError:
+        return None
+
+def convert_decimals(obj):
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    elif isinstance(obj, dict):
+        return {k: convert_decimals(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_decimals(item) for item in obj]
+    else:
+        return obj
+
+def process_card(card):
+    """Card object as parsed with ``use_float=True`` (no Decimals) -> {column: value}."""
+    layout = card.get("layout")
+    if layout not in ALLOWED_LAYOUTS:
+        logger.warning(f"Unexpected layout '{layout}' for card {card.get('name')}")
+    if "card_faces" in card and not card.get("image_uris"):
+        aggregated = [face["image_uris"] for face in card["card_faces"] if "image_uris" in face]
+        if aggregated:
+            card["image_uris"] = aggregated
+    processed = {col: card.get(col) for col in columns}
+    processed["released_at"] = parse_date(processed["released_at"])
+    return processed
+
+def card_content_hash(processed):
+    """Stable hash of everything but prices, compared against cards.content_hash on import."""
+    payload = json.dumps([processed.get(col) for col in hashed_columns], sort_keys=True,
+                         separators=(",", ":"), default=str)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+def copy_field(val):
+    """Formats one value for COPY ... FROM STDIN text format."""
+    if val is None:
+        return "\\N"
+    if isinstance(val, bool):
+        return "t" if val else "f"
+    if isinstance(val, (dict, list)):
+        val = json.dumps(val, separators=(",", ":"), ensure_ascii=False)
+    elif isinstance(val, date):
+        val = val.isoformat()
+    else:
+        val = str(val)
+    return val.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+def copy_line(row):
+    return ("\t".join(copy_field(val) for val in row) + "\n").encode("utf-8")
+
+def transform_cards(cards):
+    """
+    Card objects -> (COPY text for columns + content_hash, row count). Runs in
+    import worker processes, so the parent only parses JSON and feeds COPY.
+    """
+    lines = []
+    for card in cards:
+        processed = process_card(card)
+        if not processed.get("id"):
+            continue
+        row = tuple(processed[col] for col in columns) + (card_content_hash(processed),)
+        lines.append(copy_line(row))
+    return b"".join(lines), len(lines)
+
+class CopyRowStream:
+    """
+    File-like view of an iterator of (COPY text, row count) blocks; psycopg2
+    pulls it in read() sized pieces, so blocks are only produced as fast as
+    the database consumes them.
+    """
+
+    def __init__(self, blocks):
+        self._blocks = iter(blocks)
+        self._pending = b""
+        self.rows = 0
+
+    def read(self, size=-1):
+        parts, length = [self._pending], len(self._pending)
+        while size < 0 or length < size:
+            block = next(self._blocks, None)
+            if block is None:
+                break
+            data, count = block
+            parts.append(data)
+            length += len(data)
+            self.rows += count
+        data = b"".join(parts)
+        if size < 0:
+            self._pending = b""
+            return data
+        self._pending = data[size:]
+        return data[:size]
+
+def copy_blocks(rows):
+    """One COPY block per row, for small row iterators built in this process."""
+    for row in rows:
+        yield copy_line(row), 1
+
+def iter_card_chunks(json_file, chunk_cards, parser=ijson):
+    """``parser`` is the ijson module or one backend (see ijson.get_backend)."""
+    with open(json_file, 'rb') as f:
+        chunk = []
+        for card in parser.items(f, 'item', use_float=True):
+            chunk.append(card)
+            if len(chunk) >= chunk_cards:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+def iter_card_copy_blocks(json_file, workers=IMPORT_WORKERS, chunk_cards=IMPORT_CHUNK_CARDS, parser=ijson):
+    """
+    Yields COPY blocks for the bulk file in file order. Chunks of parsed cards
+    are transformed on a process pool with at most 2 * ``workers`` chunks in
+    flight, so a slow COPY stops parsing instead of buffering the file.
+    """
+    chunks = iter_card_chunks(json_file, chunk_cards, parser)
+    if workers <= 1:
+        for chunk in chunks:
+            yield transform_cards(chunk)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(pool.submit(transform_cards, chunk))
+            if len(in_flight) >= 2 * workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
@@ -0,0 +1,102 @@
+# scryfall_update/price_refresh.py
+# Price-only refresh of the cards table from the Scryfall bulk file.
+#
+# Only each card's id and prices are pulled out of the ijson event stream;
+# the rest of the card object is never built. The prices are COPYed into an
+# unlogged staging table and applied with one UPDATE that touches only cards
+# whose prices changed. The typed price_* columns are generated from
+# cards.prices, and none of them are indexed, so these updates stay HOT.
+#
+#   python -m scryfall_update.price_refresh
+
+import logging
+import os
+import time
+
+import ijson
+
+from db.postgres_pool import pg_pool
+from scryfall_update.card_rows import CopyRowStream, convert_decimals, copy_blocks
+from scryfall_update.update import (
+    BULK_DATA_TYPE, COPY_READ_BYTES, DATA_DIR, current_wal_lsn,
+    download_latest_json, last_processed_at, mark_processed, wal_bytes_since,
+)
+
+logger = logging.getLogger(__name__)
+
+STAGING_TABLE = "card_prices_import"
+
+def iter_card_prices(json_file):
+    """Yields (card_id, prices) for every card in the bulk file."""
+    card_id, prices = None, None
+    with open(json_file, 'rb') as f:
+        for prefix, event, value in ijson.parse(f):
+            if prefix == "item.id":
+                card_id = value
+            elif prefix == "item.prices" and event == "start_map":
+                prices = {}
+            elif prefix.startswith("item.prices.") and prices is not None:
+                prices[prefix[len("item.prices."):]] = convert_decimals(value)
+            elif prefix == "item" and event == "end_map":
+                if card_id:
+                    yield card_id, prices
+                card_id, prices = None, None
+
+def refresh_prices(json_file):
+    """Applies the bulk file's prices to cards. Returns counts, rows/sec and WAL bytes."""
+    conn = pg_pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            wal_start = current_wal_lsn(cur)
+            cur.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+            cur.execute(f"CREATE UNLOGGED TABLE {STAGING_TABLE} (id UUID, prices JSONB)")
+
+            start = time.perf_counter()
+            stream = CopyRowStream(copy_blocks(iter_card_prices(json_file)))
+            cur.copy_expert(f"COPY {STAGING_TABLE} (id, prices) FROM STDIN", stream, size=COPY_READ_BYTES)
+            conn.commit()
+
+            cur.execute(f"""
+                UPDATE cards SET prices = staged.prices
+                FROM {STAGING_TABLE} AS staged
+                WHERE cards.id = staged.id
+                  AND cards.prices IS DISTINCT FROM staged.prices
+            """)
+            updated = cur.rowcount
+            conn.commit()
+            elapsed = time.perf_counter() - start
+
+            wal_bytes = wal_bytes_since(cur, wal_start)
+            cur.execute(f"DROP TABLE {STAGING_TABLE}")
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pg_pool.putconn(conn)
+
+    stats = {
+        "rows": stream.rows,
+        "updated": updated,
+        "seconds": round(elapsed, 1),
+        "rows_per_second": round(stream.rows / elapsed) if elapsed else None,
+        "wal_bytes": wal_bytes,
+    }
+    wal_text = f"{wal_bytes / 1e6:.1f} MB WAL" if wal_bytes is not None else "WAL volume unavailable"
+    logger.info(f"💲 Refreshed prices for {updated} of {stream.rows} cards in {elapsed:.1f}s "
+                f"({stats['rows_per_second']} rows/s, {wal_text}).")
+    return stats
+
+def main():
+    json_file = os.path.join(DATA_DIR, f"scryfall-{BULK_DATA_TYPE}.json")
+    server_updated_at, _ = download_latest_json(json_file)
+    if last_processed_at(json_file, "prices") == server_updated_at:
+        logger.info("✅ Prices already refreshed from the current Scryfall bulk file. Skipping.")
+        return None
+    stats = refresh_prices(json_file)
+    mark_processed(json_file, "prices", server_updated_at)
+    return stats
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    main()
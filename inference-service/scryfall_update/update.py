@@ -1,16 +1,18 @@
 import logging
 import os
-import decimal
 import time
 import random
 from datetime import datetime, timezone
 
 import requests
+import psycopg2
 import psycopg2.extras
 import ijson
 from filelock import FileLock, Timeout
 
 from db.postgres_pool import pg_pool
+from scryfall_update.bulk_download import download_bulk_file
+from scryfall_update.card_rows import CopyRowStream, columns, iter_card_copy_blocks, parse_date
 
 # ---------------------------
 # LOGGING CONFIGURATION
@@ -21,95 +23,137 @@ logger = logging.getLogger(__name__)
 # CONFIGURATION
 # ---------------------------
 BULK_DATA_TYPE = "all_prints"
+# Unlogged table the bulk file is COPYed into before the set-based merge into cards.
+STAGING_TABLE = "cards_import"
+COPY_READ_BYTES = 1024 * 1024
 DATA_DIR = os.getenv("SCRYFALL_DATA_DIR", "data")
 os.makedirs(DATA_DIR, exist_ok=True)
 
-ALLOWED_LAYOUTS = {
-    'normal', 'split', 'flip', 'transform', 'modal_dfc', 'meld', 'leveler',
-    'class', 'case', 'saga', 'adventure', 'mutate', 'prototype', 'battle',
-    'planar', 'scheme', 'vanguard', 'token', 'double_faced_token', 'emblem',
-    'augment', 'host', 'art_series', 'reversible_card'
-}
-
-columns = [
-    "oracle_id", "id", "object", "multiverse_ids", "mtgo_id", "tcgplayer_id", "cardmarket_id", "name",
-    "lang", "released_at", "uri", "scryfall_uri", "layout", "highres_image", "image_status", "image_uris",
-    "mana_cost", "cmc", "type_line", "oracle_text", "power", "toughness", "colors", "color_identity",
-    "keywords", "legalities", "games", "reserved", "game_changer", "foil", "nonfoil", "finishes", "oversized",
-    "promo", "reprint", "variation", "set_id", "set", "set_name", "set_type", "set_uri", "set_search_uri",
-    "scryfall_set_uri", "rulings_uri", "prints_search_uri", "collector_number", "digital", "rarity",
-    "watermark", "flavor_text", "card_back_id", "artist", "artist_ids", "illustration_id", "border_color",
-    "frame", "frame_effects", "security_stamp", "full_art", "textless", "booster", "story_spotlight",
-    "edhrec_rank", "preview", "prices", "related_uris", "purchase_uris", "card_faces"
-]
-
 set_columns = [
     "id", "code", "name", "uri", "scryfall_uri", "search_uri", "released_at", "set_type", "card_count",
     "parent_set_code", "digital", "nonfoil_only", "foil_only", "icon_svg_uri"
 ]
 
 # ---------------------------
-# HELPERS
+# COPY LOADING
 # ---------------------------
-def parse_date(date_str):
-    if not date_str:
-        return None
+def current_wal_lsn(cur):
+    """Returns the current WAL insert position, or None if the role may not read it."""
     try:
-        return datetime.fromisoformat(date_str).date()
-    except ValueError:
+        cur.execute("SAVEPOINT wal_lsn")
+        cur.execute("SELECT pg_current_wal_insert_lsn()")
+        lsn = cur.fetchone()[0]
+        cur.execute("RELEASE SAVEPOINT wal_lsn")
+        return lsn
+    except psycopg2.Error:
+        cur.execute("ROLLBACK TO SAVEPOINT wal_lsn")
         return None
 
-def convert_decimals(obj):
-    if isinstance(obj, decimal.Decimal):
-        return float(obj)
-    elif isinstance(obj, dict):
-        return {k: convert_decimals(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_decimals(item) for item in obj]
-    else:
-        return obj
+def wal_bytes_since(cur, lsn):
+    if lsn is None:
+        return None
+    end = current_wal_lsn(cur)
+    if end is None:
+        return None
+    cur.execute("SELECT pg_wal_lsn_diff(%s, %s)", (end, lsn))
+    return int(cur.fetchone()[0])
 
-# ---------------------------
-# CARD PROCESSING
-# ---------------------------
-def process_card(card):
-    layout = card.get("layout")
-    if layout not in ALLOWED_LAYOUTS:
-        logger.warning(f"Unexpected layout '{layout}' for card {card.get('name')}")
-    if "card_faces" in card and not card.get("image_uris"):
-        aggregated = [face["image_uris"] for face in card["card_faces"] if "image_uris" in face]
-        if aggregated:
-            card["image_uris"] = aggregated
-    processed = {}
-    for col in columns:
-        val = card.get(col)
-        if col == "released_at":
-            processed[col] = parse_date(val)
-        else:
-            if isinstance(val, decimal.Decimal):
-                processed[col] = float(val)
-            elif isinstance(val, (dict, list)):
-                processed[col] = psycopg2.extras.Json(convert_decimals(val))
-            else:
-                processed[col] = val
-    return processed
+def merge_staged_cards(cur):
+    """
+    Set-based merge from the staging table, as three statements that each
+    touch only the rows they change:
+      - cards whose content_hash differs are rewritten,
+      - cards with the same hash get only their prices updated, and only if
+        the prices changed; prices is not indexed, so those updates stay HOT,
+      - cards not in the table yet are inserted.
+    Unchanged cards are only read. (INSERT ... ON CONFLICT DO UPDATE ... WHERE
+    would lock, and so write WAL for, every conflicting row even when the WHERE
+    is false.) Returns (new, changed, price_only).
+    """
+    copy_columns = columns + ["content_hash"]
+    col_list = ", ".join(copy_columns)
+    staged = f"(SELECT DISTINCT ON (id) * FROM {STAGING_TABLE} ORDER BY id)"
+    set_clause = ", ".join(f"{col} = staged.{col}" for col in copy_columns if col != "id")
+    cur.execute(f"""
+        UPDATE cards SET {set_clause}
+        FROM {staged} AS staged
+        WHERE cards.id = staged.id
+          AND cards.content_hash IS DISTINCT FROM staged.content_hash
+    """)
+    changed = cur.rowcount
+    cur.execute(f"""
+        UPDATE cards SET prices = staged.prices
+        FROM {staged} AS staged
+        WHERE cards.id = staged.id
+          AND cards.content_hash = staged.content_hash
+          AND cards.prices IS DISTINCT FROM staged.prices
+    """)
+    price_only = cur.rowcount
+    cur.execute(f"""
+        INSERT INTO cards ({col_list})
+        SELECT {col_list} FROM {staged} AS staged
+        WHERE NOT EXISTS (SELECT 1 FROM cards WHERE cards.id = staged.id)
+        ON CONFLICT (id) DO NOTHING
+    """)
+    return cur.rowcount, changed, price_only
 
-def upsert_batch(data_batch):
+def import_cards(json_file):
+    """
+    Streams the bulk file into an unlogged staging table with COPY, then merges
+    it into cards with merge_staged_cards (an UPDATE of changed cards, an
+    UPDATE of price-only changes and an INSERT of new cards). Returns counts,
+    rows/sec and WAL bytes.
+    """
     conn = pg_pool.getconn()
     try:
-        cursor = conn.cursor()
-        update_columns = [col for col in columns if col != "id"]
-        set_clause = ", ".join(f"{col} = EXCLUDED.{col}" for col in update_columns)
-        sql = f"""
-        INSERT INTO cards ({', '.join(columns)}) VALUES %s
-        ON CONFLICT (id) DO UPDATE SET {set_clause}
-        """
-        psycopg2.extras.execute_values(cursor, sql, data_batch, template=None, page_size=1000)
-        conn.commit()
-        cursor.close()
+        with conn.cursor() as cur:
+            wal_start = current_wal_lsn(cur)
+            cur.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+            cur.execute(f"CREATE UNLOGGED TABLE {STAGING_TABLE} (LIKE cards)")
+
+            copy_start = time.perf_counter()
+            if ijson.backend != "yajl2_c":
+                logger.warning(f"⚠️ ijson is using the {ijson.backend} backend; install yajl for the C parser.")
+            stream = CopyRowStream(iter_card_copy_blocks(json_file))
+            cur.copy_expert(f"COPY {STAGING_TABLE} ({', '.join(columns)}, content_hash) FROM STDIN", stream,
+                            size=COPY_READ_BYTES)
+            conn.commit()
+            copy_seconds = time.perf_counter() - copy_start
+            logger.info(f"📥 Copied {stream.rows} cards into {STAGING_TABLE} in {copy_seconds:.1f}s "
+                        f"({stream.rows / copy_seconds:.0f} rows/s).")
+
+            merge_start = time.perf_counter()
+            new, changed, price_only = merge_staged_cards(cur)
+            conn.commit()
+            merge_seconds = time.perf_counter() - merge_start
+
+            wal_bytes = wal_bytes_since(cur, wal_start)
+            cur.execute(f"DROP TABLE {STAGING_TABLE}")
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         pg_pool.putconn(conn)
 
+    total_seconds = copy_seconds + merge_seconds
+    stats = {
+        "rows": stream.rows,
+        "new": new,
+        "changed": changed,
+        "price_only": price_only,
+        "unchanged": stream.rows - new - changed - price_only,
+        "copy_seconds": round(copy_seconds, 1),
+        "merge_seconds": round(merge_seconds, 1),
+        "rows_per_second": round(stream.rows / total_seconds) if total_seconds else None,
+        "wal_bytes": wal_bytes,
+    }
+    wal_text = f"{wal_bytes / 1e6:.1f} MB WAL" if wal_bytes is not None else "WAL volume unavailable"
+    logger.info(f"✅ Merged {stream.rows} cards in {merge_seconds:.1f}s: {new} new, {changed} changed, "
+                f"{price_only} price-only, {stats['unchanged']} unchanged; "
+                f"{stats['rows_per_second']} rows/s overall, {wal_text}.")
+    return stats
+
 # ---------------------------
 # SET PROCESSING
 # ---------------------------
@@ -180,14 +224,23 @@ def download_latest_json(json_file):
         if local_mtime >= server_updated_at:
             logger.info("Local Scryfall JSON is up to date — skipping download.")
             return server_updated_at, False
-    r = requests.get(download_uri, timeout=10)
-    if r.status_code != 200:
-        raise RuntimeError(f"Failed to download: {r.status_code}")
-    with open(json_file, "wb") as f:
-        f.write(r.content)
+    downloaded = download_bulk_file(download_uri, json_file)
     os.utime(json_file, (server_updated_at.timestamp(), server_updated_at.timestamp()))
-    logger.info(f"Downloaded and saved {json_file}")
-    return server_updated_at, True
+    if downloaded:
+        logger.info(f"Downloaded and saved {json_file}")
+    return server_updated_at, downloaded
+
+def last_processed_at(json_file, job):
+    """updated_at of the bulk file ``job`` ("import" or "prices") last finished, or None."""
+    try:
+        with open(f"{json_file}.{job}", 'r') as f:
+            return datetime.fromisoformat(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def mark_processed(json_file, job, server_updated_at):
+    with open(f"{json_file}.{job}", 'w') as f:
+        f.write(server_updated_at.isoformat())
 
 def is_card_table_populated():
     conn = pg_pool.getconn()
@@ -205,42 +258,28 @@ def main():
     json_file = os.path.join(DATA_DIR, f"scryfall-{BULK_DATA_TYPE}.json")
     server_updated_at, downloaded = download_latest_json(json_file)
 
+    # The price refresh may have downloaded this file already, so compare against the last import too.
+    pending = downloaded or last_processed_at(json_file, "import") != server_updated_at
+
     # Determine if the cards table has data
     db_populated = is_card_table_populated()
 
-    if not downloaded and db_populated:
+    if not pending and db_populated:
         logger.info("✅ Data is already up-to-date and the cards table is populated. Skipping Scryfall import.")
         return
-    elif not downloaded and not db_populated:
+    elif not pending and not db_populated:
         logger.info("ℹ️ Local JSON is up-to-date but the cards table is empty. Proceeding with import to populate DB.")
     elif downloaded:
         logger.info("⬇️ New Scryfall data downloaded. Proceeding with import.")
+    else:
+        logger.info("ℹ️ Local JSON is newer than the last import. Proceeding with import.")
 
-    # Proceed with import if we reach here
-    batch_size = 10000
-    batch = []
-    total_count = 0
-    logger.info("🔄 Starting card processing...")
-
-    with open(json_file, 'rb') as f:
-        cards = ijson.items(f, 'item')
-        for card in cards:
-            processed = process_card(card)
-            if not processed.get("id"):
-                continue
-            row = tuple(processed.get(col) for col in columns)
-            batch.append(row)
-            total_count += 1
-            if total_count % batch_size == 0:
-                logger.info(f"⬆️ Upserting batch — {total_count} cards processed so far.")
-                upsert_batch(batch)
-                batch = []
-
-    if batch:
-        upsert_batch(batch)
-
-    logger.info(f"✅ Finished processing {total_count} cards.")
+    logger.info("🔄 Starting card import...")
+    import_cards(json_file)
     import_sets()
+    # The import applies prices too, so the price refresh can skip this file.
+    mark_processed(json_file, "import", server_updated_at)
+    mark_processed(json_file, "prices", server_updated_at)
 
 # ---------------------------
 # LOCK & ENTRYPOINT
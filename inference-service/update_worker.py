@@ -0,0 +1,133 @@
+# update_worker.py
+# Standalone entry point for the nightly Scryfall + descriptor update. Runs in
+# its own process (or container), never inside the serving app. Serving
+# processes only learn about a new bundle through the promotion manifest.
+#
+#   python update_worker.py          # block and run on the nightly schedule
+#   python update_worker.py --once   # run a single update now and exit
+#   python update_worker.py --sync   # follow the published bundle once and exit
+#   python update_worker.py --prices # refresh card prices once and exit
+#
+# With UPDATE_WORKER_MODE=sync the scheduled job follows the published bundle
+# (delta chain, else full download) instead of rebuilding it.
+
+import argparse
+import logging
+import os
+
+import redis
+from apscheduler.schedulers.blocking import BlockingScheduler
+from dotenv import load_dotenv
+
+from config import (
+    LOG_LEVEL,
+    UPDATE_WORKER_LOG_FILE_PATH,
+    UPDATE_WORKER_MODE,
+    BUNDLE_SYNC_INTERVAL_MINUTES,
+    PRICE_REFRESH_CRON_HOUR,
+    UPDATE_WORKER_CRON_HOUR,
+    UPDATE_WORKER_NICE,
+    UPDATE_WORKER_CPUS,
+    UPDATE_LOCK_TIMEOUT_SECONDS,
+)
+from utils.logging_setup import configure_logging
+
+load_dotenv()
+configure_logging(UPDATE_WORKER_LOG_FILE_PATH, LOG_LEVEL)
+logger = logging.getLogger("update_worker")
+
+def apply_resource_limits():
+    """Lower scheduling priority and optionally pin to a CPU subset.
+    Both are inherited by the ProcessPoolExecutor used for SIFT extraction."""
+    if UPDATE_WORKER_NICE:
+        os.nice(UPDATE_WORKER_NICE)
+    if UPDATE_WORKER_CPUS and hasattr(os, "sched_setaffinity"):
+        cpus = {int(c) for c in UPDATE_WORKER_CPUS.split(",") if c.strip()}
+        os.sched_setaffinity(0, cpus)
+    logger.info(f"⚙️ Update worker niceness={os.nice(0)} cpus={UPDATE_WORKER_CPUS or 'all'}")
+
+def safe_model_update():
+    # Imported here so the heavy pipeline modules load only in this process.
+    from scryfall_update.update import main as scryfall_update_main
+    from descriptor_update.descriptor_update import run_descriptor_update_pipeline
+
+    r = redis.Redis(host=os.getenv("REDIS_HOST", "mtg-redis"), port=6379)
+    lock = r.lock("model_update_lock", timeout=UPDATE_LOCK_TIMEOUT_SECONDS)
+    if lock.acquire(blocking=False):
+        try:
+            logger.info("[update-worker] Acquired lock — running Scryfall + descriptor update.")
+            scryfall_update_main()
+            run_descriptor_update_pipeline()
+            logger.info("[update-worker] Update complete.")
+        finally:
+            lock.release()
+    else:
+        logger.info("[update-worker] Skipping update — another worker is running.")
+
+def safe_price_refresh():
+    from scryfall_update.price_refresh import main as price_refresh_main
+
+    r = redis.Redis(host=os.getenv("REDIS_HOST", "mtg-redis"), port=6379)
+    lock = r.lock("model_update_lock", timeout=UPDATE_LOCK_TIMEOUT_SECONDS)
+    if lock.acquire(blocking=False):
+        try:
+            logger.info("[update-worker] Acquired lock — refreshing card prices.")
+            price_refresh_main()
+        except Exception as e:
+            logger.error(f"[update-worker] Price refresh failed: {e}", exc_info=True)
+        finally:
+            lock.release()
+    else:
+        logger.info("[update-worker] Skipping price refresh — another worker is running.")
+
+def sync_bundle():
+    from utils.resource_manager import sync_published_bundle
+    try:
+        result = sync_published_bundle()
+        logger.info(f"[update-worker] Bundle sync: {result}")
+    except Exception as e:
+        logger.error(f"[update-worker] Bundle sync failed: {e}", exc_info=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Nightly Scryfall + descriptor update worker")
+    parser.add_argument("--once", action="store_true", help="Run one update immediately and exit")
+    parser.add_argument("--sync", action="store_true", help="Sync to the published bundle once and exit")
+    parser.add_argument("--prices", action="store_true", help="Refresh card prices once and exit")
+    args = parser.parse_args()
+
+    apply_resource_limits()
+
+    if args.sync:
+        sync_bundle()
+        return
+
+    if args.once or args.prices or UPDATE_WORKER_MODE != "sync":
+        # Schema changes run here, committed on their own, not inside the imports' transactions.
+        from db.init_tables import init_card_columns
+        init_card_columns()
+
+    if args.prices:
+        safe_price_refresh()
+        return
+
+    if args.once:
+        safe_model_update()
+        # The bundle upload runs on a background queue; let it finish before exiting.
+        from descriptor_update.upload_to_hf import wait_for_uploads
+        wait_for_uploads()
+        return
+
+    scheduler = BlockingScheduler()
+    if UPDATE_WORKER_MODE == "sync":
+        scheduler.add_job(sync_bundle, trigger="interval", minutes=BUNDLE_SYNC_INTERVAL_MINUTES)
+        logger.info(f"🕑 Update worker syncing the published bundle every {BUNDLE_SYNC_INTERVAL_MINUTES} min.")
+    else:
+        scheduler.add_job(safe_model_update, trigger="cron", hour=UPDATE_WORKER_CRON_HOUR)
+        logger.info(f"🕑 Update worker scheduled daily at {UPDATE_WORKER_CRON_HOUR:02d}:00.")
+        if PRICE_REFRESH_CRON_HOUR >= 0:
+            scheduler.add_job(safe_price_refresh, trigger="cron", hour=PRICE_REFRESH_CRON_HOUR)
+            logger.info(f"🕑 Price refresh scheduled daily at {PRICE_REFRESH_CRON_HOUR:02d}:00.")
+    scheduler.start()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# utils/bundle_delta.py
+# Delta bundles: the changes between two consecutive descriptor bundles.
+#
+# Incremental builds keep the trained FAISS index and only remove / add the
+# vectors of changed cards. FAISS ids are never renumbered: removed positions
+# stay in id_map as null and new vectors get ids from the end of id_map. A
+# delta records exactly those operations plus the changed cards' features:
+#
+#   delta.json          base/target bundle ids, removed cards and FAISS ids,
+#                       added cards with their FAISS id ranges, and sha256 of
+#                       the resulting faiss_ivf.index and id_map.json
+#   delta_features.h5   feature store (layout v2) with the added cards
+#
+# Builder and replicas apply the same operations in the same order through
+# apply_faiss_delta, so a replica on the base bundle ends up with byte-identical
+# index files, which apply_delta checks before anything is used.
+
+import os
+import json
+import hashlib
+import logging
+
+import faiss
+import numpy as np
+
+from utils.feature_store import FeatureStore, dequantize_descriptors
+
+logger = logging.getLogger(__name__)
+
+DELTA_JSON = "delta.json"
+DELTA_FEATURES = "delta_features.h5"
+DELTA_FILES = [DELTA_JSON, DELTA_FEATURES]
+CHECKED_FILES = ["faiss_ivf.index", "id_map.json"]
+
+class DeltaMismatch(RuntimeError):
+    """The delta does not apply to this bundle; callers fall back to a full download."""
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def id_map_holes(id_map):
+    return sum(1 for card_id in id_map if card_id is None)
+
+def faiss_ids_for_cards(id_map, card_ids):
+    card_ids = set(card_ids)
+    return [i for i, card_id in enumerate(id_map) if card_id is not None and card_id in card_ids]
+
+def assign_faiss_ids(id_map, card_ids, store):
+    """[card_id, first FAISS id, count] for each card, continuing from the end of id_map."""
+    added = []
+    next_id = len(id_map)
+    for card_id in card_ids:
+        count = len(store.get_raw(card_id)[1])
+        added.append([card_id, next_id, count])
+        next_id += count
+    return added
+
+def apply_faiss_delta(index, id_map, removed_faiss_ids, added_cards, store):
+    """Removes and adds vectors in place; ``store`` supplies the added cards' descriptors."""
+    if removed_faiss_ids:
+        index.remove_ids(np.asarray(removed_faiss_ids, dtype=np.int64))
+        for faiss_id in removed_faiss_ids:
+            id_map[faiss_id] = None
+    for card_id, start, count in added_cards:
+        if start != len(id_map):
+            raise DeltaMismatch(f"{card_id} expects FAISS id {start}, id map ends at {len(id_map)}")
+        _, descriptors = store.get_raw(card_id)
+        index.add_with_ids(dequantize_descriptors(descriptors, store.scale),
+                           np.arange(start, start + count, dtype=np.int64))
+        id_map.extend([card_id] * count)
+
+def write_delta(delta_dir, delta, store, bundle_dir):
+    """
+    Writes delta.json and delta_features.h5 for ``delta`` (as built by the
+    descriptor pipeline), taking features from ``store`` and the result
+    checksums from the finished bundle files in ``bundle_dir``.
+    """
+    os.makedirs(delta_dir, exist_ok=True)
+    features_path = os.path.join(delta_dir, DELTA_FEATURES)
+    if os.path.exists(features_path):
+        os.remove(features_path)
+    with FeatureStore(features_path, 'w') as delta_store:
+        for card_id, _, _ in delta["added_cards"]:
+            keypoints, descriptors = store.get_raw(card_id)
+            delta_store.append(card_id, keypoints, descriptors, **store.source(card_id))
+
+    delta = dict(delta)
+    delta["result_files"] = {fname: file_sha256(os.path.join(bundle_dir, fname)) for fname in CHECKED_FILES}
+    with open(os.path.join(delta_dir, DELTA_JSON), 'w') as f:
+        json.dump(delta, f)
+    logger.info(f"🧩 Delta {delta['base_bundle_id']} → {delta['bundle_id']}: "
+                f"{len(delta['removed_cards'])} cards removed, {len(delta['added_cards'])} added")
+
+def apply_delta(bundle_dir, delta_dir, expected_base_id):
+    """
+    Applies one delta in place to a writable copy of a bundle (never the live
+    run directory). Raises DeltaMismatch if it doesn't chain onto
+    ``expected_base_id`` or the result differs from the builder's.
+    """
+    with open(os.path.join(delta_dir, DELTA_JSON), 'r') as f:
+        delta = json.load(f)
+    if delta["base_bundle_id"] != expected_base_id:
+        raise DeltaMismatch(f"Delta base {delta['base_bundle_id']} does not match bundle {expected_base_id}")
+
+    faiss_path = os.path.join(bundle_dir, "faiss_ivf.index")
+    id_map_path = os.path.join(bundle_dir, "id_map.json")
+    index = faiss.read_index(faiss_path)
+    with open(id_map_path, 'r') as f:
+        id_map = json.load(f)
+
+    with FeatureStore(os.path.join(delta_dir, DELTA_FEATURES), 'r') as delta_store:
+        apply_faiss_delta(index, id_map, delta["removed_faiss_ids"], delta["added_cards"], delta_store)
+        with FeatureStore(os.path.join(bundle_dir, "candidate_features.h5"), 'a') as store:
+            for card_id in delta["removed_cards"]:
+                store.remove(card_id)
+            for card_id, _, _ in delta["added_cards"]:
+                keypoints, descriptors = delta_store.get_raw(card_id)
+                store.append(card_id, keypoints, descriptors, **delta_store.source(card_id))
+
+    faiss.write_index(index, faiss_path)
+    with open(id_map_path, 'w') as f:
+        json.dump(id_map, f)
+
+    for fname, expected in delta["result_files"].items():
+        if file_sha256(os.path.join(bundle_dir, fname)) != expected:
+            raise DeltaMismatch(f"{fname} differs from bundle {delta['bundle_id']} after applying the delta")
+    logger.info(f"🧩 Applied delta {delta['base_bundle_id']} → {delta['bundle_id']}")
+    return delta
@@ -0,0 +1,306 @@
+# utils/bundle_download.py
+# Downloads the published descriptor bundle (see descriptor_update/bundle_packaging.py).
+#
+# The archive is split into fixed-size segments that are fetched over parallel
+# HTTP range requests into a preallocated file. Finished segments are recorded
+# in a sidecar progress file, so an interrupted download resumes where it
+# stopped, and a dropped connection resumes from its last written byte. While
+# segments arrive, the contiguous downloaded prefix is decompressed and untarred
+# straight into a versioned bundle directory. Every file, and the archive
+# itself, is checked against the published manifest before it is used.
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_BYTES = 1024 * 1024
+REQUEST_TIMEOUT = 60
+RETRY_BACKOFF_SECONDS = 1.0
+
+class BundleDownloadError(RuntimeError):
+    pass
+
+class ChecksumMismatch(BundleDownloadError):
+    """The downloaded bytes are wrong; resuming from them would fail again."""
+
+def build_session(connections):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=connections, pool_maxsize=connections)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def fetch_bundle_manifest(session, url):
+    response = session.get(url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    manifest = response.json()
+    for field in ("archive_bytes", "archive_sha256", "files"):
+        if field not in manifest:
+            raise BundleDownloadError(f"Bundle manifest {url} has no {field}")
+    return manifest
+
+def supports_ranges(session, url):
+    with session.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=REQUEST_TIMEOUT) as response:
+        return response.status_code == 206
+
+class SegmentedFile:
+    """
+    Preallocated download target plus the set of segments already on disk.
+    Progress is saved next to the file and reused only for the same archive.
+    """
+
+    def __init__(self, path, size, sha256, segment_bytes):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.segment_bytes = max(1, min(segment_bytes, size))
+        self.num_segments = max(1, -(-size // self.segment_bytes))
+        self.progress_path = path + ".progress"
+        self._cond = threading.Condition()
+        self._done = self._load_progress()
+        self._prefix_segments = 0
+        self._advance_prefix()
+        self.error = None
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+            f.truncate(size)
+
+    def _load_progress(self):
+        if not os.path.exists(self.path):
+            return set()
+        try:
+            with open(self.progress_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        if state.get("sha256") != self.sha256 or state.get("segment_bytes") != self.segment_bytes:
+            return set()
+        return set(state.get("done", []))
+
+    def _save_progress(self):
+        tmp_path = self.progress_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"sha256": self.sha256, "segment_bytes": self.segment_bytes, "done": sorted(self._done)}, f)
+        os.replace(tmp_path, self.progress_path)
+
+    def _advance_prefix(self):
+        while self._prefix_segments in self._done:
+            self._prefix_segments += 1
+
+    def segment_range(self, index):
+        start = index * self.segment_bytes
+        return start, min(self.size, start + self.segment_bytes)
+
+    def pending(self):
+        return [i for i in range(self.num_segments) if i not in self._done]
+
+    def done_bytes(self):
+        with self._cond:
+            return sum(end - start for start, end in map(self.segment_range, self._done))
+
+    def mark_done(self, index):
+        with self._cond:
+            self._done.add(index)
+            self._advance_prefix()
+            self._save_progress()
+            self._cond.notify_all()
+
+    def fail(self, error):
+        with self._cond:
+            if self.error is None:
+                self.error = error
+            self._cond.notify_all()
+
+    def wait_for(self, offset):
+        """Blocks until the byte at ``offset`` is downloaded; returns the contiguous prefix length."""
+        with self._cond:
+            while True:
+                if self.error is not None:
+                    raise BundleDownloadError(f"Bundle download failed: {self.error}")
+                available = min(self.size, self._prefix_segments * self.segment_bytes)
+                if available > offset or available == self.size:
+                    return available
+                self._cond.wait()
+
+    def discard(self):
+        for path in (self.path, self.progress_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+class PrefixReader:
+    """Sequential reader over the downloaded prefix; hashes everything it returns."""
+
+    def __init__(self, segmented):
+        self._segmented = segmented
+        self._fd = os.open(segmented.path, os.O_RDONLY)
+        self._pos = 0
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        if self._pos >= self._segmented.size:
+            return b""
+        available = self._segmented.wait_for(self._pos)
+        n = available - self._pos if size is None or size < 0 else min(size, available - self._pos)
+        data = os.pread(self._fd, n, self._pos)
+        self._pos += len(data)
+        self.sha256.update(data)
+        return data
+
+    def drain(self):
+        while self.read(STREAM_CHUNK_BYTES):
+            pass
+
+    def close(self):
+        os.close(self._fd)
+
+def fetch_segment(session, url, segmented, index, ranged=True, retries=5):
+    """Writes one segment; retries resume from the last byte written."""
+    start, end = segmented.segment_range(index)
+    written = 0
+    fd = os.open(segmented.path, os.O_WRONLY)
+    try:
+        for attempt in range(retries + 1):
+            try:
+                headers = {"Range": f"bytes={start + written}-{end - 1}"} if ranged else {}
+                with session.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+                    expected_status = 206 if ranged else 200
+                    if response.status_code != expected_status:
+                        raise BundleDownloadError(f"HTTP {response.status_code} for segment {index}")
+                    for chunk in response.iter_content(STREAM_CHUNK_BYTES):
+                        if segmented.error is not None:
+                            return
+                        chunk = chunk[:end - start - written]
+                        os.pwrite(fd, chunk, start + written)
+                        written += len(chunk)
+                if written < end - start:
+                    raise BundleDownloadError(f"Segment {index} ended after {written} of {end - start} bytes")
+                segmented.mark_done(index)
+                return
+            except (requests.RequestException, BundleDownloadError) as e:
+                if attempt == retries:
+                    raise
+                if not ranged:
+                    written = 0  # without range support the body always restarts at byte 0
+                logger.warning(f"⚠️ Segment {index} interrupted ({e}); retrying from byte {start + written}.")
+                time.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt)
+    finally:
+        os.close(fd)
+
+def extract_stream(reader, dest_dir, expected_files, manifest):
+    """Untars the archive as it downloads, verifying each file's sha256 as it is written."""
+    source = reader
+    if manifest.get("compression") == "zstd":
+        import zstandard
+        source = zstandard.ZstdDecompressor().stream_reader(reader, read_size=STREAM_CHUNK_BYTES)
+    extracted = []
+    with tarfile.open(fileobj=source, mode='r|') as tar:
+        for member in tar:
+            if not member.isfile() or member.name not in expected_files:
+                continue
+            digest = hashlib.sha256()
+            src = tar.extractfile(member)
+            with open(os.path.join(dest_dir, member.name), 'wb') as out:
+                while True:
+                    chunk = src.read(STREAM_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    out.write(chunk)
+            expected = manifest["files"].get(member.name, {}).get("sha256")
+            if expected and digest.hexdigest() != expected:
+                raise ChecksumMismatch(f"Checksum mismatch for {member.name}")
+            extracted.append(member.name)
+            logger.info(f"✅ Extracted and verified {member.name}")
+    reader.drain()
+    missing = set(expected_files) - set(extracted)
+    if missing:
+        raise BundleDownloadError(f"Bundle archive is missing {sorted(missing)}")
+
+def _propagate_failure(segmented, future):
+    if not future.cancelled() and future.exception() is not None:
+        segmented.fail(future.exception())
+
+def download_bundle(base_url, archive, bundle_root, expected_files, connections=4,
+                    segment_bytes=8 * 1024 * 1024, retries=5):
+    """
+    Downloads ``{base_url}/{archive}`` into ``bundle_root/<bundle_id>/`` and
+    returns (bundle_dir, manifest, stats). A partial archive left in
+    ``bundle_root`` by an interrupted run is resumed.
+    """
+    os.makedirs(bundle_root, exist_ok=True)
+    archive_url = f"{base_url}/{archive}"
+    with build_session(connections) as session:
+        manifest = fetch_bundle_manifest(session, f"{archive_url}.manifest.json")
+        bundle_id = manifest.get("bundle_id") or "unversioned"
+        ranged = supports_ranges(session, archive_url)
+        if not ranged:
+            logger.warning(f"⚠️ {archive_url} does not support range requests; using one connection.")
+            connections, segment_bytes = 1, manifest["archive_bytes"]
+
+        segmented = SegmentedFile(os.path.join(bundle_root, archive + ".part"), manifest["archive_bytes"],
+                                  manifest["archive_sha256"], segment_bytes)
+        resumed_bytes = segmented.done_bytes()
+        if resumed_bytes:
+            logger.info(f"⏯️ Resuming bundle {bundle_id}: {resumed_bytes / 1e6:.1f} MB already downloaded.")
+        logger.info(f"⬇️ Downloading bundle {bundle_id} ({segmented.size / 1e6:.1f} MB) from {archive_url} "
+                    f"over {connections} connection(s).")
+
+        partial_dir = os.path.join(bundle_root, bundle_id + ".partial")
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        os.makedirs(partial_dir)
+
+        start = time.perf_counter()
+        reader = PrefixReader(segmented)
+        try:
+            with ThreadPoolExecutor(max_workers=connections) as pool:
+                futures = [pool.submit(fetch_segment, session, archive_url, segmented, i, ranged, retries)
+                           for i in segmented.pending()]
+                for future in futures:
+                    future.add_done_callback(partial(_propagate_failure, segmented))
+                try:
+                    extract_stream(reader, partial_dir, expected_files, manifest)
+                except BaseException as e:
+                    segmented.fail(e)
+                    for future in futures:
+                        future.cancel()
+                    raise
+        except ChecksumMismatch:
+            segmented.discard()
+            shutil.rmtree(partial_dir, ignore_errors=True)
+            raise
+        finally:
+            reader.close()
+
+    elapsed = time.perf_counter() - start
+    if reader.sha256.hexdigest() != manifest["archive_sha256"]:
+        segmented.discard()
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        raise ChecksumMismatch("Archive checksum does not match the bundle manifest; partial download discarded.")
+
+    bundle_dir = os.path.join(bundle_root, bundle_id)
+    shutil.rmtree(bundle_dir, ignore_errors=True)
+    os.replace(partial_dir, bundle_dir)
+    segmented.discard()
+
+    fetched_bytes = segmented.size - resumed_bytes
+    stats = {
+        "bundle_id": bundle_id,
+        "archive_bytes": segmented.size,
+        "resumed_bytes": resumed_bytes,
+        "connections": connections,
+        "seconds": round(elapsed, 2),
+        "mb_per_second": round(fetched_bytes / 1e6 / elapsed, 2) if elapsed else None,
+    }
+    logger.info(f"✅ Bundle {bundle_id} downloaded and verified in {elapsed:.1f}s ({stats['mb_per_second']} MB/s).")
+    return bundle_dir, manifest, stats
@@ -0,0 +1,42 @@
+# utils/bundle_manifest.py
+# The promotion manifest is the only signal from the update worker to serving
+# processes: bundle files are swapped into place first, and manifest.json is
+# replaced atomically last. Serving processes watch this one file.
+
+import os
+import json
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+# Published next to the bundle archives: latest bundle id plus the delta chain.
+BUNDLE_INDEX_NAME = "bundle-index.json"
+
+def new_bundle_id():
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S.%fZ")
+
+def manifest_path(run_dir):
+    return os.path.join(run_dir, MANIFEST_NAME)
+
+def read_manifest(run_dir):
+    path = manifest_path(run_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ Could not read bundle manifest {path}: {e}")
+        return None
+
+def write_manifest(run_dir, manifest):
+    path = manifest_path(run_dir)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    logger.info(f"📝 Bundle manifest {manifest.get('bundle_id')} written to {path}")
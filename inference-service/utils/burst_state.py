@@ -0,0 +1,116 @@
+# utils/burst_state.py
+# Per-session evidence accumulated across frames of a mobile burst scan.
+#
+# State lives in Redis so every worker sees the same session:
+#   burst:<session_id>:frames   frames processed so far
+#   burst:<session_id>:votes    hash of card_id -> accumulated FAISS votes
+#   burst:<session_id>:inliers  hash of card_id -> accumulated RANSAC inliers
+#   burst:<session_id>:decided  JSON scan result, held briefly once a burst is decided
+#                               (just the card id while the deciding frame stores it)
+#
+# Evidence expires after BURST_STATE_TTL_SECONDS without a new frame, so a
+# session can scan one card after another.
+
+import os
+import json
+import logging
+import redis
+from config import (
+    BURST_STATE_TTL_SECONDS,
+    BURST_DECIDED_HOLD_SECONDS,
+    BURST_MIN_FRAMES,
+    BURST_MIN_INLIERS,
+    BURST_MIN_INLIER_MARGIN,
+)
+
+logger = logging.getLogger(__name__)
+
+_redis_client = None
+
+def _client():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis(host=os.getenv("REDIS_HOST", "mtg-redis"), port=6379)
+    return _redis_client
+
+def _key(session_id, field):
+    return f"burst:{session_id}:{field}"
+
+def get_decided_result(session_id):
+    raw = _client().get(_key(session_id, "decided"))
+    return json.loads(raw) if raw else None
+
+def claim_decision(session_id, card_id):
+    """
+    Reserves the session's decision for this frame before its result is
+    stored. SET NX is atomic, so when frames of one burst race only one of them
+    claims it. Returns False if another frame decided the session first.
+    """
+    claimed = _client().set(_key(session_id, "decided"), json.dumps({"predicted_card_id": card_id}),
+                            nx=True, ex=BURST_DECIDED_HOLD_SECONDS)
+    return bool(claimed)
+
+def release_decision(session_id):
+    """Drops a claim whose result could not be stored, so later frames can decide."""
+    _client().delete(_key(session_id, "decided"))
+
+def mark_decided(session_id, scan_data):
+    """
+    Replaces the claim with the full result for the rest of the hold window, so
+    frames of the same burst still in flight are skipped, and clears the
+    evidence so the next card scanned in this session starts fresh.
+    """
+    pipe = _client().pipeline()
+    pipe.set(_key(session_id, "decided"), json.dumps(scan_data), xx=True, keepttl=True)
+    pipe.delete(*(_key(session_id, f) for f in ("frames", "votes", "inliers")))
+    pipe.execute()
+
+def record_frame(session_id, candidate_counts, candidate_debug):
+    """
+    Adds one frame's FAISS votes and per-candidate inliers to the session and
+    returns the accumulated state as {"frames", "votes", "inliers"}.
+    """
+    votes_key = _key(session_id, "votes")
+    inliers_key = _key(session_id, "inliers")
+    frames_key = _key(session_id, "frames")
+
+    pipe = _client().pipeline()
+    for card_id, count in candidate_counts.items():
+        pipe.hincrby(votes_key, card_id, int(count))
+    for card_id, dbg in candidate_debug.items():
+        pipe.hincrby(inliers_key, card_id, int(dbg.get("total_inliers", 0)))
+    pipe.incr(frames_key)
+    for key in (votes_key, inliers_key, frames_key):
+        pipe.expire(key, BURST_STATE_TTL_SECONDS)
+    pipe.hgetall(votes_key)
+    pipe.hgetall(inliers_key)
+    results = pipe.execute()
+
+    # One result per HINCRBY, then INCR, three EXPIREs and the two HGETALLs.
+    frames = int(results[len(candidate_counts) + len(candidate_debug)])
+    votes, inliers = results[-2], results[-1]
+    return {
+        "frames": frames,
+        "votes": {k.decode(): int(v) for k, v in votes.items()},
+        "inliers": {k.decode(): int(v) for k, v in inliers.items()},
+    }
+
+def pick_burst_winner(state):
+    """
+    Decides a session from accumulated evidence. The leading card must have
+    enough combined inliers across at least BURST_MIN_FRAMES frames and a clear
+    lead over the runner-up; FAISS votes break ties between equal inlier counts.
+    """
+    if state["frames"] < BURST_MIN_FRAMES or not state["inliers"]:
+        return None
+    ranked = sorted(
+        state["inliers"].items(),
+        key=lambda x: (-x[1], -state["votes"].get(x[0], 0))
+    )
+    best_id, best_inliers = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0
+    if best_inliers >= BURST_MIN_INLIERS and best_inliers - runner_up >= BURST_MIN_INLIER_MARGIN:
+        logger.info("Burst decided on %s after %d frames (%d inliers, runner-up %d)",
+                    best_id, state["frames"], best_inliers, runner_up)
+        return best_id
+    return None
@@ -0,0 +1,111 @@
+# utils/card_detection.py
+# Finds card quadrilaterals in a binder-page photo and rectifies each one to
+# the 256x256 ROI used for matching.
+
+import logging
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ROI_SIZE = 256
+CARD_ASPECT = 63.0 / 88.0  # short side / long side of a standard card
+ASPECT_TOLERANCE = 0.12
+MIN_AREA_FRACTION = 0.01   # of the page area
+MAX_AREA_FRACTION = 0.5
+DETECTION_MAX_SIDE = 1200  # contours are found on a downscaled copy of the page
+
+def _order_corners(pts):
+    """Orders four points as top-left, top-right, bottom-right, bottom-left."""
+    pts = np.asarray(pts, dtype=np.float32).reshape(4, 2)
+    # Clockwise by angle around the centroid (y points down), starting from the
+    # first corner past the top-left direction. Unlike x+y / y-x extremes this
+    # never picks the same point twice when the card is rotated near 45 degrees.
+    centre = pts.mean(axis=0)
+    angles = np.arctan2(pts[:, 1] - centre[1], pts[:, 0] - centre[0])
+    ordered = pts[np.argsort(np.mod(angles + 0.75 * np.pi, 2 * np.pi))]
+    # Keep the card upright: a landscape quad is rotated to portrait.
+    width = np.linalg.norm(ordered[1] - ordered[0])
+    height = np.linalg.norm(ordered[3] - ordered[0])
+    if width > height:
+        ordered = np.roll(ordered, -1, axis=0)
+    return ordered
+
+def _box_iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+def detect_card_quads(image, max_cards=12):
+    """
+    Returns up to ``max_cards`` card quadrilaterals (4x2 float32 arrays in
+    image coordinates, ordered TL, TR, BR, BL), sorted in reading order.
+    """
+    h, w = image.shape[:2]
+    scale = min(1.0, DETECTION_MAX_SIDE / max(h, w))
+    small = cv2.resize(image, (int(w * scale), int(h * scale))) if scale < 1.0 else image
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+    gray = cv2.GaussianBlur(gray, (5, 5), 0)
+
+    edges = cv2.Canny(gray, 50, 150)
+    edges = cv2.dilate(edges, np.ones((3, 3), np.uint8), iterations=1)
+    contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+    page_area = float(gray.shape[0] * gray.shape[1])
+    candidates = []
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        if not (MIN_AREA_FRACTION * page_area <= area <= MAX_AREA_FRACTION * page_area):
+            continue
+        # Artwork touching the card edge can add notches to the contour, so
+        # the quad is fitted to its convex hull.
+        hull = cv2.convexHull(contour)
+        rect = cv2.minAreaRect(hull)
+        (_, _), (rw, rh), _ = rect
+        if min(rw, rh) == 0:
+            continue
+        if abs(min(rw, rh) / max(rw, rh) - CARD_ASPECT) > ASPECT_TOLERANCE:
+            continue
+        approx = cv2.approxPolyDP(hull, 0.02 * cv2.arcLength(hull, True), True)
+        if len(approx) == 4:
+            quad = approx.reshape(4, 2)
+        elif cv2.contourArea(hull) / (rw * rh) > 0.9:
+            quad = cv2.boxPoints(rect)
+        else:
+            continue
+        candidates.append((area, quad.astype(np.float32) / scale))
+
+    # Card borders produce nested near-duplicate contours; keep the largest of each group.
+    candidates.sort(key=lambda c: -c[0])
+    kept = []
+    for area, quad in candidates:
+        box = cv2.boundingRect(quad)
+        if all(_box_iou(box, cv2.boundingRect(other)) < 0.5 for other in kept):
+            kept.append(quad)
+        if len(kept) >= max_cards:
+            break
+
+    quads = [_order_corners(q) for q in kept]
+    if not quads:
+        return []
+
+    # Reading order: a new row starts wherever consecutive centre y values
+    # jump by more than half a card height; each row then runs left to right.
+    row_height = np.median([np.linalg.norm(q[3] - q[0]) for q in quads])
+    centres = [q.mean(axis=0) for q in quads]
+    by_y = sorted(range(len(quads)), key=lambda i: centres[i][1])
+    rows = [[by_y[0]]]
+    for prev, i in zip(by_y, by_y[1:]):
+        if centres[i][1] - centres[prev][1] > row_height * 0.5:
+            rows.append([])
+        rows[-1].append(i)
+    return [quads[i] for row in rows for i in sorted(row, key=lambda i: centres[i][0])]
+
+def rectify_card(image, quad, size=ROI_SIZE):
+    dst = np.array([[0, 0], [size - 1, 0], [size - 1, size - 1], [0, size - 1]], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(quad, dst)
+    return cv2.warpPerspective(image, matrix, (size, size))
@@ -0,0 +1,351 @@
+# utils/feature_store.py
+# Candidate feature store (candidate_features.h5).
+#
+# Layout v2 keeps every card's features in shared flat datasets instead of one
+# HDF5 group per card and feature set:
+#
+#   /descriptors     uint8 (rows, 128)   RootSIFT scaled by DESCRIPTOR_SCALE
+#   /keypoints       KEYPOINT_DTYPE (rows,)
+#   /cards/ids, offsets, counts, image_urls, image_statuses, highres
+#
+# A card's features are one contiguous row range, and chunks are sized so a
+# per-card read touches one or two chunks. Replacing or removing a card only
+# updates the index; the orphaned rows are reclaimed by ``repack``.
+#
+# Legacy files (one group per card, gzip float16 descriptors, JSON keypoints)
+# are still readable through LegacyFeatureStore; ``repack`` migrates them.
+
+import os
+import re
+import json
+import logging
+import h5py
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+LAYOUT_VERSION = 2
+DESCRIPTOR_DIM = 128
+# RootSIFT components are well below 0.5, so x512 keeps them inside uint8.
+DESCRIPTOR_SCALE = 512.0
+CHUNK_ROWS = 128
+WRITE_BUFFER_ROWS = 8192
+
+KEYPOINT_DTYPE = np.dtype([
+    ("x", "<f4"), ("y", "<f4"), ("size", "<f4"),
+    ("angle", "<f4"), ("response", "<f4"), ("octave", "<i4"),
+])
+
+def quantize_descriptors(descriptors):
+    scaled = np.rint(np.asarray(descriptors, dtype=np.float32) * DESCRIPTOR_SCALE)
+    return np.clip(scaled, 0, 255).astype(np.uint8)
+
+def dequantize_descriptors(quantized, scale=DESCRIPTOR_SCALE):
+    return quantized.astype(np.float32) * np.float32(1.0 / scale)
+
+def keypoints_to_array(keypoints):
+    """cv2.KeyPoint list → KEYPOINT_DTYPE array."""
+    arr = np.empty(len(keypoints), dtype=KEYPOINT_DTYPE)
+    for i, kp in enumerate(keypoints):
+        arr[i] = (kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response, kp.octave)
+    return arr
+
+def serialized_keypoints_to_array(kps_data):
+    """Legacy JSON keypoint dicts → KEYPOINT_DTYPE array."""
+    arr = np.empty(len(kps_data), dtype=KEYPOINT_DTYPE)
+    for i, d in enumerate(kps_data):
+        arr[i] = (d["pt"][0], d["pt"][1], d["size"], d["angle"], d["response"], d["octave"])
+    return arr
+
+def keypoint_xy(keypoints):
+    return np.stack([keypoints["x"], keypoints["y"]], axis=1).astype(np.float32)
+
+class FeatureStore:
+    """Layout-v2 store. ``mode`` is an h5py mode; new or empty files are initialised."""
+
+    def __init__(self, path, mode='r'):
+        self.filename = path
+        self.mode = mode
+        self._h5 = h5py.File(path, mode)
+        self._pending = []
+        self._pending_rows = 0
+        self._dirty = False
+        if self._h5.attrs.get("layout_version") != LAYOUT_VERSION:
+            if mode == 'r' or len(self._h5.keys()):
+                self._h5.close()
+                raise ValueError(f"{path} is not a layout v{LAYOUT_VERSION} feature store")
+            self._initialise()
+        self.scale = float(self._h5.attrs.get("descriptor_scale", DESCRIPTOR_SCALE))
+        self._descriptors = self._h5["descriptors"]
+        self._keypoints = self._h5["keypoints"]
+        self._load_index()
+
+    def _initialise(self):
+        self._h5.attrs["layout_version"] = LAYOUT_VERSION
+        self._h5.attrs["descriptor_scale"] = DESCRIPTOR_SCALE
+        self._h5.create_dataset("descriptors", shape=(0, DESCRIPTOR_DIM), maxshape=(None, DESCRIPTOR_DIM),
+                                dtype=np.uint8, chunks=(CHUNK_ROWS, DESCRIPTOR_DIM), compression="lzf")
+        self._h5.create_dataset("keypoints", shape=(0,), maxshape=(None,), dtype=KEYPOINT_DTYPE,
+                                chunks=(CHUNK_ROWS,), compression="lzf")
+        self._h5.create_group("cards")
+        self._index = {}
+        self._dirty = True
+        self._write_index()
+
+    def _load_index(self):
+        cards = self._h5["cards"]
+        ids = cards["ids"].asstr()[()]
+        urls = cards["image_urls"].asstr()[()]
+        statuses = cards["image_statuses"].asstr()[()]
+        offsets = cards["offsets"][()]
+        counts = cards["counts"][()]
+        highres = cards["highres"][()]
+        # card_id -> [offset, count, image_url, image_status, highres_image]
+        self._index = {
+            ids[i]: [int(offsets[i]), int(counts[i]), urls[i], statuses[i], bool(highres[i])]
+            for i in range(len(ids))
+        }
+
+    def _write_index(self):
+        cards = self._h5["cards"]
+        entries = sorted(self._index.items(), key=lambda item: item[1][0])
+        str_dtype = h5py.string_dtype(encoding="utf-8")
+        columns = {
+            "ids": (np.array([card_id for card_id, _ in entries], dtype=object), str_dtype),
+            "offsets": (np.array([e[0] for _, e in entries], dtype=np.int64), np.int64),
+            "counts": (np.array([e[1] for _, e in entries], dtype=np.int32), np.int32),
+            "image_urls": (np.array([e[2] or "" for _, e in entries], dtype=object), str_dtype),
+            "image_statuses": (np.array([e[3] or "" for _, e in entries], dtype=object), str_dtype),
+            "highres": (np.array([bool(e[4]) for _, e in entries], dtype=np.bool_), np.bool_),
+        }
+        for name, (data, dtype) in columns.items():
+            if name in cards:
+                del cards[name]
+            cards.create_dataset(name, data=data, dtype=dtype)
+        self._dirty = False
+
+    # ─── Reads ─────────────────────────────────────────────────────────
+
+    def __contains__(self, card_id):
+        return card_id in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def card_ids(self):
+        return list(self._index.keys())
+
+    def get(self, card_id):
+        """Returns [(keypoint_xy float32 (N, 2), descriptors float32 (N, 128))], empty if unknown."""
+        entry = self._index.get(card_id)
+        if entry is None:
+            return []
+        offset, count = entry[0], entry[1]
+        descriptors = dequantize_descriptors(self._descriptors[offset:offset + count], self.scale)
+        keypoints = self._keypoints[offset:offset + count]
+        return [(keypoint_xy(keypoints), descriptors)]
+
+    def get_raw(self, card_id):
+        """Returns (keypoints KEYPOINT_DTYPE, descriptors uint8) or None."""
+        entry = self._index.get(card_id)
+        if entry is None:
+            return None
+        offset, count = entry[0], entry[1]
+        return self._keypoints[offset:offset + count], self._descriptors[offset:offset + count]
+
+    def sources(self):
+        """card_id -> (image_url, image_status)."""
+        return {card_id: (e[2] or None, e[3] or None) for card_id, e in self._index.items()}
+
+    def source(self, card_id):
+        e = self._index[card_id]
+        return {"image_url": e[2], "image_status": e[3] or None, "highres_image": e[4]}
+
+    def iter_descriptors(self, batch_rows=1 << 16):
+        """Yields (card_id, float32 descriptors) for every live card in storage order."""
+        self.flush()
+        entries = sorted(self._index.items(), key=lambda item: item[1][0])
+        i = 0
+        while i < len(entries):
+            # Read a run of cards in one slice, then split it per card.
+            start = entries[i][1][0]
+            j = i
+            end = start
+            while j < len(entries) and entries[j][1][0] + entries[j][1][1] - start <= batch_rows:
+                end = max(end, entries[j][1][0] + entries[j][1][1])
+                j += 1
+            if j == i:
+                j, end = i + 1, start + entries[i][1][1]
+            block = dequantize_descriptors(self._descriptors[start:end], self.scale)
+            for card_id, (offset, count, *_rest) in entries[i:j]:
+                yield card_id, block[offset - start:offset - start + count]
+            i = j
+
+    def stats(self):
+        self.flush()
+        total_rows = self._descriptors.shape[0]
+        live_rows = sum(e[1] for e in self._index.values())
+        return {
+            "layout_version": LAYOUT_VERSION,
+            "cards": len(self._index),
+            "rows": total_rows,
+            "live_rows": live_rows,
+            "garbage_rows": total_rows - live_rows,
+            "file_bytes": os.path.getsize(self.filename),
+        }
+
+    # ─── Writes ────────────────────────────────────────────────────────
+
+    def append(self, card_id, keypoints, descriptors, image_url="", image_status="", highres_image=False):
+        """Adds or replaces a card. ``descriptors`` are uint8 (see quantize_descriptors)."""
+        count = len(descriptors)
+        offset = self._descriptors.shape[0] + self._pending_rows
+        self._pending.append((np.asarray(keypoints, dtype=KEYPOINT_DTYPE), np.asarray(descriptors, dtype=np.uint8)))
+        self._pending_rows += count
+        self._index[card_id] = [offset, count, image_url or "", image_status or "", bool(highres_image)]
+        self._dirty = True
+        if self._pending_rows >= WRITE_BUFFER_ROWS:
+            self._flush_rows()
+
+    def remove(self, card_id):
+        if self._index.pop(card_id, None) is not None:
+            self._dirty = True
+
+    def _flush_rows(self):
+        if not self._pending:
+            return
+        start = self._descriptors.shape[0]
+        end = start + self._pending_rows
+        self._descriptors.resize((end, DESCRIPTOR_DIM))
+        self._keypoints.resize((end,))
+        self._descriptors[start:end] = np.concatenate([des for _, des in self._pending])
+        self._keypoints[start:end] = np.concatenate([kps for kps, _ in self._pending])
+        self._pending = []
+        self._pending_rows = 0
+
+    def flush(self):
+        if self.mode == 'r':
+            return
+        self._flush_rows()
+        if self._dirty:
+            self._write_index()
+        self._h5.flush()
+
+    def close(self):
+        if self._h5:
+            self.flush()
+            self._h5.close()
+            self._h5 = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+def _feature_group_order(name):
+    # Legacy groups are named feature_<n> in creation order; a plain string sort
+    # would put feature_10 before feature_2.
+    match = re.fullmatch(r"feature_(\d+)", name)
+    return (1, int(match.group(1)), name) if match else (0, 0, name)
+
+class LegacyFeatureStore:
+    """Read-only view of the original one-group-per-card layout."""
+
+    def __init__(self, path):
+        self.filename = path
+        self.mode = 'r'
+        self._h5 = h5py.File(path, 'r')
+
+    def __contains__(self, card_id):
+        return card_id in self._h5
+
+    def __len__(self):
+        return len(self._h5.keys())
+
+    def card_ids(self):
+        return list(self._h5.keys())
+
+    def _feature_sets(self, card_id):
+        """Yields the card's feature groups oldest first (feature_0, feature_1, ..., feature_10)."""
+        card_grp = self._h5[card_id]
+        for name in sorted(card_grp.keys(), key=_feature_group_order):
+            feat_grp = card_grp[name]
+            kp_json_arr = feat_grp["keypoints"][()]
+            kp_str = kp_json_arr[0].decode("utf-8") if isinstance(kp_json_arr[0], bytes) else kp_json_arr[0]
+            yield serialized_keypoints_to_array(json.loads(kp_str)), feat_grp["descriptors"][()], feat_grp
+
+    def get(self, card_id):
+        if card_id not in self._h5:
+            return []
+        return [(keypoint_xy(kps), des.astype(np.float32)) for kps, des, _ in self._feature_sets(card_id)]
+
+    def sources(self):
+        sources = {}
+        for card_id, card_grp in self._h5.items():
+            image_url = card_grp.attrs.get("image_url")
+            if image_url is None:
+                for feat_grp in card_grp.values():
+                    image_url = feat_grp.attrs.get("image_url")
+                    break
+            sources[card_id] = (image_url, card_grp.attrs.get("image_status"))
+        return sources
+
+    def close(self):
+        if self._h5:
+            self._h5.close()
+            self._h5 = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+def is_current_layout(path):
+    with h5py.File(path, 'r') as h5:
+        return h5.attrs.get("layout_version") == LAYOUT_VERSION
+
+def open_feature_store(path, mode='r'):
+    """Opens either layout for reading; writable opens require (or create) layout v2."""
+    if mode == 'r' and not is_current_layout(path):
+        return LegacyFeatureStore(path)
+    return FeatureStore(path, mode)
+
+def repack(src_path, dst_path):
+    """
+    Writes a compact layout-v2 copy of ``src_path`` (either layout) to ``dst_path``:
+    live cards only, contiguous, in card-id order. Used both to reclaim rows
+    orphaned by replacements/removals and to migrate legacy files.
+    """
+    if os.path.exists(dst_path):
+        os.remove(dst_path)
+    src = open_feature_store(src_path, 'r')
+    try:
+        with FeatureStore(dst_path, 'w') as dst:
+            if isinstance(src, LegacyFeatureStore):
+                sources = src.sources()
+                for card_id in sorted(src.card_ids()):
+                    sets = list(src._feature_sets(card_id))
+                    if not sets:
+                        continue
+                    if len(sets) > 1:
+                        logger.info(f"ℹ️ {card_id} has {len(sets)} feature sets; keeping the newest.")
+                    kps, des, feat_grp = sets[-1]
+                    card_attrs = src._h5[card_id].attrs
+                    dst.append(card_id, kps, quantize_descriptors(des.astype(np.float32)),
+                               image_url=sources[card_id][0] or feat_grp.attrs.get("image_url", ""),
+                               image_status=card_attrs.get("image_status", ""),
+                               highres_image=bool(card_attrs.get("highres_image", False)))
+            else:
+                for card_id in sorted(src.card_ids()):
+                    kps, des = src.get_raw(card_id)
+                    dst.append(card_id, kps, des, **src.source(card_id))
+            stats = dst.stats()
+    finally:
+        src.close()
+    logger.info(f"📦 Repacked {src_path} → {dst_path}: {stats['cards']} cards, {stats['rows']} rows, "
+                f"{stats['file_bytes'] / 1e6:.1f} MB")
+    return stats
@@ -0,0 +1,84 @@
+# utils/image_decode.py
+# Size-aware decoding of uploaded ROI images.
+
+import struct
+import time
+import logging
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Every ROI is resized to 256x256 before feature extraction, so decoding more
+# pixels than that is wasted work.
+TARGET_SIZE = 256
+
+# libjpeg can scale by 1/2, 1/4 and 1/8 during decode (DCT scaling).
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# SOFn markers carry the frame size; C4 (DHT), C8 (JPG) and CC (DAC) do not.
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def read_jpeg_size(data):
+    """Returns (width, height) from the JPEG frame header, or None if not a parseable JPEG."""
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    pos = 2
+    length = len(data)
+    while pos + 4 <= length:
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:  # standalone markers
+            pos += 2
+            continue
+        seg_len = struct.unpack(">H", bytes(data[pos + 2:pos + 4]))[0]
+        if marker in _JPEG_SOF_MARKERS:
+            if pos + 9 > length:
+                return None
+            height, width = struct.unpack(">HH", bytes(data[pos + 5:pos + 9]))
+            return width, height
+        pos += 2 + seg_len
+    return None
+
+def choose_reduced_flag(width, height, target=TARGET_SIZE):
+    """Largest libjpeg scale factor that still leaves both sides at least ``target`` pixels."""
+    shortest = min(width, height)
+    for factor, flag in _REDUCED_FLAGS:
+        if shortest // factor >= target:
+            return factor, flag
+    return 1, cv2.IMREAD_COLOR
+
+def decode_roi_image(raw_bytes, target=TARGET_SIZE):
+    """
+    Decodes an uploaded ROI, using reduced-resolution JPEG decoding when the
+    source is much larger than ``target``. Returns (image, decode_info).
+    """
+    start = time.perf_counter()
+    file_bytes = np.frombuffer(raw_bytes, np.uint8)
+
+    factor, flag = 1, cv2.IMREAD_COLOR
+    size = read_jpeg_size(file_bytes)
+    if size:
+        factor, flag = choose_reduced_flag(*size, target=target)
+
+    image = cv2.imdecode(file_bytes, flag)
+    if image is None and flag != cv2.IMREAD_COLOR:
+        # Header parsed but the reduced decode failed; fall back to a plain decode.
+        factor, image = 1, cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+
+    decode_info = {
+        "source_size": size,
+        "reduction": factor,
+        "decode_time": time.perf_counter() - start,
+    }
+    logger.debug("ROI decode: source=%s reduction=1/%d time=%.1fms",
+                 size, factor, decode_info["decode_time"] * 1000)
+    return image, decode_info
@@ -0,0 +1,68 @@
+# utils/image_quality.py
+# Cheap pre-checks that reject hopeless ROIs before SIFT, FAISS and RANSAC run.
+
+import time
+import logging
+import cv2
+import numpy as np
+from config import (
+    QUALITY_GATE_ENABLED,
+    QUALITY_MIN_LAPLACIAN_VAR,
+    QUALITY_MIN_LUMINANCE,
+    QUALITY_MAX_LUMINANCE,
+    QUALITY_MIN_KEYPOINTS,
+)
+from utils.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# Metrics are computed on a small fixed-size thumbnail so the gate costs well
+# under a millisecond regardless of the upload resolution.
+QUALITY_THUMB_SIZE = (128, 128)
+
+_fast_detector = cv2.FastFeatureDetector_create(threshold=20, nonmaxSuppression=True)
+
+quality_rejections = Counter(
+    "inference_quality_rejections_total",
+    "ROIs rejected by the image-quality gate, by reason.",
+    labels=("reason",),
+)
+
+def compute_quality_metrics(image):
+    thumb = cv2.resize(image, QUALITY_THUMB_SIZE, interpolation=cv2.INTER_LINEAR)
+    gray = thumb if thumb.ndim == 2 else cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+    return {
+        "laplacian_var": float(cv2.Laplacian(gray, cv2.CV_32F).var()),
+        "mean_luminance": float(np.mean(gray)),
+        "keypoint_estimate": len(_fast_detector.detect(gray, None)),
+    }
+
+def assess_roi_quality(image):
+    """
+    Returns (reason, metrics). ``reason`` is None for usable frames, otherwise a
+    reason code the client can act on: too_dark, too_bright, too_blurry, low_detail.
+    """
+    start = time.perf_counter()
+    metrics = compute_quality_metrics(image)
+
+    reason = None
+    if metrics["mean_luminance"] < QUALITY_MIN_LUMINANCE:
+        reason = "too_dark"
+    elif metrics["mean_luminance"] > QUALITY_MAX_LUMINANCE:
+        reason = "too_bright"
+    elif metrics["laplacian_var"] < QUALITY_MIN_LAPLACIAN_VAR:
+        reason = "too_blurry"
+    elif metrics["keypoint_estimate"] < QUALITY_MIN_KEYPOINTS:
+        reason = "low_detail"
+
+    metrics["gate_time"] = time.perf_counter() - start
+    if reason:
+        quality_rejections.inc(reason=reason)
+        logger.info("ROI rejected by quality gate: %s (%s)", reason, metrics)
+    return reason, metrics
+
+def quality_gate(image):
+    """Like ``assess_roi_quality`` but a no-op when the gate is disabled."""
+    if not QUALITY_GATE_ENABLED:
+        return None, {}
+    return assess_roi_quality(image)
@@ -0,0 +1,41 @@
+# utils/inference_metrics.py
+# Inference pipeline metrics, served on /metrics.
+
+from utils.metrics import Counter, Histogram
+
+# Stages: decode, quality_gate, preprocess, sift, faiss_search, candidate_load,
+# knn_match, ransac, match, db_lookup, total. /infer/page reports its
+# request-level stages with a "page_" prefix.
+stage_latency = Histogram(
+    "inference_stage_seconds",
+    "Latency of each inference pipeline stage in seconds.",
+    labels=("stage",),
+)
+
+candidates_verified = Counter(
+    "inference_candidates_verified_total",
+    "FAISS candidates verified with knnMatch + RANSAC.",
+)
+
+candidate_cache_lookups = Counter(
+    "inference_candidate_cache_lookups_total",
+    "Candidate feature lookups, by whether the per-request cache already held them.",
+    labels=("result",),
+)
+
+best_inliers = Histogram(
+    "inference_best_inliers",
+    "RANSAC inlier count of the best candidate per matched ROI.",
+    buckets=(0, 4, 8, 12, 16, 20, 30, 50, 100, 200),
+)
+
+not_found = Counter(
+    "inference_not_found_total",
+    "Inference requests answered with 404, by endpoint and reason.",
+    labels=("endpoint", "reason"),
+)
+
+def observe_stages(timings, prefix=""):
+    """Records a route's ``timings`` dict (stage -> seconds)."""
+    for stage, seconds in timings.items():
+        stage_latency.observe(seconds, stage=prefix + stage)
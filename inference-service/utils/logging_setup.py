@@ -0,0 +1,32 @@
+# utils/logging_setup.py
+# Shared logging configuration for the web app and the update worker.
+
+import os
+import sys
+import logging
+from logging.handlers import TimedRotatingFileHandler
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+
+def configure_logging(log_file_path, log_level):
+    handlers = []
+
+    if log_file_path:
+        os.makedirs(os.path.dirname(log_file_path), exist_ok=True)
+        file_handler = TimedRotatingFileHandler(
+            log_file_path, when="midnight", interval=1, backupCount=0, utc=True
+        )
+        file_handler.suffix = "%Y-%m-%d"
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handlers.append(file_handler)
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handlers.append(stream_handler)
+
+    logging.basicConfig(
+        level=log_level,
+        handlers=handlers,
+        format=LOG_FORMAT,
+        force=True
+    )
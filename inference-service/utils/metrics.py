@@ -0,0 +1,78 @@
+# utils/metrics.py
+# Inference-service metrics, served on /metrics in the Prometheus text format.
+#
+# Counter and Histogram wrap prometheus_client so updates can be muted per
+# thread. Under gunicorn, PROMETHEUS_MULTIPROC_DIR (set in gunicorn.conf.py
+# before the app is imported) puts prometheus_client in multiprocess mode:
+# every worker writes its values to files in that directory and /metrics
+# aggregates them, so a scrape sees the whole service regardless of which
+# worker answers it.
+
+import os
+import threading
+
+import prometheus_client
+from prometheus_client import CollectorRegistry, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+
+_local = threading.local()
+
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class muted:
+    """Context manager: metrics updates made on this thread are dropped.
+    Used for background work (warmup, shadow evaluation) that shares instrumented code."""
+    def __enter__(self):
+        _local.muted = True
+        return self
+
+    def __exit__(self, *exc):
+        _local.muted = False
+        return False
+
+def _is_muted():
+    return getattr(_local, "muted", False)
+
+class _Metric:
+    def __init__(self, metric, labels):
+        self._metric = metric
+        self.label_names = tuple(labels)
+
+    def _child(self, labels):
+        if not self.label_names:
+            return self._metric
+        return self._metric.labels(*(str(labels.get(n, "")) for n in self.label_names))
+
+class Counter(_Metric):
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(prometheus_client.Counter(name, documentation, labelnames=labels), labels)
+
+    def inc(self, amount=1, **labels):
+        if not _is_muted():
+            self._child(labels).inc(amount)
+
+class Histogram(_Metric):
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(prometheus_client.Histogram(name, documentation, labelnames=labels, buckets=buckets),
+                         labels)
+
+    def observe(self, value, **labels):
+        if not _is_muted():
+            self._child(labels).observe(value)
+
+# ─── Multiprocess mode ─────────────────────────────────────────────────
+
+def _multiprocess_dir():
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+def mark_worker_dead(pid):
+    if _multiprocess_dir():
+        multiprocess.mark_process_dead(pid)
+
+def render_metrics():
+    """Returns (body, content type) for /metrics."""
+    if _multiprocess_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
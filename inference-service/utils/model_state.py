@@ -6,9 +6,11 @@ from threading import Lock
 # Global lock for safe model access across threads (e.g. reload during watchdog)
 model_lock = Lock()
 
-# Loaded model resources (FAISS index, HDF5 file, ID map)
+# Loaded model resources (FAISS index, HDF5 file, ID map, promoted bundle id)
 model_resources = {
     "faiss_index": None,
     "hdf5_file": None,
-    "id_map": None
+    "id_map": None,
+    "bundle_id": None,
+    "load_duration": None
 }
\ No newline at end of file
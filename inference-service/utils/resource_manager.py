@@ -1,13 +1,24 @@
 import os
 import json
 import faiss
-import h5py
 import logging
 import requests
-import zipfile
-import tempfile
+import shutil
+import time
+from datetime import datetime, timezone
 from filelock import FileLock
 from utils.model_state import model_resources, model_lock
+from utils.bundle_manifest import BUNDLE_INDEX_NAME, read_manifest, write_manifest
+from utils.bundle_download import build_session, download_bundle
+from utils.bundle_delta import DELTA_FILES, DeltaMismatch, apply_delta
+from config import (
+    BUNDLE_BASE_URL,
+    BUNDLE_ARCHIVE,
+    BUNDLE_DOWNLOAD_CONNECTIONS,
+    BUNDLE_DOWNLOAD_SEGMENT_MB,
+    BUNDLE_DOWNLOAD_RETRIES,
+)
+from utils.feature_store import open_feature_store
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +26,7 @@ RESOURCE_DIR = "/app/resources"
 RUN_DIR = os.path.join(RESOURCE_DIR, "run")
 LOCK_DIR = "/tmp/locks"
 LOCK_PATH = os.path.join(LOCK_DIR, "resource_download.lock")
-HF_ZIP_URL = "https://huggingface.co/datasets/JakeTurner616/mtg-cards-SIFT-Features/resolve/main/resources-nightly.zip?download=true"
+BUNDLE_ROOT = os.path.join(RESOURCE_DIR, "bundles")
 
 EXPECTED_FILES = [
     "faiss_ivf.index",
@@ -28,50 +39,32 @@ def _resource_files_exist():
     logger.debug(f"Checking for expected resource files in {RUN_DIR}: {EXPECTED_FILES} -> {exists}")
     return exists
 
-import shutil
-
-def _download_and_extract_zip():
+def _download_and_extract_bundle():
+    """
+    Downloads the published bundle into resources/bundles/<bundle_id>/ (extracted
+    and verified while it streams), then renames the files into RUN_DIR. Both
+    directories are on the same volume, so nothing is copied a second time.
+    """
     try:
-        logger.info("🪵 Preparing to create temporary file for download...")
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".zip") as tmp_file:
-            logger.info("✅ Temporary file created successfully, proceeding to download...")
-            tmp_zip_path = tmp_file.name
-
-            logger.info(f"⬇️ Starting descriptor resources download from Hugging Face: {HF_ZIP_URL}")
-            response = requests.get(HF_ZIP_URL, stream=True, timeout=60)
-            response.raise_for_status()
-
-            total_downloaded = 0
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    tmp_file.write(chunk)
-                    total_downloaded += len(chunk)
-                    if total_downloaded % (1024 * 1024 * 10) < 8192:
-                        logger.info(f"⬇️ Downloaded {total_downloaded / (1024 * 1024):.2f} MB so far...")
-
-            tmp_file.flush()
-
-        logger.info(f"📦 Download complete ({total_downloaded / (1024 * 1024):.2f} MB). Extracting resources...")
-
-        with zipfile.ZipFile(tmp_zip_path, 'r') as zip_ref:
-            extract_path = "/app/resources/tmp_extracted"
-            os.makedirs(extract_path, exist_ok=True)
-            zip_ref.extractall(extract_path)
-
-        os.remove(tmp_zip_path)
-        logger.info("✅ Extraction complete. Moving descriptor resources into /app/resources/run/.")
+        bundle_dir, manifest, stats = download_bundle(
+            BUNDLE_BASE_URL, BUNDLE_ARCHIVE, BUNDLE_ROOT, EXPECTED_FILES,
+            connections=BUNDLE_DOWNLOAD_CONNECTIONS,
+            segment_bytes=BUNDLE_DOWNLOAD_SEGMENT_MB * 1024 * 1024,
+            retries=BUNDLE_DOWNLOAD_RETRIES,
+        )
 
         os.makedirs(RUN_DIR, exist_ok=True)
         for filename in EXPECTED_FILES:
-            src = os.path.join(extract_path, filename)
-            dst = os.path.join(RUN_DIR, filename)
-            if os.path.exists(src):
-                shutil.move(src, dst)
-                logger.info(f"✅ Moved {filename} to {dst}")
-            else:
-                logger.error(f"❌ Expected file {filename} not found in extracted ZIP.")
-
-        shutil.rmtree(extract_path)
+            os.replace(os.path.join(bundle_dir, filename), os.path.join(RUN_DIR, filename))
+            logger.info(f"✅ Moved {filename} to {RUN_DIR}")
+        shutil.rmtree(bundle_dir)
+
+        write_manifest(RUN_DIR, {
+            "bundle_id": manifest.get("bundle_id"),
+            "downloaded_at": datetime.now(timezone.utc).isoformat(),
+            "files": manifest["files"],
+            "download": stats,
+        })
         logger.info("✅ Resource preparation complete.")
 
     except Exception as e:
@@ -79,6 +72,90 @@ def _download_and_extract_zip():
         raise RuntimeError(f"Descriptor resource download failed: {e}")
 
 
+def _delta_chain(bundle_index, local_id):
+    """[(base_id, entry), ...] leading from ``local_id`` to the latest bundle, or None."""
+    chain = []
+    current = local_id
+    deltas = bundle_index.get("deltas", {})
+    while current != bundle_index.get("latest"):
+        entry = deltas.get(current)
+        if entry is None or len(chain) >= len(deltas):
+            return None
+        chain.append((current, entry))
+        current = entry["to"]
+    return chain
+
+def _apply_delta_chain(local_id, chain):
+    """Applies each delta to a copy of the run bundle, then renames the result into RUN_DIR."""
+    latest_id = chain[-1][1]["to"]
+    work_dir = os.path.join(BUNDLE_ROOT, f"{latest_id}.delta-work")
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    for filename in EXPECTED_FILES:
+        shutil.copy2(os.path.join(RUN_DIR, filename), os.path.join(work_dir, filename))
+
+    current = local_id
+    stats = []
+    for base_id, entry in chain:
+        delta_dir, _, download_stats = download_bundle(
+            BUNDLE_BASE_URL, entry["archive"], BUNDLE_ROOT, DELTA_FILES,
+            connections=BUNDLE_DOWNLOAD_CONNECTIONS,
+            segment_bytes=BUNDLE_DOWNLOAD_SEGMENT_MB * 1024 * 1024,
+            retries=BUNDLE_DOWNLOAD_RETRIES,
+        )
+        try:
+            delta = apply_delta(work_dir, delta_dir, current)
+        finally:
+            shutil.rmtree(delta_dir, ignore_errors=True)
+        current = delta["bundle_id"]
+        stats.append(download_stats)
+
+    for filename in EXPECTED_FILES:
+        os.replace(os.path.join(work_dir, filename), os.path.join(RUN_DIR, filename))
+    shutil.rmtree(work_dir)
+    write_manifest(RUN_DIR, {
+        "bundle_id": current,
+        "downloaded_at": datetime.now(timezone.utc).isoformat(),
+        "applied_deltas": [entry["archive"] for _, entry in chain],
+        "download": stats,
+    })
+
+def sync_published_bundle():
+    """
+    Brings RUN_DIR up to the latest published bundle: through the delta chain
+    when one leads from the local bundle id, otherwise by a full download.
+    Serving processes pick the result up through the manifest watchdog.
+    """
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    with FileLock(LOCK_PATH, timeout=600):
+        local_id = (read_manifest(RUN_DIR) or {}).get("bundle_id")
+        with build_session(1) as session:
+            response = session.get(f"{BUNDLE_BASE_URL}/{BUNDLE_INDEX_NAME}", timeout=60)
+        if response.status_code == 404:
+            bundle_index = {}
+        else:
+            response.raise_for_status()
+            bundle_index = response.json()
+
+        latest_id = bundle_index.get("latest")
+        if local_id and local_id == latest_id:
+            logger.info(f"✅ Bundle {local_id} is current.")
+            return {"action": "none", "bundle_id": local_id}
+
+        chain = _delta_chain(bundle_index, local_id) if local_id and _resource_files_exist() else None
+        if chain:
+            try:
+                _apply_delta_chain(local_id, chain)
+                logger.info(f"🧩 Updated bundle {local_id} → {latest_id} through {len(chain)} delta(s).")
+                return {"action": "delta", "bundle_id": latest_id, "deltas": len(chain)}
+            except (DeltaMismatch, RuntimeError, OSError, requests.RequestException) as e:
+                logger.warning(f"⚠️ Delta update from {local_id} failed ({e}); falling back to a full download.")
+        else:
+            logger.info(f"⬇️ No delta chain from bundle {local_id} to {latest_id}; downloading the full bundle.")
+
+        _download_and_extract_bundle()
+        return {"action": "full", "bundle_id": (read_manifest(RUN_DIR) or {}).get("bundle_id")}
+
 def download_and_extract_resources_once():
     os.makedirs(LOCK_DIR, exist_ok=True)
     with FileLock(LOCK_PATH, timeout=600):  # 10-minute lock for first-time initialization
@@ -87,9 +164,9 @@ def download_and_extract_resources_once():
             return
         logger.warning("⚠️ Descriptor resources missing. Attempting download from Hugging Face fallback.")
         try:
-            _download_and_extract_zip()
+            _download_and_extract_bundle()
         except Exception as e:
-            logger.error(f"❌ Exception in _download_and_extract_zip: {e}", exc_info=True)
+            logger.error(f"❌ Exception in _download_and_extract_bundle: {e}", exc_info=True)
             raise
 
         if not _resource_files_exist():
@@ -99,6 +176,7 @@ def download_and_extract_resources_once():
 
 def load_resources():
     logger.info("🚀 Starting model resource loading...")
+    load_start = time.perf_counter()
     download_and_extract_resources_once()
 
     faiss_path = os.path.join(RUN_DIR, "faiss_ivf.index")
@@ -108,7 +186,7 @@ def load_resources():
     logger.info("📖 Loading FAISS index...")
     faiss_index = faiss.read_index(faiss_path)
     logger.info("📖 Loading HDF5 feature file...")
-    hf = h5py.File(h5_path, 'r')
+    hf = open_feature_store(h5_path, 'r')
     logger.info("📖 Loading ID map JSON...")
     with open(map_path, 'r') as f:
         id_map = json.load(f)
@@ -123,13 +201,17 @@ def load_resources():
         model_resources["faiss_index"] = faiss_index
         model_resources["hdf5_file"] = hf
         model_resources["id_map"] = id_map
+        model_resources["bundle_id"] = (read_manifest(RUN_DIR) or {}).get("bundle_id")
         model_resources["reload_needed"] = False
+        model_resources["load_duration"] = round(time.perf_counter() - load_start, 3)
 
     logger.info(
-        "✅ Model resources loaded successfully: FAISS ntotal=%d | ID map=%d entries | HDF5 groups=%d",
+        "✅ Model resources loaded in %.2fs: bundle=%s | FAISS ntotal=%d | ID map=%d entries | feature store cards=%d",
+        model_resources["load_duration"],
+        model_resources["bundle_id"],
         faiss_index.ntotal,
         len(id_map),
-        len(hf.keys())
+        len(hf)
     )
 
     if not getattr(load_resources, "_watchdog_started", False):
@@ -0,0 +1,200 @@
+# utils/shadow_eval.py
+# Shadow evaluation of a candidate bundle on live /infer traffic.
+#
+# A sampled fraction of requests is queued, after the response has been
+# computed, for a second match against the shadow bundle. One background thread
+# per process drains the queue: it runs at the lowest scheduling priority,
+# verifies candidates inline (no thread pool) and drops work when the queue is
+# full, so shadow work is capped at a single low-priority core per process.
+# Results go to a local SQLite store.
+
+import os
+import json
+import time
+import queue
+import random
+import sqlite3
+import hashlib
+import logging
+import threading
+import faiss
+from config import (
+    SHADOW_ENABLED,
+    SHADOW_BUNDLE_DIR,
+    SHADOW_SAMPLE_RATE,
+    SHADOW_QUEUE_SIZE,
+    SHADOW_NICE,
+    SHADOW_STORE_PATH,
+)
+from utils.bundle_manifest import read_manifest
+from utils.feature_store import open_feature_store
+from utils.metrics import Counter, muted
+
+logger = logging.getLogger(__name__)
+
+shadow_state = {
+    "faiss_index": None,
+    "hdf5_file": None,
+    "id_map": None,
+    "bundle_id": None,
+    "queue": None,
+    "worker_pid": None,
+}
+_start_lock = threading.Lock()
+
+shadow_evaluations = Counter(
+    "inference_shadow_evaluations_total",
+    "Shadow-bundle evaluations, by whether the shadow answer agreed with the serving answer.",
+    labels=("result",),
+)
+shadow_dropped = Counter(
+    "inference_shadow_dropped_total",
+    "Sampled requests dropped because the shadow queue was full.",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shadow_results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    image_sha1 TEXT NOT NULL,
+    serving_bundle_id TEXT,
+    shadow_bundle_id TEXT,
+    serving_card_id TEXT,
+    shadow_card_id TEXT,
+    agree INTEGER NOT NULL,
+    serving_ms REAL,
+    shadow_ms REAL,
+    serving_inliers INTEGER,
+    shadow_inliers INTEGER
+)
+"""
+
+def load_shadow_bundle():
+    """Loads the shadow bundle if SHADOW_ENABLED and one is present. Safe to call again to refresh."""
+    if not SHADOW_ENABLED:
+        return False
+    paths = [os.path.join(SHADOW_BUNDLE_DIR, f) for f in ("faiss_ivf.index", "candidate_features.h5", "id_map.json")]
+    if not all(os.path.exists(p) for p in paths):
+        logger.warning(f"⚠️ Shadow mode enabled but no bundle found in {SHADOW_BUNDLE_DIR}; shadow disabled.")
+        return False
+
+    faiss_index = faiss.read_index(paths[0])
+    hf = open_feature_store(paths[1], 'r')
+    with open(paths[2], 'r') as f:
+        id_map = json.load(f)
+
+    old_hf = shadow_state["hdf5_file"]
+    shadow_state.update({
+        "faiss_index": faiss_index,
+        "hdf5_file": hf,
+        "id_map": id_map,
+        "bundle_id": (read_manifest(SHADOW_BUNDLE_DIR) or {}).get("bundle_id"),
+    })
+    if old_hf is not None:
+        try:
+            old_hf.close()
+        except Exception as e:
+            logger.warning(f"⚠️ Error closing old shadow HDF5: {e}")
+    logger.info(f"👥 Shadow bundle {shadow_state['bundle_id']} loaded from {SHADOW_BUNDLE_DIR} "
+                f"(FAISS ntotal={faiss_index.ntotal}, sample rate={SHADOW_SAMPLE_RATE})")
+    return True
+
+def reopen_shadow_hdf5_after_fork():
+    hf = shadow_state["hdf5_file"]
+    if hf is not None:
+        shadow_state["hdf5_file"] = open_feature_store(hf.filename, 'r')
+
+def _ensure_worker():
+    # Threads don't survive fork, so each gunicorn worker starts its own on first use.
+    if shadow_state["worker_pid"] == os.getpid():
+        return
+    with _start_lock:
+        if shadow_state["worker_pid"] == os.getpid():
+            return
+        shadow_state["queue"] = queue.Queue(maxsize=SHADOW_QUEUE_SIZE)
+        threading.Thread(target=_worker_loop, args=(shadow_state["queue"],),
+                         name="shadow-eval", daemon=True).start()
+        shadow_state["worker_pid"] = os.getpid()
+
+def maybe_submit(raw_bytes, roi_image, serving_card_id, serving_time, serving_inliers, serving_bundle_id):
+    """Called from /infer after the serving match. Never blocks the request."""
+    if shadow_state["faiss_index"] is None or random.random() >= SHADOW_SAMPLE_RATE:
+        return
+    _ensure_worker()
+    try:
+        shadow_state["queue"].put_nowait(
+            (raw_bytes, roi_image, serving_card_id, serving_time, serving_inliers, serving_bundle_id)
+        )
+    except queue.Full:
+        shadow_dropped.inc()
+
+def _lower_thread_priority():
+    # Linux applies niceness per thread (by native thread id).
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), SHADOW_NICE)
+    except (AttributeError, OSError) as e:
+        logger.warning(f"⚠️ Could not lower shadow thread priority: {e}")
+
+def _open_store():
+    os.makedirs(os.path.dirname(SHADOW_STORE_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(SHADOW_STORE_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(_SCHEMA)
+    conn.commit()
+    return conn
+
+def _worker_loop(work_queue):
+    from utils.sift_features import find_closest_card_ransac
+
+    _lower_thread_priority()
+    store = _open_store()
+    while True:
+        raw_bytes, roi_image, serving_card_id, serving_time, serving_inliers, serving_bundle_id = work_queue.get()
+        try:
+            model = (shadow_state["faiss_index"], shadow_state["hdf5_file"], shadow_state["id_map"])
+            start = time.perf_counter()
+            with muted():
+                shadow_card_id, _, _, _, debug_info = find_closest_card_ransac(
+                    roi_image, k=3, model=model, match_threads=1
+                )
+            shadow_time = time.perf_counter() - start
+
+            agree = shadow_card_id == serving_card_id
+            image_sha1 = hashlib.sha1(raw_bytes).hexdigest()
+            store.execute(
+                "INSERT INTO shadow_results (created_at, image_sha1, serving_bundle_id, shadow_bundle_id, "
+                "serving_card_id, shadow_card_id, agree, serving_ms, shadow_ms, serving_inliers, shadow_inliers) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), image_sha1, serving_bundle_id, shadow_state["bundle_id"], serving_card_id,
+                 shadow_card_id, int(agree), serving_time * 1000, shadow_time * 1000,
+                 serving_inliers, debug_info.get("best_inliers", 0)),
+            )
+            store.commit()
+            shadow_evaluations.inc(result="agree" if agree else "disagree")
+            if not agree:
+                logger.info(f"👥 Shadow disagreement on {image_sha1[:12]}: serving={serving_card_id} "
+                            f"shadow={shadow_card_id} ({serving_time * 1000:.1f}ms vs {shadow_time * 1000:.1f}ms)")
+        except Exception:
+            logger.exception("❌ Shadow evaluation failed")
+        finally:
+            work_queue.task_done()
+
+def shadow_summary(since=None):
+    """Agreement rate and latency deltas from the local store (for ad-hoc inspection)."""
+    conn = sqlite3.connect(SHADOW_STORE_PATH, timeout=30)
+    try:
+        row = conn.execute(
+            "SELECT COUNT(*), AVG(agree), AVG(shadow_ms - serving_ms), AVG(serving_ms), AVG(shadow_ms) "
+            "FROM shadow_results WHERE created_at >= ?",
+            (since or 0,),
+        ).fetchone()
+    finally:
+        conn.close()
+    count, agreement, delta, serving_ms, shadow_ms = row
+    return {
+        "evaluations": count,
+        "agreement_rate": agreement,
+        "mean_latency_delta_ms": delta,
+        "mean_serving_ms": serving_ms,
+        "mean_shadow_ms": shadow_ms,
+    }
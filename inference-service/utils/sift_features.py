@@ -6,6 +6,9 @@ from collections import Counter
 import concurrent.futures
 import logging
 from utils.resource_manager import load_resources
+from utils.inference_metrics import (stage_latency, candidates_verified, candidate_cache_lookups,
+                                     best_inliers as best_inliers_histogram)
+from config import SIFT_BUDGET_TIERS, SIFT_CASCADE_MIN_INLIERS, SIFT_CASCADE_MIN_VOTE_MARGIN
 
 logger = logging.getLogger(__name__)
 
@@ -13,7 +16,16 @@ logger = logging.getLogger(__name__)
 global_sift = cv2.SIFT_create(nfeatures=250)
 global_CLAHE = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
 
-def extract_features_sift(roi_image, max_features=250):
+def _format_timings(timings):
+    return ", ".join(f"{step}={t * 1000:.1f}ms" for step, t in timings.items())
+
+def build_enhanced_color(resized):
+    """CLAHE-on-L colour image, the same preprocessing feature_worker uses to build the index."""
+    lab = cv2.cvtColor(resized, cv2.COLOR_BGR2LAB)
+    L, A, B = cv2.split(lab)
+    return cv2.cvtColor(cv2.merge((global_CLAHE.apply(L), A, B)), cv2.COLOR_LAB2BGR)
+
+def extract_features_sift(roi_image, max_features=250, return_color=False):
     debug_timings = {}
     overall_start = time.perf_counter()
 
@@ -21,30 +33,24 @@ def extract_features_sift(roi_image, max_features=250):
     resized = cv2.resize(roi_image, (256, 256))
     debug_timings['resize'] = time.perf_counter() - start
 
+    # Must match extract_features_from_bytes in descriptor_update/workers/feature_worker.py
+    # (BGR->LAB, CLAHE on L, back to BGR, then gray); the index is built from those descriptors.
     start = time.perf_counter()
-    lab = cv2.cvtColor(resized, cv2.COLOR_BGR2LAB)
-    debug_timings['to_lab'] = time.perf_counter() - start
-
-    start = time.perf_counter()
-    L, A, B = cv2.split(lab)
-    L_clahe = global_CLAHE.apply(L)
+    if resized.ndim == 3:
+        enhanced = build_enhanced_color(resized)
+        gray = cv2.cvtColor(enhanced, cv2.COLOR_BGR2GRAY)
+    else:
+        enhanced, gray = None, global_CLAHE.apply(resized)
     debug_timings['clahe'] = time.perf_counter() - start
-
-    start = time.perf_counter()
-    lab_clahe = cv2.merge((L_clahe, A, B))
-    enhanced_color = cv2.cvtColor(lab_clahe, cv2.COLOR_LAB2BGR)
-    gray = cv2.cvtColor(enhanced_color, cv2.COLOR_BGR2GRAY)
-    debug_timings['color_processing'] = time.perf_counter() - start
+    enhanced_color = enhanced if return_color else None
 
     start = time.perf_counter()
     keypoints, descriptors = global_sift.detectAndCompute(gray, None)
     debug_timings['sift_detection'] = time.perf_counter() - start
 
-    if descriptors is not None and len(keypoints) > max_features:
+    if descriptors is not None and len(keypoints) > 0:
         start = time.perf_counter()
-        sorted_kp_des = sorted(zip(keypoints, descriptors), key=lambda x: -x[0].response)
-        keypoints, descriptors = zip(*sorted_kp_des[:max_features])
-        keypoints, descriptors = list(keypoints), np.array(descriptors)
+        keypoints, descriptors = select_top_keypoints(keypoints, descriptors, max_features)
         debug_timings['feature_limit'] = time.perf_counter() - start
 
     if descriptors is not None:
@@ -54,40 +60,44 @@ def extract_features_sift(roi_image, max_features=250):
         descriptors = np.sqrt(descriptors).astype('float32')
         debug_timings['normalization'] = time.perf_counter() - start
 
-    total_time = time.perf_counter() - overall_start
-    logger.info("SIFT extraction timings:")
-    for step, t in debug_timings.items():
-        print(f"  {step}: {t:.3f} seconds")
-    print(f"Total SIFT extraction time: {total_time:.3f} seconds")
+    debug_timings['total'] = time.perf_counter() - overall_start
+    logger.debug("SIFT extraction timings: %s", _format_timings(debug_timings))
+    stage_latency.observe(
+        debug_timings['resize'] + debug_timings['clahe'],
+        stage="preprocess")
+    stage_latency.observe(
+        debug_timings['sift_detection'] + debug_timings.get('feature_limit', 0.0)
+        + debug_timings.get('normalization', 0.0),
+        stage="sift")
 
     return keypoints, descriptors, enhanced_color
 
-def deserialize_keypoints(kps_data):
-    return [
-        cv2.KeyPoint(d['pt'][0], d['pt'][1], d['size'], d['angle'],
-                     d['response'], d['octave'], d['class_id'])
-        for d in kps_data
-    ]
-
-def load_candidate_features_for_card(card_id, hf):
-    features = []
-    if card_id in hf:
-        card_grp = hf[card_id]
-        for feat_key in card_grp.keys():
-            kp_json_arr = card_grp[feat_key]["keypoints"][()]
-            kp_str = kp_json_arr[0].decode("utf-8") if isinstance(kp_json_arr[0], bytes) else kp_json_arr[0]
-            kp_serialized = json.loads(kp_str)
-            des = card_grp[feat_key]["descriptors"][()].astype('float32')
-            features.append((kp_serialized, des))
-    return features
+def select_top_keypoints(keypoints, descriptors, max_features):
+    """Keep the strongest ``max_features`` keypoints, ordered by descending response.
+
+    The ordering matters: the budget cascade in ``find_closest_card_ransac`` takes
+    prefixes of the result as its smaller tiers.
+    """
+    responses = np.fromiter((kp.response for kp in keypoints), dtype=np.float32, count=len(keypoints))
+    if len(keypoints) > max_features:
+        top = np.argpartition(-responses, max_features - 1)[:max_features]
+    else:
+        top = np.arange(len(keypoints))
+    order = top[np.argsort(-responses[top], kind='stable')]
+    return [keypoints[i] for i in order], descriptors[order]
+
+def load_candidate_features_for_card(card_id, store):
+    """[(keypoint_xy, descriptors)] for one card; only keypoint positions are needed for RANSAC."""
+    return store.get(card_id)
 
 from .model_state import model_resources, model_lock
+from .worker_runtime import serving_state
+from .feature_store import open_feature_store
 import faiss
-import h5py
 
 def load_faiss_index_for_testing(faiss_path, h5_path, id_map_path):
     faiss_index = faiss.read_index(faiss_path)
-    hf = h5py.File(h5_path, 'r')
+    hf = open_feature_store(h5_path, 'r')
     with open(id_map_path, 'r') as f:
         id_map = json.load(f)
 
@@ -103,10 +113,18 @@ def load_faiss_index_for_testing(faiss_path, h5_path, id_map_path):
         model_resources["id_map"] = id_map
 
     logger.info(f"✅ Loaded FAISS index (ntotal={faiss_index.ntotal}), "
-                f"HDF5 with {len(hf.keys())} groups, "
+                f"feature store with {len(hf)} cards, "
                 f"ID map with {len(id_map)} entries from staging for testing.")
 
-def find_closest_card_ransac(roi_image, k=3, min_candidate_matches=1, MIN_INLIER_THRESHOLD=8, max_candidates=10):
+def _is_confident(best_candidate, best_inliers, candidate_counts, num_query):
+    """A tier's answer is trusted when it has enough inliers and also leads the FAISS vote."""
+    if best_candidate is None or best_inliers < SIFT_CASCADE_MIN_INLIERS:
+        return False
+    runner_up = max((cnt for cand, cnt in candidate_counts.items() if cand != best_candidate), default=0)
+    vote_margin = (candidate_counts[best_candidate] - runner_up) / max(num_query, 1)
+    return vote_margin >= SIFT_CASCADE_MIN_VOTE_MARGIN
+
+def _current_model():
     # Safely reload model if marked
     reload_needed = False
     with model_lock:
@@ -118,109 +136,227 @@ def find_closest_card_ransac(roi_image, k=3, min_candidate_matches=1, MIN_INLIER
         load_resources()
 
     with model_lock:
-        faiss_index = model_resources["faiss_index"]
-        hf = model_resources["hdf5_file"]
-        id_map = model_resources["id_map"]
+        return model_resources["faiss_index"], model_resources["hdf5_file"], model_resources["id_map"]
 
-    overall_start = time.perf_counter()
-    debug_info = {}
-
-    sift_start = time.perf_counter()
-    keypoints, descriptors, processed_img = extract_features_sift(roi_image, max_features=250)
-    debug_info['sift_time'] = time.perf_counter() - sift_start
-    debug_info['num_keypoints'] = len(keypoints) if keypoints else 0
-
-    if descriptors is None or len(keypoints) == 0:
-        debug_info['error'] = "No descriptors found."
-        return None, "Unknown", keypoints, processed_img, debug_info
-
-    start = time.perf_counter()
-    distances, indices = faiss_index.search(descriptors, k)
-    debug_info['faiss_search_time'] = time.perf_counter() - start
-
-    flat_indices = indices.flatten()
-    candidate_ids = [id_map[i] for i in flat_indices if i < len(id_map)]
-    candidate_counts = Counter(candidate_ids)
-    debug_info['faiss_candidate_counts'] = dict(candidate_counts)
-
-    best_inliers = 0
-    best_candidate = None
-    candidate_debug = {}
-
-    sorted_candidates = sorted(candidate_counts.items(), key=lambda x: -x[1])
-    top_candidate_ids = [cand for cand, cnt in sorted_candidates[:max_candidates]]
-
-    def process_candidate(candidate_id):
-        local_bf = cv2.BFMatcher()
-        cand_debug = {}
-        cand_start = time.perf_counter()
+def _verify_candidate(candidate_id, query_keypoints, query_descriptors, hf, candidate_cache):
+    local_bf = cv2.BFMatcher()
+    cand_debug = {}
+    cand_start = time.perf_counter()
 
+    candidate_sets = candidate_cache.get(candidate_id)
+    if candidate_sets is None:
+        candidate_cache_lookups.inc(result="miss")
         candidate_sets = load_candidate_features_for_card(candidate_id, hf)
+        candidate_cache[candidate_id] = candidate_sets
         cand_debug['load_time'] = time.perf_counter() - cand_start
-
-        total_inliers = 0
-        bf_time_total = 0.0
-        ransac_time_total = 0.0
-
-        for kp_serialized, candidate_des in candidate_sets:
-            candidate_kp = deserialize_keypoints(kp_serialized)
-            bf_start = time.perf_counter()
-            matches = local_bf.knnMatch(descriptors, candidate_des, k=2)
-            bf_time_total += time.perf_counter() - bf_start
-
-            good_matches = [m for m, n in matches if m.distance < 0.75 * n.distance]
-            if len(good_matches) >= 4:
-                ransac_start = time.perf_counter()
-                src_pts = np.float32([keypoints[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-                dst_pts = np.float32([candidate_kp[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-                _, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
-                ransac_time_total += time.perf_counter() - ransac_start
-                if mask is not None:
-                    total_inliers += int(mask.sum())
-
-        cand_debug['bf_time_total'] = bf_time_total
-        cand_debug['ransac_time_total'] = ransac_time_total
-        cand_debug['total_inliers'] = total_inliers
-        cand_debug['iteration_time'] = time.perf_counter() - cand_start
-        return candidate_id, total_inliers, cand_debug
-
-    if len(top_candidate_ids) > 1:
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = {
-                executor.submit(process_candidate, cand_id): cand_id
-                for cand_id in top_candidate_ids
-                if candidate_counts[cand_id] >= min_candidate_matches
-            }
-            for future in concurrent.futures.as_completed(futures):
-                cand_id, total_inliers, cand_debug = future.result()
-                candidate_debug[cand_id] = cand_debug
-                if total_inliers > best_inliers:
-                    best_inliers = total_inliers
-                    best_candidate = cand_id
+        stage_latency.observe(cand_debug['load_time'], stage="candidate_load")
     else:
-        for cand_id in top_candidate_ids:
-            if candidate_counts[cand_id] < min_candidate_matches:
-                continue
-            cand_id, total_inliers, cand_debug = process_candidate(cand_id)
-            candidate_debug[cand_id] = cand_debug
-            if total_inliers > best_inliers:
-                best_inliers = total_inliers
-                best_candidate = cand_id
-
-    debug_info['best_inliers'] = best_inliers
-    debug_info['candidate_debug'] = candidate_debug
-
-    sort_start = time.perf_counter()
-    sorted_candidates = sorted(candidate_debug.items(), key=lambda x: -x[1]['total_inliers'])
-    debug_info['candidate_sort_time'] = time.perf_counter() - sort_start
-
-    print(f"Candidate sorting took: {debug_info['candidate_sort_time']:.3f} seconds")
-    logger.info("Top candidate inlier counts:")
-    for idx, (cand, dbg) in enumerate(reversed(sorted_candidates[:3]), start=1):
-        print(f"  {idx}. Candidate {cand} - {dbg['total_inliers']} inliers")
-
-    if best_inliers < MIN_INLIER_THRESHOLD:
-        best_candidate = None
-
-    debug_info['overall_time'] = time.perf_counter() - overall_start
-    return best_candidate, None, keypoints, processed_img, debug_info
+        candidate_cache_lookups.inc(result="hit")
+        cand_debug['load_time'] = time.perf_counter() - cand_start
+
+    total_inliers = 0
+    bf_time_total = 0.0
+    ransac_time_total = 0.0
+
+    for candidate_xy, candidate_des in candidate_sets:
+        bf_start = time.perf_counter()
+        matches = local_bf.knnMatch(query_descriptors, candidate_des, k=2)
+        bf_time_total += time.perf_counter() - bf_start
+
+        good_matches = [m[0] for m in matches if len(m) == 2 and m[0].distance < 0.75 * m[1].distance]
+        if len(good_matches) >= 4:
+            ransac_start = time.perf_counter()
+            src_pts = np.float32([query_keypoints[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
+            dst_pts = candidate_xy[[m.trainIdx for m in good_matches]].reshape(-1, 1, 2)
+            _, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
+            ransac_time_total += time.perf_counter() - ransac_start
+            if mask is not None:
+                total_inliers += int(mask.sum())
+
+    cand_debug['bf_time_total'] = bf_time_total
+    cand_debug['ransac_time_total'] = ransac_time_total
+    cand_debug['total_inliers'] = total_inliers
+    cand_debug['iteration_time'] = time.perf_counter() - cand_start
+    candidates_verified.inc()
+    stage_latency.observe(bf_time_total, stage="knn_match")
+    stage_latency.observe(ransac_time_total, stage="ransac")
+    return candidate_id, total_inliers, cand_debug
+
+def _record_verification(query, candidate_id, total_inliers, cand_debug):
+    query['candidate_debug'][candidate_id] = cand_debug
+    if total_inliers > query['best_inliers']:
+        query['best_inliers'] = total_inliers
+        query['best_candidate'] = candidate_id
+
+def find_closest_cards_ransac_batch(roi_images, k=3, min_candidate_matches=1, MIN_INLIER_THRESHOLD=8,
+                                    max_candidates=10, budget_tiers=None, debug=False, model=None,
+                                    match_threads=None):
+    """
+    Matches several ROIs in one pass. Each cascade tier runs a single FAISS
+    search over the new descriptors of every ROI still in play, and candidate
+    verification for all of them shares one thread pool.
+
+    ``model`` is an explicit (faiss_index, hdf5_file, id_map) to match against
+    instead of the serving model; ``match_threads=1`` verifies candidates inline
+    on the calling thread.
+
+    Returns one (best_candidate, label, keypoints, processed_img, debug_info)
+    tuple per ROI, in input order.
+    """
+    faiss_index, hf, id_map = model or _current_model()
+    match_threads = match_threads or serving_state["match_threads"]
+    budget_tiers = tuple(budget_tiers or SIFT_BUDGET_TIERS)
+
+    queries = []
+    for roi_image in roi_images:
+        overall_start = time.perf_counter()
+        debug_info = {}
+
+        sift_start = time.perf_counter()
+        keypoints, descriptors, processed_img = extract_features_sift(
+            roi_image, max_features=budget_tiers[-1], return_color=debug
+        )
+        debug_info['sift_time'] = time.perf_counter() - sift_start
+        debug_info['num_keypoints'] = len(keypoints) if keypoints else 0
+
+        query = {
+            'keypoints': keypoints,
+            'descriptors': descriptors,
+            'processed_img': processed_img,
+            'debug_info': debug_info,
+            'overall_start': overall_start,
+            'matchable': descriptors is not None and len(keypoints) > 0,
+        }
+        if query['matchable']:
+            query['indices'] = np.empty((0, k), dtype=np.int64)
+            debug_info['faiss_search_time'] = 0.0
+            debug_info['cascade'] = []
+        else:
+            debug_info['error'] = "No descriptors found."
+        queries.append(query)
+
+    # Candidate features loaded from HDF5 are shared across tiers and ROIs.
+    candidate_cache = {}
+
+    # ─── Keypoint budget cascade ───────────────────────────────────────
+    # Keypoints are ordered by response, so each tier is a prefix of the next
+    # and FAISS only has to search the descriptors added since the last tier.
+    active = [q for q in queries if q['matchable']]
+    for tier, budget in enumerate(budget_tiers):
+        if not active:
+            break
+        tier_start = time.perf_counter()
+
+        new_blocks = []
+        for query in active:
+            query['num_query'] = min(budget, len(query['keypoints']))
+            new_blocks.append(query['descriptors'][len(query['indices']):query['num_query']])
+
+        start = time.perf_counter()
+        block_sizes = [len(block) for block in new_blocks]
+        if sum(block_sizes):
+            _, found = faiss_index.search(np.vstack(new_blocks), k)
+            offset = 0
+            for query, size in zip(active, block_sizes):
+                query['indices'] = np.vstack([query['indices'], found[offset:offset + size]])
+                offset += size
+        search_time = time.perf_counter() - start
+        stage_latency.observe(search_time, stage="faiss_search")
+
+        jobs = []
+        for query in active:
+            query['debug_info']['faiss_search_time'] += search_time
+            flat_indices = query['indices'].flatten()
+            candidate_counts = Counter(id_map[i] for i in flat_indices if 0 <= i < len(id_map))
+            query['candidate_counts'] = candidate_counts
+            query['candidate_debug'] = {}
+            query['best_candidate'] = None
+            query['best_inliers'] = 0
+
+            sorted_candidates = sorted(candidate_counts.items(), key=lambda x: -x[1])
+            jobs.extend(
+                (query, cand)
+                for cand, cnt in sorted_candidates[:max_candidates]
+                if cnt >= min_candidate_matches
+            )
+
+        def submit_args(query, cand):
+            n = query['num_query']
+            return cand, query['keypoints'][:n], query['descriptors'][:n], hf, candidate_cache
+
+        if len(jobs) > 1 and match_threads != 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=match_threads) as executor:
+                futures = {
+                    executor.submit(_verify_candidate, *submit_args(query, cand)): query
+                    for query, cand in jobs
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    _record_verification(futures[future], *future.result())
+        else:
+            for query, cand in jobs:
+                _record_verification(query, *_verify_candidate(*submit_args(query, cand)))
+
+        still_active = []
+        for query in active:
+            confident = _is_confident(query['best_candidate'], query['best_inliers'],
+                                      query['candidate_counts'], query['num_query'])
+            query['tier'] = tier
+            query['debug_info']['cascade'].append({
+                'tier': tier,
+                'budget': budget,
+                'num_query': query['num_query'],
+                'best_candidate': query['best_candidate'],
+                'best_inliers': query['best_inliers'],
+                'confident': confident,
+                'tier_time': time.perf_counter() - tier_start,
+            })
+            if not confident and query['num_query'] < len(query['keypoints']):
+                still_active.append(query)
+        active = still_active
+
+    results = []
+    for query in queries:
+        debug_info = query['debug_info']
+        if not query['matchable']:
+            results.append((None, "Unknown", query['keypoints'], query['processed_img'], debug_info))
+            continue
+
+        tier = query['tier']
+        best_candidate = query['best_candidate']
+        best_inliers = query['best_inliers']
+        debug_info['cascade_tier'] = tier
+        debug_info['keypoint_budget'] = budget_tiers[tier]
+        debug_info['faiss_candidate_counts'] = dict(query['candidate_counts'])
+        debug_info['best_inliers'] = best_inliers
+        best_inliers_histogram.observe(best_inliers)
+        debug_info['candidate_debug'] = query['candidate_debug']
+        if len(roi_images) > 1:
+            debug_info['batch_size'] = len(roi_images)
+        logger.info("Keypoint cascade answered at tier %d (budget=%d, query keypoints=%d, inliers=%d)",
+                    tier, budget_tiers[tier], query['num_query'], best_inliers)
+
+        sort_start = time.perf_counter()
+        sorted_candidates = sorted(query['candidate_debug'].items(), key=lambda x: -x[1]['total_inliers'])
+        debug_info['candidate_sort_time'] = time.perf_counter() - sort_start
+
+        logger.debug("Top candidate inlier counts: %s",
+                     ", ".join(f"{cand}={dbg['total_inliers']}" for cand, dbg in sorted_candidates[:3]))
+
+        if best_inliers < MIN_INLIER_THRESHOLD:
+            best_candidate = None
+
+        debug_info['overall_time'] = time.perf_counter() - query['overall_start']
+        logger.debug("Match timings: sift=%.1fms, faiss=%.1fms, overall=%.1fms",
+                     debug_info['sift_time'] * 1000, debug_info['faiss_search_time'] * 1000,
+                     debug_info['overall_time'] * 1000)
+        results.append((best_candidate, None, query['keypoints'][:query['num_query']],
+                        query['processed_img'], debug_info))
+    return results
+
+def find_closest_card_ransac(roi_image, k=3, min_candidate_matches=1, MIN_INLIER_THRESHOLD=8, max_candidates=10,
+                             budget_tiers=None, debug=False, model=None, match_threads=None):
+    return find_closest_cards_ransac_batch(
+        [roi_image], k=k, min_candidate_matches=min_candidate_matches,
+        MIN_INLIER_THRESHOLD=MIN_INLIER_THRESHOLD, max_candidates=max_candidates,
+        budget_tiers=budget_tiers, debug=debug, model=model, match_threads=match_threads
+    )[0]
@@ -0,0 +1,116 @@
+# utils/warmup.py
+# Runs a handful of ROIs through the full pipeline after the model is loaded so
+# that FAISS page faults, OpenCV lazy init and h5py chunk-cache misses are paid
+# for before the process reports ready. None of it is recorded on /metrics.
+
+import os
+import time
+import logging
+import resource
+import cv2
+import numpy as np
+from config import WARMUP_ENABLED, WARMUP_SYNTHETIC_ROIS, WARMUP_FIXTURE_DIR
+from utils.model_state import model_resources
+from utils.image_decode import decode_roi_image
+from utils.image_quality import compute_quality_metrics
+from utils.sift_features import find_closest_card_ransac
+from utils.metrics import muted
+
+logger = logging.getLogger(__name__)
+
+FIXTURE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+readiness_state = {
+    "ready": False,
+    "warmed_at": None,
+    "warmup_duration": None,
+    "warmup_latencies": [],
+}
+
+def synthetic_roi(seed, size=256):
+    """Deterministic card-like clutter with enough corners for SIFT to bite on."""
+    rng = np.random.default_rng(seed)
+    img = np.full((size, size, 3), 200, np.uint8)
+    for _ in range(40):
+        x1, y1 = (int(v) for v in rng.integers(0, size, 2))
+        x2, y2 = x1 + int(rng.integers(8, 60)), y1 + int(rng.integers(8, 60))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.rectangle(img, (x1, y1), (x2, y2), color, -1 if rng.random() < 0.5 else 2)
+    for _ in range(15):
+        center = tuple(int(v) for v in rng.integers(0, size, 2))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.circle(img, center, int(rng.integers(4, 30)), color, 2)
+    return img
+
+def load_warmup_payloads():
+    """JPEG-encoded warmup ROIs, so the decode step is exercised as well."""
+    payloads = []
+    if WARMUP_FIXTURE_DIR and os.path.isdir(WARMUP_FIXTURE_DIR):
+        for fname in sorted(os.listdir(WARMUP_FIXTURE_DIR)):
+            if fname.lower().endswith(FIXTURE_EXTENSIONS):
+                with open(os.path.join(WARMUP_FIXTURE_DIR, fname), 'rb') as f:
+                    payloads.append((fname, f.read()))
+    for i in range(WARMUP_SYNTHETIC_ROIS):
+        ok, buf = cv2.imencode(".jpg", synthetic_roi(i))
+        if ok:
+            payloads.append((f"synthetic-{i}", buf.tobytes()))
+    return payloads
+
+def resident_memory_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is the peak, in KiB on Linux; good enough off Linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def run_warmup():
+    """
+    Must run in the process that will serve requests (a gunicorn worker, not the
+    preload master): FAISS search starts an OpenMP pool that does not survive fork.
+    """
+    readiness_state["ready"] = False
+    if not WARMUP_ENABLED:
+        readiness_state["ready"] = True
+        return readiness_state
+
+    start = time.perf_counter()
+    latencies = []
+    for name, raw in load_warmup_payloads():
+        t0 = time.perf_counter()
+        try:
+            image, _ = decode_roi_image(raw)
+            if image is None:
+                logger.warning(f"⚠️ Warmup ROI {name} could not be decoded; skipping.")
+                continue
+            # Muted so cold-start latencies stay out of the serving histograms; verification
+            # runs inline because muting is per thread.
+            with muted():
+                compute_quality_metrics(image)
+                find_closest_card_ransac(image, k=3, min_candidate_matches=1, MIN_INLIER_THRESHOLD=8,
+                                         max_candidates=10, match_threads=1)
+        except Exception as e:
+            logger.warning(f"⚠️ Warmup ROI {name} failed: {e}")
+            continue
+        latencies.append({"roi": name, "latency": round(time.perf_counter() - t0, 4)})
+
+    readiness_state["warmup_latencies"] = latencies
+    readiness_state["warmup_duration"] = round(time.perf_counter() - start, 3)
+    readiness_state["warmed_at"] = time.time()
+    readiness_state["ready"] = model_resources.get("faiss_index") is not None
+    logger.info(
+        f"🔥 Warmup finished in {readiness_state['warmup_duration']}s over {len(latencies)} ROIs "
+        f"(pid={os.getpid()}, ready={readiness_state['ready']})"
+    )
+    return readiness_state
+
+def readiness_report():
+    return {
+        "ready": readiness_state["ready"],
+        "pid": os.getpid(),
+        "bundle_id": model_resources.get("bundle_id"),
+        "load_duration": model_resources.get("load_duration"),
+        "warmup_duration": readiness_state["warmup_duration"],
+        "warmup_latencies": readiness_state["warmup_latencies"],
+        "resident_memory_bytes": resident_memory_bytes(),
+    }
@@ -5,15 +5,17 @@ import logging
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from .model_state import model_lock, model_resources
+from .worker_runtime import is_gunicorn_master, reload_in_master
+from .bundle_manifest import MANIFEST_NAME
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 MODEL_DIR = os.path.abspath("resources/run")
+# The update worker swaps bundle files in first and replaces the manifest
+# last, so the manifest is the only file that signals a new bundle.
 WATCHED_FILES = {
-    "faiss_ivf.index",
-    "candidate_features.h5",
-    "id_map.json"
+    MANIFEST_NAME
 }
 
 DEBOUNCE_SECONDS = 2.0  # Debounce delay to group rapid changes
@@ -26,6 +28,11 @@ class ModelFileHandler(FileSystemEventHandler):
         self.last_mtimes = {}  # Track last modification times
 
     def _trigger_reload(self):
+        if is_gunicorn_master():
+            # Workers are forked from the master, so reload there and rotate them.
+            logger.info("🔄 Watchdog reloading model in gunicorn master.")
+            reload_in_master()
+            return
         logger.info("🔄 Watchdog marking reload_needed flag for next inference.")
         with model_lock:
             model_resources["reload_needed"] = True
@@ -40,10 +47,12 @@ class ModelFileHandler(FileSystemEventHandler):
     def on_any_event(self, event):
         if event.is_directory:
             return
-        fname = os.path.basename(event.src_path)
+        # The manifest arrives via rename, so moves are matched on their destination.
+        path = event.dest_path if event.event_type == "moved" else event.src_path
+        fname = os.path.basename(path)
         if fname in WATCHED_FILES:
             try:
-                current_mtime = os.path.getmtime(event.src_path)
+                current_mtime = os.path.getmtime(path)
                 last_mtime = self.last_mtimes.get(fname)
 
                 if last_mtime != current_mtime:
@@ -54,7 +63,7 @@ class ModelFileHandler(FileSystemEventHandler):
                     logger.debug(f"ℹ️ Model file {fname} event detected, but mtime unchanged. Ignoring.")
 
             except FileNotFoundError:
-                logger.warning(f"⚠️ File {event.src_path} not found during mtime check.")
+                logger.warning(f"⚠️ File {path} not found during mtime check.")
 
 def start_model_file_watchdog():
     handler = ModelFileHandler()
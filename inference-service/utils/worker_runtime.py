@@ -0,0 +1,63 @@
+# utils/worker_runtime.py
+# Process-level setup for the gunicorn preload serving mode.
+#
+# The gunicorn master imports the app (and so loads the model) once; workers
+# are forked from it and share the FAISS index pages copy-on-write. On a model
+# file change the master reloads and asks gunicorn to replace its workers
+# (SIGHUP), so every worker picks up the new model from the master's memory.
+
+import os
+import signal
+import logging
+import cv2
+import faiss
+from utils.model_state import model_resources, model_lock
+from utils.feature_store import open_feature_store
+from utils.shadow_eval import reopen_shadow_hdf5_after_fork
+
+logger = logging.getLogger(__name__)
+
+# Filled in by gunicorn.conf.py; stays empty when running under `python app.py`.
+serving_state = {
+    "master_pid": None,
+    "match_threads": None,
+}
+
+def mark_gunicorn_master():
+    serving_state["master_pid"] = os.getpid()
+
+def is_gunicorn_master():
+    return serving_state["master_pid"] == os.getpid()
+
+def per_worker_thread_budget(num_workers):
+    return max(1, (os.cpu_count() or 1) // max(1, num_workers))
+
+def apply_thread_budget(num_threads):
+    """Caps OpenCV, FAISS (OpenMP) and candidate-verification threads for this process."""
+    cv2.setNumThreads(num_threads)
+    faiss.omp_set_num_threads(num_threads)
+    serving_state["match_threads"] = num_threads
+
+def reopen_hdf5_after_fork():
+    # HDF5 handles are not meant to be shared across processes; the FAISS index
+    # and ID map stay shared, but each worker reads features through its own handle.
+    with model_lock:
+        hf = model_resources.get("hdf5_file")
+        if hf is not None:
+            model_resources["hdf5_file"] = open_feature_store(hf.filename, 'r')
+    reopen_shadow_hdf5_after_fork()
+
+def init_worker(num_workers):
+    budget = per_worker_thread_budget(num_workers)
+    apply_thread_budget(budget)
+    reopen_hdf5_after_fork()
+    logger.info("Worker %d ready (thread budget=%d)", os.getpid(), budget)
+
+def reload_in_master():
+    """Reloads the model in the gunicorn master, then rotates the workers onto it."""
+    from utils.resource_manager import load_resources
+    from utils.shadow_eval import load_shadow_bundle
+    load_resources()
+    load_shadow_bundle()
+    logger.info("🔁 Model reloaded in gunicorn master; signalling workers to restart.")
+    os.kill(os.getpid(), signal.SIGHUP)
@@ -10,10 +10,15 @@ It also downloads the sets data from Scryfall and upserts that data into a new "
 """
 
 import os
+import json
+import time
+import zlib
 import decimal
 from datetime import datetime, timezone
+from email.utils import formatdate
 
 import requests
+import urllib3
 import psycopg2
 import psycopg2.extras
 import ijson
@@ -284,6 +289,160 @@ def import_sets():
 # ---------------------------
 # DOWNLOAD FUNCTIONS
 # ---------------------------
+CHUNK_BYTES = 1024 * 1024
+DOWNLOAD_RETRIES = 5
+
+def read_json_file(path):
+    """Return the parsed JSON in path, or {} if it is missing or unreadable."""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_json_file(path, data):
+    """Atomically write data as JSON to path."""
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+def fetch_body(url, part_path, state_path, conditional_headers):
+    """
+    Stream the raw (still gzip-encoded) response body into part_path.
+    A partial body left by an interrupted attempt is resumed with a Range request,
+    pinned with If-Range to the ETag it was started with.
+    Returns the response validators, or None if the server answered 304 Not Modified.
+    """
+    state = read_json_file(state_path)
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Accept-Encoding": "gzip", **conditional_headers}
+    if offset and state.get("url") == url and (state.get("etag") or state.get("last_modified")):
+        saved = {k: state.get(k) for k in ("etag", "last_modified", "content_encoding")}
+        if state.get("length") == offset:
+            # Fully downloaded by an earlier run that stopped before decoding.
+            print(f"{part_path} is already complete; decoding it.")
+            return saved
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = state.get("etag") or state["last_modified"]
+    else:
+        offset = 0
+
+    with requests.get(url, headers=headers, stream=True, timeout=(10, 60)) as r:
+        if r.status_code == 304:
+            return None
+        if r.status_code == 416 and offset:
+            # The range starts at or past the end of the file: either the partial
+            # body is complete, or it doesn't match upstream and is restarted.
+            total = r.headers.get("Content-Range", "").rpartition("/")[2]
+            if total == str(offset):
+                print(f"{part_path} is already complete; decoding it.")
+                return saved
+            print(f"{part_path} does not match the upstream file; restarting the download.")
+            for path in (part_path, state_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            r.close()
+            return fetch_body(url, part_path, state_path, conditional_headers)
+        if r.status_code == 206 and offset:
+            print(f"Resuming download from byte {offset}...")
+            validators = saved
+        elif r.status_code == 200:
+            offset = 0
+            validators = {
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+                "content_encoding": r.headers.get("Content-Encoding", "identity").lower(),
+            }
+            expected = r.headers.get("Content-Length")
+            write_json_file(state_path, {"url": url, **validators,
+                                         "length": int(expected) if expected is not None else None})
+        else:
+            raise RuntimeError(f"Failed to download {BULK_DATA_TYPE} JSON: {r.status_code}")
+
+        expected = r.headers.get("Content-Length")
+        with open(part_path, "r+b" if offset else "wb") as f:
+            f.truncate(offset)
+            f.seek(offset)
+            for chunk in r.raw.stream(CHUNK_BYTES, decode_content=False):
+                f.write(chunk)
+            written = f.tell()
+        if expected is not None and written != offset + int(expected):
+            raise RuntimeError(f"Download ended after {written} of {offset + int(expected)} bytes")
+    return validators
+
+def decode_body(part_path, tmp_path, content_encoding):
+    """Decompress the downloaded body into tmp_path one chunk at a time."""
+    if content_encoding not in ("identity", "gzip"):
+        raise RuntimeError(f"Unsupported Content-Encoding: {content_encoding}")
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS) if content_encoding == "gzip" else None
+    with open(part_path, "rb") as src, open(tmp_path, "wb") as out:
+        for chunk in iter(lambda: src.read(CHUNK_BYTES), b""):
+            if decoder is None:
+                out.write(chunk)
+                continue
+            data = decoder.decompress(chunk, CHUNK_BYTES)
+            while data:
+                out.write(data)
+                data = decoder.decompress(decoder.unconsumed_tail, CHUNK_BYTES)
+        if decoder is not None:
+            out.write(decoder.flush())
+            if not decoder.eof:
+                raise RuntimeError("Downloaded body ended before the end of the gzip stream")
+        out.flush()
+        os.fsync(out.fileno())
+
+def download_bulk_file(url, json_file):
+    """
+    Stream url into json_file with bounded memory and replace it atomically.
+    Sends If-None-Match / If-Modified-Since from the previous download and retries
+    interrupted transfers from the last byte on disk.
+    Returns True if json_file was replaced, False if the server reported it unchanged.
+    """
+    part_path = json_file + ".part"
+    state_path = part_path + ".json"
+    meta_path = json_file + ".meta.json"
+
+    conditional_headers = {}
+    if os.path.exists(json_file):
+        meta = read_json_file(meta_path)
+        if meta.get("url") != url:
+            meta = {}
+        if meta.get("etag"):
+            conditional_headers["If-None-Match"] = meta["etag"]
+        conditional_headers["If-Modified-Since"] = meta.get("last_modified") or \
+            formatdate(os.path.getmtime(json_file), usegmt=True)
+
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        try:
+            validators = fetch_body(url, part_path, state_path, conditional_headers)
+            break
+        except (requests.RequestException, urllib3.exceptions.HTTPError, RuntimeError) as e:
+            if attempt == DOWNLOAD_RETRIES:
+                raise
+            print(f"Download interrupted ({e}); retrying...")
+            time.sleep(2 ** attempt)
+
+    if validators is None:
+        for path in (part_path, state_path):
+            if os.path.exists(path):
+                os.remove(path)
+        return False
+
+    tmp_path = json_file + ".tmp"
+    try:
+        decode_body(part_path, tmp_path, validators["content_encoding"])
+    except (zlib.error, RuntimeError):
+        # A corrupt body can't be resumed; start over next time.
+        for path in (part_path, state_path, tmp_path):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    os.replace(tmp_path, json_file)
+    write_json_file(meta_path, {"url": url, "etag": validators["etag"], "last_modified": validators["last_modified"]})
+    os.remove(part_path)
+    os.remove(state_path)
+    return True
+
 def download_latest_json(json_file):
     """
     Checks the Scryfall bulk-data API for the desired JSON file.
@@ -325,15 +484,13 @@ def download_latest_json(json_file):
             return
         print(f"{json_file} is outdated; downloading new version...")
 
-    r = requests.get(download_uri, timeout=10)
-    if r.status_code != 200:
-        raise RuntimeError(f"Failed to download {BULK_DATA_TYPE} JSON: {r.status_code}")
-    
-    with open(json_file, "wb") as f:
-        f.write(r.content)
+    downloaded = download_bulk_file(download_uri, json_file)
     mod_time = server_updated_at.timestamp()
     os.utime(json_file, (mod_time, mod_time))
-    print(f"Downloaded and saved as {json_file} with mtime set to {server_updated_at.isoformat()}")
+    if downloaded:
+        print(f"Downloaded and saved as {json_file} with mtime set to {server_updated_at.isoformat()}")
+    else:
+        print(f"Server reports {json_file} unchanged (304); kept local copy.")
 
 # ---------------------------
 # MAIN FUNCTION
@@ -347,7 +504,7 @@ def main():
     batch_size = 10000
     batch = []
     total_count = 0
-    logger.info("Streaming and processing card JSON file...")
+    print("Streaming and processing card JSON file...")
     with open(json_file, 'rb') as f:
         cards = ijson.items(f, 'item')
         for card in cards:
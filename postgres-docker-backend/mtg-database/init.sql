@@ -99,7 +99,14 @@ CREATE TABLE cards (
     prices JSONB,
     related_uris JSONB,
     purchase_uris JSONB,
-    card_faces JSONB
+    card_faces JSONB,
+    content_hash TEXT,  -- Hash of everything but prices; lets the nightly import skip unchanged cards
+    -- Typed prices for aggregates, kept in sync with the prices JSONB by Postgres
+    price_usd NUMERIC GENERATED ALWAYS AS ((prices->>'usd')::numeric) STORED,
+    price_usd_foil NUMERIC GENERATED ALWAYS AS ((prices->>'usd_foil')::numeric) STORED,
+    price_usd_etched NUMERIC GENERATED ALWAYS AS ((prices->>'usd_etched')::numeric) STORED,
+    price_eur NUMERIC GENERATED ALWAYS AS ((prices->>'eur')::numeric) STORED,
+    price_tix NUMERIC GENERATED ALWAYS AS ((prices->>'tix')::numeric) STORED
 );
 
 -- Drop the sets table if it exists
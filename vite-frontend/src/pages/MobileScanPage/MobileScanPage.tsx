@@ -52,7 +52,11 @@ const MobileScanPage: React.FC = () => {
       });
 
       const json = await res.json();
-      setStatus(res.ok ? 'Scan sent successfully! Awaiting match...' : `Upload error: ${json.error || 'Unknown error'}`);
+      if (res.status === 202) {
+        setStatus(`Hold steady — combining frames (${json.frames})...`);
+      } else {
+        setStatus(res.ok ? 'Scan sent successfully! Awaiting match...' : `Upload error: ${json.error || 'Unknown error'}`);
+      }
     } catch (err) {
       console.error('Upload failed:', err);
       setStatus('Upload failed');